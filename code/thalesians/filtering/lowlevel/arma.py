@@ -0,0 +1,221 @@
+import math
+
+import numpy as np
+import scipy.linalg as la
+
+import thalesians.maths.numpyutils as npu
+from thalesians.filtering.lowlevel.kalman import KalmanFilter, KalmanFilterSeriesData
+from thalesians.maths.constants import MINUS_HALF_LN_2PI
+
+class ARMAKalmanFilter(object):
+    r"""
+The Kalman filter for an ARMA(p, q) process observed with noise,
+
+    y_t = x_t + v_t,    x_t = const + ar[0] * x_{t-1} + ... + ar[p-1] * x_{t-p} + e_t + ma[0] * e_{t-1} + ... + ma[q-1] * e_{t-q},
+
+with e_t ~ N(0, var) and v_t ~ N(0, obsnoisevar), in the companion (Harvey) state space form with procdim = max(p, q+1). The
+transition matrix is a shift with the AR coefficients in its first column, the process noise enters through the single vector
+(1, ma[0], ..., ma[procdim-2]) and the observation picks the first component of the state. The filter uses this structure directly:
+predicting statecov costs O(procdim^2) rather than the O(procdim^3) of a dense
+:class:`thalesians.filtering.lowlevel.kalman.KalmanFilter`, and observing is a rank-one update.
+
+:param ar: The AR coefficients
+:param ma: The MA coefficients
+:param var: The variance of the innovations e_t of the ARMA process
+:param obsnoisevar: The variance of the observation noise v_t (zero if the process is observed exactly)
+:param const: The constant term of the ARMA recursion
+:param state: The initial procdim-dimensional state; by default, the stationary mean
+:param statecov: The initial procdim-by-procdim state covariance; by default, the stationary covariance, which requires the AR
+    part to be stationary
+    """
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Constructor
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, ar, ma=(), var=1., obsnoisevar=0., const=0., state=None, statecov=None):
+        ar = npu.tondim1(np.asarray(ar, dtype=float))
+        ma = npu.tondim1(np.asarray(ma, dtype=float))
+        self.procdim = max(len(ar), len(ma) + 1)
+        self.obsdim = 1
+
+        self.__ar = np.zeros((self.procdim,))
+        self.__ar[:len(ar)] = ar
+        self.__noiseloading = np.zeros((self.procdim,))
+        self.__noiseloading[0] = 1.
+        self.__noiseloading[1:len(ma)+1] = ma
+        self.__var = float(var)
+        self.__obsnoisevar = float(obsnoisevar)
+        self.__const = float(const)
+        self.__procnoisecov = self.__var * np.outer(self.__noiseloading, self.__noiseloading)
+
+        if state is None or statecov is None:
+            procmap = self.procmap
+            if statecov is None:
+                assert np.max(np.abs(np.linalg.eigvals(procmap))) < 1., 'The AR part is not stationary, so statecov must be given'
+                statecov = la.solve_discrete_lyapunov(procmap, self.__procnoisecov)
+            if state is None:
+                state = np.zeros((self.procdim,))
+                if self.__const != 0.: state[0] = self.__const
+                state = np.linalg.solve(np.eye(self.procdim) - procmap, state)
+        self.__state = np.ravel(np.array(state, dtype=float))
+        self.__statecov = np.array(npu.tondim2(statecov), dtype=float)
+        assert np.shape(self.__state) == (self.procdim,), 'The state must be procdim-dimensional'
+        assert np.shape(self.__statecov) == (self.procdim, self.procdim), 'The state covariance must be procdim-by-procdim-dimensional'
+
+        self.predictedobs = None
+        self.innov = None
+        self.innovcov = None
+        self.gain = None
+
+        self.loglikelihood = 0.0
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Structured products
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# With the companion transition matrix, (procmap * matrix)[i,:] = ar[i] * matrix[0,:] + matrix[i+1,:], the last row having no
+# second term, and similarly for the columns of matrix * procmap^T.
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __propagatestate(self, state):
+        result = self.__ar * state[0]
+        result[:-1] += state[1:]
+        result[0] += self.__const
+        return result
+
+    def __propagatestatecov(self, statecov):
+        procmapstatecov = np.outer(self.__ar, statecov[0])
+        procmapstatecov[:-1] += statecov[1:]
+        result = np.outer(procmapstatecov[:,0], self.__ar)
+        result[:,:-1] += procmapstatecov[:,1:]
+        result += self.__procnoisecov
+        return result
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Predict and observe
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def predict(self, **kwargs):
+        self.__state = self.__propagatestate(self.__state)
+        self.__statecov = self.__propagatestatecov(self.__statecov)
+        return self.state
+
+    def observe(self, obs, **kwargs):
+        obs = float(np.ravel(obs)[0])
+        if math.isnan(obs): return self.state
+        self.predictedobs = self.__state[0]
+        self.innov = obs - self.predictedobs
+        self.innovcov = self.__statecov[0,0] + self.__obsnoisevar
+        covobsmapt = self.__statecov[:,0].copy()
+        self.gain = covobsmapt / self.innovcov
+        self.__state = self.__state + self.gain * self.innov
+        self.__statecov = self.__statecov - np.outer(self.gain, covobsmapt)
+        self.loglikelihood += MINUS_HALF_LN_2PI - .5 * (math.log(self.innovcov) + self.innov * self.innov / self.innovcov)
+        return self.state
+
+    def predictAndObserve(self, obs, **kwargs):
+        self.predict(**kwargs)
+        return self.observe(obs, **kwargs)
+
+    def filterseries(self, observations):
+        r"""
+Runs predictAndObserve over every element of the one-dimensional array observations and returns a
+:class:`thalesians.filtering.lowlevel.kalman.KalmanFilterSeriesData`, with the same conventions (NaNs are missing observations) as
+:meth:`thalesians.filtering.lowlevel.kalman.KalmanFilter.filterseries`.
+        """
+        observations = np.ravel(np.asarray(observations, dtype=float))
+        timecount, procdim = len(observations), self.procdim
+
+        states = np.empty((timecount, procdim))
+        statecovs = np.empty((timecount, procdim, procdim))
+        innovs = np.full((timecount, 1), np.nan)
+        innovcovs = np.full((timecount, 1, 1), np.nan)
+        gains = np.full((timecount, procdim, 1), np.nan)
+        loglikelihoods = np.zeros((timecount,))
+        priorstates = np.empty((timecount, procdim))
+        priorstatecovs = np.empty((timecount, procdim, procdim))
+
+        initialstate, initialstatecov = self.__state.copy(), self.__statecov.copy()
+        state, statecov = initialstate, initialstatecov
+        obsnoisevar = self.__obsnoisevar
+        for t in range(timecount):
+            state = self.__propagatestate(state)
+            statecov = self.__propagatestatecov(statecov)
+            priorstates[t] = state
+            priorstatecovs[t] = statecov
+            obs = observations[t]
+            if not math.isnan(obs):
+                innov = obs - state[0]
+                innovcov = statecov[0,0] + obsnoisevar
+                covobsmapt = statecov[:,0].copy()
+                gain = covobsmapt / innovcov
+                state = state + gain * innov
+                statecov = statecov - np.outer(gain, covobsmapt)
+                innovs[t,0] = innov
+                innovcovs[t,0,0] = innovcov
+                gains[t,:,0] = gain
+                loglikelihoods[t] = MINUS_HALF_LN_2PI - .5 * (math.log(innovcov) + innov * innov / innovcov)
+            states[t] = state
+            statecovs[t] = statecov
+
+        self.__state, self.__statecov = state, statecov
+        observed = np.flatnonzero(~np.isnan(observations))
+        if len(observed) > 0:
+            last = observed[-1]
+            self.predictedobs = priorstates[last,0]
+            self.innov = innovs[last,0]
+            self.innovcov = innovcovs[last,0,0]
+            self.gain = gains[last,:,0].copy()
+        self.loglikelihood += np.sum(loglikelihoods)
+
+        return KalmanFilterSeriesData(
+                states=states,
+                statecovs=statecovs,
+                innovs=innovs,
+                innovcovs=innovcovs,
+                gains=gains,
+                loglikelihoods=loglikelihoods,
+                priorstates=priorstates,
+                priorstatecovs=priorstatecovs,
+                initialstate=initialstate,
+                initialstatecov=initialstatecov)
+
+    def tokalmanfilter(self):
+        r"""
+Returns a dense :class:`thalesians.filtering.lowlevel.kalman.KalmanFilter` for the same model, positioned at the same state, for
+use with the code that expects one (such as :func:`thalesians.filtering.lowlevel.smoothing.rtssmooth`, with :attr:`procmap`, or
+:func:`thalesians.filtering.lowlevel.expectationmaximisation.emestimate`).
+        """
+        obsmap = np.zeros((1, self.procdim))
+        obsmap[0,0] = 1.
+        procoffset = np.zeros((self.procdim,))
+        procoffset[0] = self.__const
+        return KalmanFilter(self.__state, self.__statecov, self.__procnoisecov, self.__obsnoisevar, self.procmap, obsmap,
+                procoffset=procoffset, procnoisemap=np.eye(self.procdim), obsnoisemap=np.eye(1))
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Properties
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    @property
+    def procmap(self):
+        r"""The (dense) procdim-by-procdim companion transition matrix"""
+        procmap = np.zeros((self.procdim, self.procdim))
+        procmap[:,0] = self.__ar
+        procmap[:-1,1:] = np.eye(self.procdim - 1)
+        return procmap
+
+    @property
+    def procnoisecov(self): return self.__procnoisecov.copy()
+
+    @property
+    def state(self): return npu.tondim2(self.__state, ndim1tocolumn=True, copy=True)
+
+    @property
+    def statecov(self): return self.__statecov.copy()
+
+    @property
+    def mean(self): return self.state
+
+    @property
+    def var(self): return self.statecov
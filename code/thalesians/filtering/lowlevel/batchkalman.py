@@ -0,0 +1,339 @@
+import numpy as np
+
+from thalesians.filtering.lowlevel.forecasting import ForecastCache
+from thalesians.maths.constants import MINUS_HALF_LN_2PI
+
+def _tostatestack(value, batchsize=None):
+    value = np.array(value, dtype=float, copy=True)
+    if np.ndim(value) == 1:
+        assert batchsize is not None, 'Cannot infer batchsize from a one-dimensional stack'
+        value = np.reshape(value, (batchsize, -1))
+    if np.ndim(value) == 2: value = value[:,:,np.newaxis]
+    assert np.ndim(value) == 3 and np.shape(value)[2] == 1, 'A stack of vectors must be batchsize-by-dim or batchsize-by-dim-by-1'
+    return value
+
+def _tomatrixstack(value, batchsize):
+    value = np.array(value, dtype=float, copy=True)
+    r = np.ndim(value)
+    if r == 0: value = np.reshape(value, (1, 1, 1))
+    elif r == 1: value = np.reshape(value, (np.size(value), 1, 1))
+    elif r == 2: value = value[np.newaxis,:,:]
+    assert np.ndim(value) == 3, 'A stack of matrices must be rows-by-columns or batchsize-by-rows-by-columns'
+    if np.shape(value)[0] == 1 and batchsize != 1:
+        value = np.array(np.broadcast_to(value, (batchsize,) + np.shape(value)[1:]))
+    assert np.shape(value)[0] == batchsize, 'A stack of matrices must have batchsize (%d) elements; it has %d' % (batchsize, np.shape(value)[0])
+    return value
+
+def _tovectorstack(value, batchsize):
+    # A single vector is shared by every filter in the batch; a two-dimensional input is batchsize-by-dim.
+    if np.ndim(value) <= 1:
+        value = np.tile(np.reshape(np.array(value, dtype=float), (1, -1)), (batchsize, 1))
+    return _tostatestack(value, batchsize)
+
+def _transpose(stack):
+    return np.swapaxes(stack, 1, 2)
+
+class BatchKalmanFilter(object):
+    r"""
+A batch of independent Kalman filters, advanced together.
+
+Each quantity of :class:`thalesians.filtering.lowlevel.kalman.KalmanFilter` is held here as a stack whose leading dimension is
+batchsize. Every predict and observe is a single set of batched matrix products and solves over the whole stack, so the cost of a
+tick grows with the arithmetic rather than with the number of Python-level filter objects. A single (rows-by-columns) matrix is
+broadcast to every filter in the batch.
+
+:param state: The batchsize-by-procdim-dimensional initial estimates of the states of the systems
+:param statecov: The batchsize-by-procdim-by-procdim-dimensional a posteriori error covariance matrices
+:param procnoisecov: The (batchsize-by-)procdim-by-procdim-dimensional covariance matrices of the state noise processes
+:param obsnoisecov: The (batchsize-by-)obsdim-by-obsdim-dimensional covariance matrices of the measurement noise processes
+:param procmap: The (batchsize-by-)procdim-by-procdim-dimensional transition matrices
+:param obsmap: The (batchsize-by-)obsdim-by-procdim-dimensional measurement matrices
+:param procoffset: The (batchsize-by-)procdim-dimensional offsets added to the states at the predict step
+:param obsoffset: The (batchsize-by-)obsdim-dimensional offsets added to the predicted observations
+:param procnoisemap: The (batchsize-by-)procdim-by-procdim-dimensional matrices applied to the process noise; identity by default
+:param obsnoisemap: The (batchsize-by-)obsdim-by-obsdim-dimensional matrices applied to the observation noise; identity by default
+    """
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Constructor
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, state, statecov, procnoisecov=None, obsnoisecov=None, procmap=None, obsmap=None, procoffset=None, obsoffset=None, procnoisemap=None, obsnoisemap=None):
+        self.__state = _tostatestack(state)
+        self.batchsize, self.procdim, _ = np.shape(self.__state)
+        self.obsdim = None
+        self.__forecastcache = None
+
+        self.statecov = statecov
+        self.procnoisecov = procnoisecov
+        self.obsnoisecov = obsnoisecov
+        self.procmap = procmap
+        self.obsmap = obsmap
+        self.procoffset = procoffset
+        self.obsoffset = obsoffset
+        self.procnoisemap = procnoisemap
+        self.obsnoisemap = obsnoisemap
+
+        self.predictedobs = None
+        self.innov = None
+        self.innovcov = None
+        self.gain = None
+
+        self.loglikelihood = np.zeros((self.batchsize,))
+
+    @classmethod
+    def fromfilters(cls, filters):
+        r"""
+Stacks a sequence of :class:`thalesians.filtering.lowlevel.kalman.KalmanFilter` objects with the same procdim and obsdim into a
+single batch.
+        """
+        def stack(name):
+            values = [getattr(f, name) for f in filters]
+            if all(v is None for v in values): return None
+            assert all(v is not None for v in values), 'Either all or none of the filters must have %s set' % name
+            return np.array(values)
+        return cls(stack('state'), stack('statecov'), stack('procnoisecov'), stack('obsnoisecov'), stack('procmap'), stack('obsmap'),
+                stack('procoffset'), stack('obsoffset'), stack('procnoisemap'), stack('obsnoisemap'))
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Predict and observe
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def predict(self):
+        assert self.__procnoisecov is not None, 'The process noise covariance is not set'
+
+        if self.__procmap is None:
+            self.__state = self.__state.copy()
+            self.__statecov = self.__statecov.copy()
+        else:
+            self.__state = np.matmul(self.__procmap, self.__state)
+            self.__statecov = np.matmul(np.matmul(self.__procmap, self.__statecov), _transpose(self.__procmap))
+        if self.__procoffset is not None:
+            self.__state += self.__procoffset
+
+        if self.__procnoisemap is None:
+            self.__statecov += self.__procnoisecov
+        else:
+            self.__statecov += np.matmul(np.matmul(self.__procnoisemap, self.__procnoisecov), _transpose(self.__procnoisemap))
+
+        return self.__state
+
+    def observe(self, obs):
+        r"""
+Assimilates one observation per filter. obs is batchsize-by-obsdim (or of length batchsize if obsdim == 1). Filters whose
+observation contains a NaN are treated as having no observation: their states and covariances are left at the prior and their
+log-likelihoods are unchanged.
+        """
+        assert self.__obsnoisecov is not None, 'The covariance matrix obsnoisecov is not set'
+        assert self.__obsmap is not None, 'The measurement matrix obsmap is not set'
+
+        obs = _tostatestack(obs, self.batchsize)
+        assert np.shape(obs)[1] == self.obsdim, 'The observations must be obsdim-dimensional'
+
+        self.predictedobs = np.matmul(self.__obsmap, self.__state)
+        if self.__obsoffset is not None:
+            self.predictedobs += self.__obsoffset
+
+        missing = np.any(np.isnan(obs), axis=(1, 2))
+        havemissing = np.any(missing)
+        if havemissing:
+            obs = np.where(missing[:,np.newaxis,np.newaxis], self.predictedobs, obs)
+
+        covobsmapt = np.matmul(self.__statecov, _transpose(self.__obsmap))
+        self.innovcov = np.matmul(self.__obsmap, covobsmapt)
+        if self.__obsnoisemap is None:
+            self.innovcov += self.__obsnoisecov
+        else:
+            self.innovcov += np.matmul(np.matmul(self.__obsnoisemap, self.__obsnoisecov), _transpose(self.__obsnoisemap))
+
+        self.innov = obs - self.predictedobs
+
+        # Since innovcov is symmetric, gain = statecov obsmap^T innovcov^{-1} solves innovcov gain^T = obsmap statecov. The same
+        # solve is reused for the Mahalanobis term of the log-likelihood.
+        solution = np.linalg.solve(self.innovcov, np.concatenate((_transpose(covobsmapt), self.innov), axis=2))
+        self.gain = _transpose(solution[:,:,:self.procdim])
+        innovsolution = solution[:,:,self.procdim:]
+
+        state = self.__state + np.matmul(self.gain, self.innov)
+        statecov = self.__statecov - np.matmul(self.gain, _transpose(covobsmapt))
+
+        _, logdet = np.linalg.slogdet(self.innovcov)
+        loglikelihood = self.obsdim * MINUS_HALF_LN_2PI - .5 * (logdet + np.sum(self.innov * innovsolution, axis=(1, 2)))
+
+        if havemissing:
+            statecov = np.where(missing[:,np.newaxis,np.newaxis], self.__statecov, statecov)
+            loglikelihood[missing] = 0.
+            self.innov[missing] = np.nan
+
+        self.__state = state
+        self.__statecov = statecov
+        self.loglikelihood += loglikelihood
+
+        return self.__state
+
+    def predictAndObserve(self, obs):
+        self.predict()
+        return self.observe(obs)
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Forecasting
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def forecast(self, horizons):
+        r"""
+As :meth:`thalesians.filtering.lowlevel.kalman.KalmanFilter.forecast`, for every filter in the batch at once: the returned
+states are len(horizons)-by-batchsize-by-procdim, the state covariances len(horizons)-by-batchsize-by-procdim-by-procdim, and so
+on. The powers of the procmap stack and the cumulative noises and offsets are cached until the process model is reassigned.
+        """
+        assert self.__procnoisecov is not None, 'The process noise covariance is not set'
+        if self.__forecastcache is None:
+            procmap = np.broadcast_to(np.eye(self.procdim), (self.batchsize, self.procdim, self.procdim)) if self.__procmap is None else self.__procmap
+            procnoisecov = self.__procnoisecov if self.__procnoisemap is None else \
+                    np.matmul(np.matmul(self.__procnoisemap, self.__procnoisecov), _transpose(self.__procnoisemap))
+            procoffset = np.zeros((self.batchsize, self.procdim)) if self.__procoffset is None else self.__procoffset[:,:,0]
+            self.__forecastcache = ForecastCache(procmap, procnoisecov, procoffset)
+        obsmap, obsoffset, obsnoisecov = None, None, None
+        if self.__obsmap is not None and self.__obsnoisecov is not None:
+            obsmap = self.__obsmap
+            obsoffset = None if self.__obsoffset is None else self.__obsoffset[:,:,0]
+            obsnoisecov = self.__obsnoisecov if self.__obsnoisemap is None else \
+                    np.matmul(np.matmul(self.__obsnoisemap, self.__obsnoisecov), _transpose(self.__obsnoisemap))
+        return self.__forecastcache.forecast(horizons, self.__state[:,:,0], self.__statecov, obsmap, obsoffset, obsnoisecov)
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Properties
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# As in KalmanFilter, the setters coerce their inputs to stacks of the right rank and shape. Vectors are stored as stacks of
+# columns (batchsize-by-dim-by-1), so that they can be fed to the batched matrix products directly.
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __set_obsdim(self, obsdim, name):
+        assert (self.obsdim is None) or (self.obsdim == obsdim), '%s must be consistent with obsdim (%d); got %d' % (name, self.obsdim, obsdim)
+        self.obsdim = obsdim
+
+    def __get_state(self):
+        return self.__state
+
+    def __set_state(self, value):
+        value = _tostatestack(value, self.batchsize)
+        assert np.shape(value) == (self.batchsize, self.procdim, 1), 'The states must be batchsize-by-procdim-dimensional'
+        self.__state = value
+
+    state = property(fget=__get_state, fset=__set_state, doc='The batchsize-by-procdim-by-1-dimensional estimates of the states of the systems')
+
+    def __get_statecov(self):
+        return self.__statecov
+
+    def __set_statecov(self, value):
+        value = _tomatrixstack(value, self.batchsize)
+        assert np.shape(value)[1:] == (self.procdim, self.procdim), 'The state covariances must be procdim-by-procdim-dimensional'
+        self.__statecov = value
+
+    statecov = property(fget=__get_statecov, fset=__set_statecov, doc='The batchsize-by-procdim-by-procdim-dimensional a posteriori error covariance matrices')
+
+    def __get_procnoisecov(self):
+        return self.__procnoisecov
+
+    def __set_procnoisecov(self, value):
+        self.__forecastcache = None
+        if value is not None:
+            value = _tomatrixstack(value, self.batchsize)
+            assert np.shape(value)[1] == np.shape(value)[2], 'The covariance matrices procnoisecov must be square'
+        self.__procnoisecov = value
+
+    procnoisecov = property(fget=__get_procnoisecov, fset=__set_procnoisecov, doc='The batchsize-by-procdim-by-procdim-dimensional covariance matrices of the state noise processes')
+
+    def __get_obsnoisecov(self):
+        return self.__obsnoisecov
+
+    def __set_obsnoisecov(self, value):
+        if value is not None:
+            value = _tomatrixstack(value, self.batchsize)
+            assert np.shape(value)[1] == np.shape(value)[2], 'The covariance matrices obsnoisecov must be square'
+            self.__set_obsdim(np.shape(value)[1], 'obsnoisecov')
+        self.__obsnoisecov = value
+
+    obsnoisecov = property(fget=__get_obsnoisecov, fset=__set_obsnoisecov, doc='The batchsize-by-obsdim-by-obsdim-dimensional covariance matrices of the measurement noise processes')
+
+    def __get_procmap(self):
+        return self.__procmap
+
+    def __set_procmap(self, value):
+        self.__forecastcache = None
+        if value is not None:
+            value = _tomatrixstack(value, self.batchsize)
+            assert np.shape(value)[1:] == (self.procdim, self.procdim), 'The transition matrices procmap must be procdim-by-procdim-dimensional'
+        self.__procmap = value
+
+    procmap = property(fget=__get_procmap, fset=__set_procmap, doc='The batchsize-by-procdim-by-procdim-dimensional transition matrices')
+
+    def __get_obsmap(self):
+        return self.__obsmap
+
+    def __set_obsmap(self, value):
+        if value is not None:
+            value = _tomatrixstack(value, self.batchsize)
+            assert np.shape(value)[2] == self.procdim, 'The measurement matrices obsmap must have procdim (%d) columns; they have %d columns' % (self.procdim, np.shape(value)[2])
+            self.__set_obsdim(np.shape(value)[1], 'obsmap')
+        self.__obsmap = value
+
+    obsmap = property(fget=__get_obsmap, fset=__set_obsmap, doc='The batchsize-by-obsdim-by-procdim-dimensional measurement matrices')
+
+    def __get_procoffset(self):
+        return self.__procoffset
+
+    def __set_procoffset(self, value):
+        self.__forecastcache = None
+        if value is not None:
+            value = _tovectorstack(value, self.batchsize)
+            assert np.shape(value)[1] == self.procdim, 'The offsets procoffset must be procdim-dimensional'
+        self.__procoffset = value
+
+    procoffset = property(fget=__get_procoffset, fset=__set_procoffset)
+
+    def __get_obsoffset(self):
+        return self.__obsoffset
+
+    def __set_obsoffset(self, value):
+        if value is not None:
+            value = _tovectorstack(value, self.batchsize)
+            assert np.shape(value)[1] == self.obsdim, 'The offsets obsoffset must be obsdim-dimensional'
+        self.__obsoffset = value
+
+    obsoffset = property(fget=__get_obsoffset, fset=__set_obsoffset)
+
+    def __get_procnoisemap(self):
+        return self.__procnoisemap
+
+    def __set_procnoisemap(self, value):
+        self.__forecastcache = None
+        if value is not None:
+            value = _tomatrixstack(value, self.batchsize)
+            assert np.shape(value)[1] == self.procdim, 'The matrices procnoisemap must have procdim (%d) rows' % self.procdim
+        self.__procnoisemap = value
+
+    procnoisemap = property(fget=__get_procnoisemap, fset=__set_procnoisemap)
+
+    def __get_obsnoisemap(self):
+        return self.__obsnoisemap
+
+    def __set_obsnoisemap(self, value):
+        if value is not None:
+            value = _tomatrixstack(value, self.batchsize)
+            assert np.shape(value)[1] == self.obsdim, 'The matrices obsnoisemap must have obsdim rows'
+        self.__obsnoisemap = value
+
+    obsnoisemap = property(fget=__get_obsnoisemap, fset=__set_obsnoisemap)
+
+    @property
+    def mean(self): return self.__state
+
+    @property
+    def var(self): return self.__statecov
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Special methods
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'BatchKalmanFilter(batchsize=%s, procdim=%s, obsdim=%s)' % (self.batchsize, self.procdim, self.obsdim)
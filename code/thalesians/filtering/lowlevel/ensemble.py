@@ -0,0 +1,175 @@
+from enum import Enum
+
+import numpy as np
+import scipy.linalg as la
+
+import thalesians.maths.numpyutils as npu
+from thalesians.maths.constants import MINUS_HALF_LN_2PI
+
+class EnsembleUpdate(Enum):
+    # Update every member with the Kalman gain formed from the ensemble covariances and its own perturbed copy of the observation.
+    # Supports covariance localisation:
+    perturbed = 0
+
+    # The ensemble transform Kalman filter: a deterministic square-root update, computed in the ensemblesize-dimensional space of
+    # weights, that gives the ensemble exactly the Kalman posterior mean and (sample) covariance:
+    squareroot = 1
+
+def _noisesampler(cov, dim):
+    # Returns a function of (count, randomstate) that samples count draws of N(0, cov), where cov is a scalar or a vector of
+    # variances (a diagonal covariance, so that nothing of order dim^2 is stored) or a dim-by-dim matrix.
+    if cov is None: return None
+    cov = np.asarray(cov, dtype=float)
+    if np.ndim(cov) < 2:
+        sd = np.broadcast_to(np.sqrt(cov), (dim,))
+        return lambda count, randomstate: randomstate.normal(size=(count, dim)) * sd
+    cholesky = np.linalg.cholesky(cov)
+    return lambda count, randomstate: np.dot(randomstate.normal(size=(count, dim)), cholesky.T)
+
+class EnsembleKalmanFilter(object):
+    r"""
+The ensemble Kalman filter. The distribution of the state is represented by an ensemblesize-by-procdim array of members, and the
+covariances the Kalman update needs are estimated from it, so the memory requirement is O(ensemblesize * procdim) (plus
+O(procdim * obsdim) for the gain with the perturbed update) rather than O(procdim^2).
+
+:param ensemble: The initial ensemblesize-by-procdim ensemble
+:param procfunc: A vectorised transition function, taking the ensemblesize-by-procdim ensemble and returning the propagated one.
+    It may add noise itself; the noise given by procnoisecov is added on top
+:param obsfunc: Either a vectorised observation function, taking the ensemblesize-by-procdim ensemble and returning the
+    ensemblesize-by-obsdim predicted observations, or an obsdim-by-procdim matrix
+:param obsnoisecov: The observation noise covariance: an obsdim-by-obsdim matrix, or a vector of variances (or a scalar) for a
+    diagonal one
+:param procnoisecov: The additive process noise covariance, in the same forms as obsnoisecov; None for no additive noise
+:param updatemethod: An :class:`EnsembleUpdate`
+:param localisation: Only with EnsembleUpdate.perturbed: a pair (procobslocalisation, obsobslocalisation) of procdim-by-obsdim and
+    obsdim-by-obsdim tapering matrices, which multiply the ensemble estimates of the state-observation and observation-observation
+    covariances elementwise
+:param inflation: The factor by which the deviations of the members from the ensemble mean are multiplied after each predict
+:param randomstate: The random state used for the noises
+    """
+
+    def __init__(self, ensemble, procfunc, obsfunc, obsnoisecov, procnoisecov=None, updatemethod=EnsembleUpdate.squareroot, localisation=None, inflation=1., randomstate=None):
+        self.__ensemble = np.array(ensemble, dtype=float)
+        assert np.ndim(self.__ensemble) == 2, 'The ensemble must be ensemblesize-by-procdim-dimensional'
+        self.ensemblesize, self.procdim = np.shape(self.__ensemble)
+        assert self.ensemblesize > 1, 'The ensemble must have at least two members'
+        self.__procfunc = procfunc
+        self.__obsfunc = obsfunc if callable(obsfunc) else (lambda obsmap: lambda ensemble: np.dot(ensemble, obsmap.T))(npu.tondim2(obsfunc))
+        self.__obsnoisecov = np.asarray(obsnoisecov, dtype=float)
+        self.__procnoisesampler = _noisesampler(procnoisecov, self.procdim)
+        self.updatemethod = updatemethod
+        assert localisation is None or updatemethod == EnsembleUpdate.perturbed, 'Localisation requires EnsembleUpdate.perturbed'
+        self.__localisation = localisation
+        self.inflation = inflation
+        self.__randomstate = npu.getrandomstate() if randomstate is None else randomstate
+
+        self.predictedobs = None
+        self.innov = None
+        self.innovcov = None
+
+        self.loglikelihood = 0.0
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Predict and observe
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def predict(self):
+        ensemble = np.asarray(self.__procfunc(self.__ensemble), dtype=float)
+        if self.__procnoisesampler is not None:
+            ensemble = ensemble + self.__procnoisesampler(self.ensemblesize, self.__randomstate)
+        if self.inflation != 1.:
+            mean = np.mean(ensemble, axis=0)
+            ensemble = mean + self.inflation * (ensemble - mean)
+        self.__ensemble = ensemble
+        return self.state
+
+    def observe(self, obs):
+        r"""
+Assimilates the obsdim-dimensional observation obs. NaN components are left out of the update.
+        """
+        obs = np.ravel(np.asarray(obs, dtype=float))
+        predictedobs = np.asarray(self.__obsfunc(self.__ensemble), dtype=float)
+        if np.ndim(predictedobs) == 1: predictedobs = predictedobs[:,np.newaxis]
+        obsnoisecov = self.__obsnoisecov
+        if np.ndim(obsnoisecov) < 2: obsnoisecov = np.diag(np.broadcast_to(obsnoisecov, (len(obs),)))
+        localisation = self.__localisation
+
+        keep = ~np.isnan(obs)
+        if not np.all(keep):
+            if not np.any(keep): return self.state
+            obs, predictedobs, obsnoisecov = obs[keep], predictedobs[:,keep], obsnoisecov[np.ix_(keep, keep)]
+            if localisation is not None: localisation = (localisation[0][:,keep], localisation[1][np.ix_(keep, keep)])
+
+        mean = np.mean(self.__ensemble, axis=0)
+        deviations = self.__ensemble - mean
+        self.predictedobs = np.mean(predictedobs, axis=0)
+        obsdeviations = predictedobs - self.predictedobs
+        self.innov = obs - self.predictedobs
+        scale = 1. / (self.ensemblesize - 1)
+
+        obscov = scale * np.dot(obsdeviations.T, obsdeviations)
+        if localisation is not None: obscov *= localisation[1]
+        self.innovcov = obscov + obsnoisecov
+        cholesky = la.cho_factor(self.innovcov, lower=True, check_finite=False)
+        logdet = 2. * np.sum(np.log(np.diagonal(cholesky[0])))
+        self.loglikelihood += len(obs) * MINUS_HALF_LN_2PI - .5 * (logdet + np.dot(self.innov, la.cho_solve(cholesky, self.innov, check_finite=False)))
+
+        if self.updatemethod == EnsembleUpdate.perturbed:
+            covobs = scale * np.dot(deviations.T, obsdeviations)
+            if localisation is not None: covobs *= localisation[0]
+            perturbedobs = obs + _noisesampler(obsnoisecov, len(obs))(self.ensemblesize, self.__randomstate)
+            # Each member moves by gain * (perturbed observation - predicted observation); gain^T = innovcov^{-1} * covobs^T.
+            self.__ensemble = self.__ensemble + np.dot(la.cho_solve(cholesky, (perturbedobs - predictedobs).T, check_finite=False).T, covobs.T)
+        else:
+            # Hunt, Kostelich and Szunyogh (2007): with C = obsdeviations * obsnoisecov^{-1}, the analysis weights have covariance
+            # [(ensemblesize - 1) I + C * obsdeviations^T]^{-1}.
+            obsnoisecholesky = la.cho_factor(obsnoisecov, lower=True, check_finite=False)
+            c = la.cho_solve(obsnoisecholesky, obsdeviations.T, check_finite=False).T
+            eigvals, eigvecs = np.linalg.eigh((self.ensemblesize - 1) * np.eye(self.ensemblesize) + np.dot(c, obsdeviations.T))
+            weightcov = np.dot(eigvecs / eigvals, eigvecs.T)
+            meanweights = np.dot(weightcov, np.dot(c, self.innov))
+            weights = np.dot(eigvecs * np.sqrt((self.ensemblesize - 1) / eigvals), eigvecs.T)
+            self.__ensemble = mean + np.dot((meanweights[:,np.newaxis] + weights).T, deviations)
+
+        return self.state
+
+    def predictAndObserve(self, obs):
+        self.predict()
+        return self.observe(obs)
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Properties
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __get_ensemble(self):
+        return self.__ensemble
+
+    def __set_ensemble(self, value):
+        value = np.array(value, dtype=float)
+        assert np.shape(value) == (self.ensemblesize, self.procdim), 'The ensemble must be ensemblesize-by-procdim-dimensional'
+        self.__ensemble = value
+
+    ensemble = property(fget=__get_ensemble, fset=__set_ensemble, doc='The ensemblesize-by-procdim ensemble')
+
+    def __get_state(self):
+        return npu.tondim2(np.mean(self.__ensemble, axis=0), ndim1tocolumn=True)
+
+    state = property(fget=__get_state, doc='The procdim-dimensional (column) ensemble mean')
+
+    def __get_statecov(self):
+        return np.cov(self.__ensemble, rowvar=False, ddof=1).reshape((self.procdim, self.procdim))
+
+    statecov = property(fget=__get_statecov, doc='The procdim-by-procdim ensemble covariance, formed on demand')
+
+    @property
+    def mean(self): return self.state
+
+    @property
+    def var(self): return self.statecov
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Special methods
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'EnsembleKalmanFilter(ensemblesize=%s, procdim=%s, updatemethod=%s)' % (self.ensemblesize, self.procdim, self.updatemethod)
@@ -0,0 +1,119 @@
+from collections import namedtuple
+import warnings
+
+import numpy as np
+
+from thalesians.filtering.lowlevel.kalman import KalmanFilter
+from thalesians.filtering.lowlevel.smoothing import rtssmooth
+
+class EMResult(namedtuple('EMResult', (
+        'kalmanfilter',
+        'loglikelihoods',
+        'converged'))):
+    r"""
+The output of :func:`emestimate`: a :class:`thalesians.filtering.lowlevel.kalman.KalmanFilter` carrying the estimated system
+matrices and positioned at the initial state, the log-likelihood of the observations at the start of each iteration, and whether
+the log-likelihood converged within the allowed number of iterations.
+    """
+    __slots__ = ()
+
+ESTIMABLES = ('procmap', 'procnoisecov', 'obsmap', 'obsnoisecov', 'initialstate')
+
+def _isidentityornone(matrix):
+    return matrix is None or (np.shape(matrix)[0] == np.shape(matrix)[1] and np.allclose(matrix, np.eye(np.shape(matrix)[0])))
+
+def emestimate(kalmanfilter, observations, estimate=('procmap', 'procnoisecov', 'obsmap', 'obsnoisecov'), maxiterations=100, tol=1e-8):
+    r"""
+Estimates the system matrices of a linear-Gaussian state space model by expectation-maximisation.
+
+kalmanfilter supplies the initial guess: its procmap, procnoisecov, obsmap and obsnoisecov are the starting values, its state
+and statecov are the distribution of the initial state, and its procoffset and obsoffset, which are held fixed, are included in
+the model. Its procnoisemap and obsnoisemap must be unset (or identities). estimate lists which of :data:`ESTIMABLES` to update;
+'initialstate' updates the mean and covariance of the initial state.
+
+Each iteration is one forward pass of :meth:`thalesians.filtering.lowlevel.kalman.KalmanFilter.filterseries` and one backward
+pass of :func:`thalesians.filtering.lowlevel.smoothing.rtssmooth`, from which the smoothed sufficient statistics are formed and
+the parameters updated in closed form. Iteration stops when the log-likelihood improves by less than tol * (1 + |log-likelihood|).
+Rows of observations containing a NaN are treated as missing.
+    """
+    assert all(e in ESTIMABLES for e in estimate), 'Can only estimate %s' % (ESTIMABLES,)
+    assert _isidentityornone(kalmanfilter.procnoisemap) and _isidentityornone(kalmanfilter.obsnoisemap), 'procnoisemap and obsnoisemap must be unset'
+
+    observations = np.asarray(observations, dtype=float)
+    if np.ndim(observations) == 1: observations = observations[:,np.newaxis]
+    timecount = np.shape(observations)[0]
+    observed = ~np.isnan(observations).any(axis=1)
+    assert np.any(observed), 'There are no observations'
+
+    procdim = kalmanfilter.procdim
+    procmap = np.eye(procdim) if kalmanfilter.procmap is None else kalmanfilter.procmap.copy()
+    procnoisecov = kalmanfilter.procnoisecov.copy()
+    obsmap = kalmanfilter.obsmap.copy()
+    obsnoisecov = kalmanfilter.obsnoisecov.copy()
+    procoffset = np.zeros((procdim,)) if kalmanfilter.procoffset is None else np.ravel(kalmanfilter.procoffset)
+    obsoffset = np.zeros((kalmanfilter.obsdim,)) if kalmanfilter.obsoffset is None else np.ravel(kalmanfilter.obsoffset)
+    initialstate = kalmanfilter.state.copy()
+    initialstatecov = kalmanfilter.statecov.copy()
+
+    def makefilter():
+        return KalmanFilter(initialstate, initialstatecov, procnoisecov, obsnoisecov, procmap, obsmap, kalmanfilter.procoffset, kalmanfilter.obsoffset)
+
+    loglikelihoods = []
+    converged = False
+    for _ in range(maxiterations):
+        seriesdata = makefilter().filterseries(observations)
+        loglikelihood = np.sum(seriesdata.loglikelihoods)
+        if len(loglikelihoods) > 0:
+            improvement = loglikelihood - loglikelihoods[-1]
+            if improvement < -tol * (1. + abs(loglikelihood)):
+                warnings.warn('The log-likelihood decreased from %f to %f' % (loglikelihoods[-1], loglikelihood))
+            loglikelihoods.append(loglikelihood)
+            if abs(improvement) < tol * (1. + abs(loglikelihood)):
+                converged = True
+                break
+        else:
+            loglikelihoods.append(loglikelihood)
+
+        smoothed = rtssmooth(seriesdata, procmap)
+
+        # The smoothed sufficient statistics, E[x_t x_t^T], E[x_t x_{t-1}^T] and E[x_{t-1} x_{t-1}^T], where x_{-1} is the
+        # initial state.
+        states = smoothed.states
+        previousstates = np.concatenate((smoothed.initialstate[np.newaxis,:], states[:-1]))
+        previousstatecovs = np.concatenate((smoothed.initialstatecov[np.newaxis,:,:], smoothed.statecovs[:-1]))
+        statemoments = smoothed.statecovs + np.einsum('ti,tj->tij', states, states)
+        sumstatemoment = np.sum(statemoments, axis=0)
+        sumlagonemoment = np.sum(smoothed.lagonecovs, axis=0) + np.dot(states.T, previousstates)
+        sumpreviousstatemoment = np.sum(previousstatecovs, axis=0) + np.dot(previousstates.T, previousstates)
+
+        # The state equation, with z_t = x_t - procoffset.
+        sumstates = np.sum(states, axis=0)
+        sumpreviousstates = np.sum(previousstates, axis=0)
+        sumcentredmoment = sumstatemoment - np.outer(procoffset, sumstates) - np.outer(sumstates, procoffset) + timecount * np.outer(procoffset, procoffset)
+        sumcentredlagonemoment = sumlagonemoment - np.outer(procoffset, sumpreviousstates)
+        if 'procmap' in estimate:
+            procmap = np.linalg.solve(sumpreviousstatemoment, sumcentredlagonemoment.T).T
+        if 'procnoisecov' in estimate:
+            procmaplagonemoment = np.dot(procmap, sumcentredlagonemoment.T)
+            procnoisecov = (sumcentredmoment - procmaplagonemoment - procmaplagonemoment.T +
+                    np.dot(np.dot(procmap, sumpreviousstatemoment), procmap.T)) / timecount
+            procnoisecov = .5 * (procnoisecov + procnoisecov.T)
+
+        # The observation equation, with u_t = y_t - obsoffset, over the observed times only.
+        centredobservations = observations[observed] - obsoffset
+        observedstates = states[observed]
+        sumobservedstatemoment = np.sum(statemoments[observed], axis=0)
+        sumobsstatemoment = np.dot(centredobservations.T, observedstates)
+        if 'obsmap' in estimate:
+            obsmap = np.linalg.solve(sumobservedstatemoment, sumobsstatemoment.T).T
+        if 'obsnoisecov' in estimate:
+            obsmapstatemoment = np.dot(obsmap, sumobsstatemoment.T)
+            obsnoisecov = (np.dot(centredobservations.T, centredobservations) - obsmapstatemoment - obsmapstatemoment.T +
+                    np.dot(np.dot(obsmap, sumobservedstatemoment), obsmap.T)) / np.sum(observed)
+            obsnoisecov = .5 * (obsnoisecov + obsnoisecov.T)
+
+        if 'initialstate' in estimate:
+            initialstate = smoothed.initialstate
+            initialstatecov = smoothed.initialstatecov
+
+    return EMResult(kalmanfilter=makefilter(), loglikelihoods=np.array(loglikelihoods), converged=converged)
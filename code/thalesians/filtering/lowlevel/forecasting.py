@@ -0,0 +1,65 @@
+from collections import namedtuple
+
+import numpy as np
+
+class KalmanForecast(namedtuple('KalmanForecast', (
+        'horizons',
+        'states',
+        'statecovs',
+        'obs',
+        'obscovs'))):
+    r"""
+The output of :meth:`thalesians.filtering.lowlevel.kalman.KalmanFilter.forecast` and
+:meth:`thalesians.filtering.lowlevel.batchkalman.BatchKalmanFilter.forecast`: for each of the horizons, the mean and covariance of
+the state and of the observation that many steps ahead. The leading dimension of each array is the horizon index; for a batch of
+filters the next one is the batch index. obs and obscovs are None if the filter has no observation model.
+    """
+    __slots__ = ()
+
+def _transpose(stack):
+    return np.swapaxes(stack, -1, -2)
+
+class ForecastCache(object):
+    r"""
+The powers procmap^h of the transition matrix of a time-invariant model, together with the cumulative process noise
+sum_{i<h} procmap^i * procnoisecov * (procmap^i)^T and the cumulative offset sum_{i<h} procmap^i * procoffset, for h = 0, 1, ...,
+extended on demand. The h-step-ahead state mean is then procmap^h * state plus the cumulative offset, and its covariance
+procmap^h * statecov * (procmap^h)^T plus the cumulative noise, so forecasting from many states costs a few batched products per
+horizon rather than h predicts. procmap and procnoisecov may be stacks (..., procdim, procdim) and procoffset a stack (..., procdim)
+for a batch of models.
+    """
+
+    def __init__(self, procmap, procnoisecov, procoffset):
+        self.__procmap = procmap
+        self.__procnoisecov = procnoisecov
+        self.__procoffset = procoffset
+        procdim = np.shape(procmap)[-1]
+        self.__powers = [np.broadcast_to(np.eye(procdim), np.shape(procmap))]
+        self.__noisesums = [np.zeros(np.shape(procmap))]
+        self.__offsetsums = [np.zeros(np.shape(procoffset))]
+
+    def __extend(self, maxhorizon):
+        procmap, procmapt = self.__procmap, _transpose(self.__procmap)
+        while len(self.__powers) <= maxhorizon:
+            self.__powers.append(np.matmul(procmap, self.__powers[-1]))
+            self.__noisesums.append(np.matmul(np.matmul(procmap, self.__noisesums[-1]), procmapt) + self.__procnoisecov)
+            self.__offsetsums.append(np.matmul(procmap, self.__offsetsums[-1][...,np.newaxis])[...,0] + self.__procoffset)
+
+    def forecast(self, horizons, state, statecov, obsmap=None, obsoffset=None, obsnoisecov=None):
+        r"""
+Returns the :class:`KalmanForecast` from state, of shape (..., procdim), and statecov, of shape (..., procdim, procdim), for the
+nonnegative integer horizons. If obsmap is given, so must be obsnoisecov (the effective observation noise covariance); obsoffset
+is optional.
+        """
+        horizons = np.ravel(np.asarray(horizons, dtype=int))
+        assert np.all(horizons >= 0), 'The horizons must be nonnegative'
+        if len(horizons) > 0: self.__extend(np.max(horizons))
+        powers = np.array([self.__powers[h] for h in horizons])
+        states = np.matmul(powers, state[...,np.newaxis])[...,0] + np.array([self.__offsetsums[h] for h in horizons])
+        statecovs = np.matmul(np.matmul(powers, statecov), _transpose(powers)) + np.array([self.__noisesums[h] for h in horizons])
+        obs, obscovs = None, None
+        if obsmap is not None:
+            obs = np.matmul(obsmap, states[...,np.newaxis])[...,0]
+            if obsoffset is not None: obs += obsoffset
+            obscovs = np.matmul(np.matmul(obsmap, statecovs), _transpose(obsmap)) + obsnoisecov
+        return KalmanForecast(horizons=horizons, states=states, statecovs=statecovs, obs=obs, obscovs=obscovs)
@@ -0,0 +1,228 @@
+import itertools
+import warnings
+
+import numpy as np
+import scipy.linalg as la
+
+from thalesians.maths.nearpd import RepairStrategy, repairedcholesky
+import thalesians.maths.numpyutils as npu
+from thalesians.maths.constants import MINUS_HALF_LN_2PI
+
+class PointSet(object):
+    r"""
+A deterministic rule for the Gaussian integrals of a nonlinear Gaussian filter: a set of points z_j in R^n, with mean weights Wm and
+covariance weights Wc, standing for N(0, I). The points for N(mean, cov) are mean + sqrtcov * z_j, where sqrtcov * sqrtcov^T = cov.
+The standard points and their weights depend only on n and are computed once for each n.
+    """
+
+    def __init__(self):
+        self.__unitpoints = {}
+
+    def _unitpoints(self, n):
+        raise NotImplementedError('Pure virtual method')
+
+    def unitpoints(self, n):
+        r"""
+Returns the n-by-pointcount matrix Z of the points for N(0, I) and their (read-only) weights Wm and Wc.
+        """
+        unitpoints = self.__unitpoints.get(n)
+        if unitpoints is None:
+            unitpoints = tuple(npu.immutablecopyof(np.asarray(a, dtype=float)) for a in self._unitpoints(n))
+            self.__unitpoints[n] = unitpoints
+        return unitpoints
+
+    def points(self, mean, sqrtcov):
+        r"""
+Returns the n-by-pointcount matrix X whose columns are the points for the mean and the covariance sqrtcov * sqrtcov^T, and their
+weights Wm and Wc. mean may be a B-by-n stack of means and sqrtcov a B-by-n-by-n stack of factors, X then being
+B-by-n-by-pointcount.
+        """
+        sqrtcov = np.asarray(sqrtcov, dtype=float)
+        n = np.shape(sqrtcov)[-1]
+        Z, Wm, Wc = self.unitpoints(n)
+        mean = np.reshape(np.asarray(mean, dtype=float), np.shape(sqrtcov)[:-2] + (n, 1))
+        return mean + np.matmul(sqrtcov, Z), Wm, Wc
+
+class CubaturePointSet(PointSet):
+    r"""
+The third-degree spherical-radial cubature rule of the cubature Kalman filter [Arasaratnam-2009]_: the 2n points +/- sqrt(n) e_i,
+all with weight 1/(2n). It integrates polynomials of degree up to three exactly and, unlike the unscented rule with more than three
+dimensions, has no negative weights.
+    """
+
+    def _unitpoints(self, n):
+        Z = np.sqrt(n) * np.hstack((np.eye(n), -np.eye(n)))
+        W = np.full(2*n, 1. / (2*n))
+        return Z, W, W
+
+    def __str__(self):
+        return 'CubaturePointSet()'
+
+class GaussHermitePointSet(PointSet):
+    r"""
+The tensor-product Gauss-Hermite rule of the given order: the order^n points whose coordinates are the nodes of the
+one-dimensional order-point Gauss-Hermite rule for N(0, 1), weighted by the products of the one-dimensional weights. It integrates
+polynomials of degree up to 2 * order - 1 in each coordinate exactly, at a cost that grows exponentially with n, so it suits
+low-dimensional (augmented) states.
+    """
+
+    def __init__(self, order=3):
+        super(GaussHermitePointSet, self).__init__()
+        assert order > 0, 'The order must be positive'
+        self.order = order
+        nodes, weights = np.polynomial.hermite_e.hermegauss(order)
+        self.__nodes, self.__weights = nodes, weights / np.sum(weights)
+
+    def _unitpoints(self, n):
+        Z = np.array(list(itertools.product(self.__nodes, repeat=n))).T
+        W = np.prod(np.array(list(itertools.product(self.__weights, repeat=n))), axis=1)
+        return Z, W, W
+
+    def __str__(self):
+        return 'GaussHermitePointSet(order=%d)' % self.order
+
+def pointTransform(X, Wm, Wc, f):
+    r"""
+Propagates the points, the columns of X, through the vectorised function f, called once on the whole of X, and returns their images
+Y, the weighted mean of Y and its weighted covariance. X may also be a stack of point matrices, as returned by
+:meth:`PointSet.points`.
+    """
+    Y = np.asarray(f(X), dtype=float)
+    if np.ndim(Y) < 2: Y = npu.tondim2(Y)
+    Ymean = np.matmul(Y, Wm)
+    meanAdjustedY = Y - Ymean[...,np.newaxis]
+    Ycov = np.matmul(meanAdjustedY * Wc, np.swapaxes(meanAdjustedY, -1, -2))
+    return Y, Ymean, Ycov
+
+class GaussianFilter(object):
+    r"""
+The nonlinear Gaussian (assumed density) filter for the system
+
+    x_t = f(x_{t-1}, w_t),    y_t = h(x_t, v_t),
+
+where w_t ~ N(0, Q) and v_t ~ N(0, R) may be correlated with each other (as in a stochastic volatility model with leverage). The
+Gaussian integrals of the predict and observe steps are evaluated with a deterministic :class:`PointSet`. The choice of the point
+set trades accuracy for speed explicitly: :class:`CubaturePointSet` gives the cubature Kalman filter,
+:class:`GaussHermitePointSet` the Gauss-Hermite filter, and :class:`thalesians.filtering.lowlevel.unscented.UnscentedPointSet` the
+unscented Kalman filter. The noises are handled by augmentation: predict draws the points of (x_{t-1}, w_t, v_t) and carries forward
+the covariance of the predicted state with v_t, and observe draws the points of (x_t, v_t).
+
+f and h are called once per step, on the whole point matrices, whose columns are the points: f(x, w), with x of shape (n, k) and w
+of shape (q, k), must return the n-by-k matrix of the propagated states, and h(x, v), with v of shape (r, k), the m-by-k matrix of
+the observations. Scalar models written with numpy operations, such as f = lambda x, w: a + b * x + c * w, are vectorised as they
+stand.
+
+:param x0: The initial n-dimensional estimate of the state
+:param P0: The initial n-by-n covariance of the state
+:param Q: The q-by-q covariance of the process noise w_t
+:param R: The r-by-r covariance of the observation noise v_t
+:param cor: The q-by-r cross-covariance of w_t and v_t (with unit Q and R, their correlation)
+:param f: The transition function
+:param h: The observation function
+:param pointset: The :class:`PointSet`
+:param repairstrategy: The :class:`thalesians.maths.nearpd.RepairStrategy` applied to a covariance matrix that turns out not to be
+    positive definite
+    """
+
+    def __init__(self, x0, P0, Q, R, cor, f, h, pointset=None, repairstrategy=RepairStrategy.jitter):
+        self.__x = np.array(npu.tondim2(x0, ndim1tocolumn=True), dtype=float)
+        self.__P = np.array(npu.tondim2(P0), dtype=float)
+        self.Q = np.array(npu.tondim2(Q), dtype=float)
+        self.R = np.array(npu.tondim2(R), dtype=float)
+        self.n, self.q, self.r = np.shape(self.__x)[0], np.shape(self.Q)[0], np.shape(self.R)[0]
+        self.cor = np.reshape(np.array(cor, dtype=float), (self.q, self.r))
+        assert np.shape(self.__P) == (self.n, self.n), 'P0 must be n-by-n-dimensional'
+        assert np.shape(self.Q) == (self.q, self.q) and np.shape(self.R) == (self.r, self.r), 'Q and R must be square'
+        self.pointset = CubaturePointSet() if pointset is None else pointset
+        self.repairstrategy = repairstrategy
+
+        n, q = self.n, self.q
+        self.fa = lambda X: f(X[...,:n,:], X[...,n:n+q,:])
+        self.ha = lambda X: h(X[...,:n,:], X[...,n:,:])
+        self.__noisecov = np.vstack((np.hstack((self.Q, self.cor)), np.hstack((self.cor.T, self.R))))
+        self.__noisecovcholesky = None
+        # The covariance of the state with the observation noise v_t that will accompany it.
+        self.__Pxv = np.zeros((self.n, self.r))
+
+        self.lastobservation = np.nan
+        self.predictedobservation = np.nan
+        self.innov = np.nan
+        self.innovcov = np.nan
+        self.gain = np.nan
+
+        self.loglikelihood = 0.0
+
+    def __cholesky(self, cov, step):
+        try:
+            return np.linalg.cholesky(cov)
+        except np.linalg.LinAlgError:
+            warnings.warn('Encountered a matrix that is not positive definite in the points calculation at the %s step' % step)
+            return repairedcholesky(cov, self.repairstrategy)
+
+    def predict(self):
+        n, q = self.n, self.q
+        xa = np.concatenate((self.__x[:,0], np.zeros(q + self.r)))
+        # The augmented covariance is block diagonal, and so is its Cholesky factor; that of the noises is computed once.
+        if self.__noisecovcholesky is None:
+            self.__noisecovcholesky = self.__cholesky(self.__noisecov, 'predict')
+        X, Wm, Wc = self.pointset.points(xa, la.block_diag(self.__cholesky(self.__P, 'predict'), self.__noisecovcholesky))
+        fX, x, Pxx = pointTransform(X, Wm, Wc, self.fa)
+        # The points of v_t are centred at zero, so they are their own deviations from the mean.
+        self.__Pxv = np.dot((fX - x[:,np.newaxis]) * Wc, X[n+q:].T)
+        self.__x = x[:,np.newaxis]
+        self.__P = Pxx
+        return self.state
+
+    def observe(self, y):
+        r"""
+Assimilates the m-dimensional observation y. NaN components are left out of the update.
+        """
+        self.lastobservation = y
+        y = np.ravel(np.asarray(y, dtype=float))
+        keep = ~np.isnan(y)
+        if not np.any(keep): return self.state
+
+        n = self.n
+        xa = np.concatenate((self.__x[:,0], np.zeros(self.r)))
+        Pa = np.vstack((np.hstack((self.__P, self.__Pxv)), np.hstack((self.__Pxv.T, self.R))))
+        X, Wm, Wc = self.pointset.points(xa, self.__cholesky(Pa, 'observe'))
+        hX, predictedobservation, Pyy = pointTransform(X, Wm, Wc, self.ha)
+        if not np.all(keep):
+            y, hX, predictedobservation, Pyy = y[keep], hX[keep], predictedobservation[keep], Pyy[np.ix_(keep, keep)]
+        # The image of h is reused for the cross-covariance of the state and the observation.
+        Pxy = np.dot((X[:n] - self.__x) * Wc, (hX - predictedobservation[:,np.newaxis]).T)
+
+        self.predictedobservation = predictedobservation[:,np.newaxis]
+        self.innov = (y - predictedobservation)[:,np.newaxis]
+        self.innovcov = Pyy
+        cholesky = la.cho_factor(Pyy, lower=True, check_finite=False)
+        self.gain = la.cho_solve(cholesky, Pxy.T, check_finite=False).T
+
+        self.__x = self.__x + np.dot(self.gain, self.innov)
+        self.__P = self.__P - np.dot(self.gain, Pxy.T)
+        # v_t has now been observed; the noise of any further observation before the next predict is independent of the state.
+        self.__Pxv = np.zeros((self.n, self.r))
+
+        logdet = 2. * np.sum(np.log(np.diagonal(cholesky[0])))
+        mahalanobis = np.sum(self.innov * la.cho_solve(cholesky, self.innov, check_finite=False))
+        self.loglikelihood += len(y) * MINUS_HALF_LN_2PI - .5 * (logdet + mahalanobis)
+        return self.state
+
+    def predictAndObserve(self, y):
+        self.predict()
+        return self.observe(y)
+
+    @property
+    def state(self): return self.__x.copy()
+
+    @property
+    def statecov(self): return self.__P.copy()
+
+    @property
+    def mean(self): return self.state
+
+    @property
+    def var(self): return self.statecov
+
+    def __str__(self):
+        return '%s(n=%s, q=%s, r=%s, pointset=%s)' % (type(self).__name__, self.n, self.q, self.r, self.pointset)
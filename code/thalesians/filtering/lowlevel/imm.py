@@ -0,0 +1,121 @@
+import numpy as np
+import scipy.special
+
+import thalesians.maths.numpyutils as npu
+from thalesians.filtering.lowlevel.batchkalman import BatchKalmanFilter
+
+class IMMFilter(object):
+    r"""
+The interacting multiple model (IMM) filter for a linear-Gaussian system that switches between modelcount regimes according to
+a Markov chain.
+
+The regimes are the filters of a :class:`thalesians.filtering.lowlevel.batchkalman.BatchKalmanFilter`, so each tick is one Markov
+mixing of the stacked states and covariances followed by one batched predict and one batched observe, whatever the number of
+regimes.
+
+:param models: A :class:`thalesians.filtering.lowlevel.batchkalman.BatchKalmanFilter` of batchsize modelcount, or a sequence of
+    :class:`thalesians.filtering.lowlevel.kalman.KalmanFilter` objects to be stacked into one. Their states and covariances are
+    the initial regime-conditional estimates
+:param transitionmatrix: The modelcount-by-modelcount matrix whose (i, j)-th element is the probability of switching from regime
+    i to regime j from one time step to the next
+:param modelprobs: The initial regime probabilities; uniform by default
+    """
+
+    def __init__(self, models, transitionmatrix, modelprobs=None):
+        self.__models = models if isinstance(models, BatchKalmanFilter) else BatchKalmanFilter.fromfilters(models)
+        self.modelcount = self.__models.batchsize
+        self.procdim = self.__models.procdim
+        self.__transitionmatrix = npu.immutablecopyof(npu.tondim2(np.asarray(transitionmatrix, dtype=float)))
+        assert np.shape(self.__transitionmatrix) == (self.modelcount, self.modelcount), 'The transition matrix must be modelcount-by-modelcount'
+        assert np.allclose(np.sum(self.__transitionmatrix, axis=1), 1.), 'The rows of the transition matrix must sum to one'
+        self.__modelprobs = np.full((self.modelcount,), 1. / self.modelcount) if modelprobs is None else np.array(np.ravel(modelprobs), dtype=float)
+        assert np.shape(self.__modelprobs) == (self.modelcount,), 'There must be modelcount model probabilities'
+        self.__predictedmodelprobs = self.__modelprobs
+        self.loglikelihood = 0.0
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Predict and observe
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def predict(self):
+        r"""
+Mixes the regime-conditional estimates according to the transition matrix and predicts each of them with its own model.
+        """
+        # mixingprobs[i, j] is the probability of having been in regime i given that the system is now in regime j.
+        jointprobs = self.__modelprobs[:,np.newaxis] * self.__transitionmatrix
+        self.__predictedmodelprobs = np.sum(jointprobs, axis=0)
+        mixingprobs = jointprobs / np.where(self.__predictedmodelprobs > 0., self.__predictedmodelprobs, 1.)
+
+        states, statecovs = self.__models.state[:,:,0], self.__models.statecov
+        mixedstates = np.dot(mixingprobs.T, states)
+        deviations = states[np.newaxis,:,:] - mixedstates[:,np.newaxis,:]
+        mixedstatecovs = np.einsum('ij,ikl->jkl', mixingprobs, statecovs) + \
+                np.einsum('ij,jik,jil->jkl', mixingprobs, deviations, deviations)
+        self.__models.state = mixedstates
+        self.__models.statecov = mixedstatecovs
+        self.__models.predict()
+        self.__modelprobs = self.__predictedmodelprobs
+        return self.state
+
+    def observe(self, obs):
+        r"""
+Assimilates the observation obs (obsdim-dimensional) in every regime and updates the regime probabilities by the regimes'
+likelihoods of obs. An observation containing a NaN leaves the probabilities at their predicted values.
+        """
+        obs = np.tile(np.reshape(np.asarray(obs, dtype=float), (1, -1)), (self.modelcount, 1))
+        previousloglikelihoods = self.__models.loglikelihood.copy()
+        self.__models.observe(obs)
+        loglikelihoods = self.__models.loglikelihood - previousloglikelihoods
+        logjoint = np.log(self.__predictedmodelprobs) + loglikelihoods
+        loglikelihood = scipy.special.logsumexp(logjoint)
+        self.__modelprobs = np.exp(logjoint - loglikelihood)
+        self.loglikelihood += loglikelihood
+        return self.state
+
+    def predictAndObserve(self, obs):
+        self.predict()
+        return self.observe(obs)
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Properties
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __get_models(self):
+        return self.__models
+
+    models = property(fget=__get_models, doc='The BatchKalmanFilter holding the regime-conditional estimates')
+
+    def __get_transitionmatrix(self):
+        return self.__transitionmatrix
+
+    transitionmatrix = property(fget=__get_transitionmatrix)
+
+    def __get_modelprobs(self):
+        return self.__modelprobs
+
+    modelprobs = property(fget=__get_modelprobs, doc='The modelcount probabilities of the regimes given the observations so far')
+
+    def __get_state(self):
+        return npu.tondim2(np.dot(self.__modelprobs, self.__models.state[:,:,0]), ndim1tocolumn=True)
+
+    state = property(fget=__get_state, doc='The procdim-dimensional (column) estimate of the state, combined over the regimes')
+
+    def __get_statecov(self):
+        state = np.ravel(self.state)
+        deviations = self.__models.state[:,:,0] - state
+        return np.einsum('j,jkl->kl', self.__modelprobs, self.__models.statecov) + np.einsum('j,jk,jl->kl', self.__modelprobs, deviations, deviations)
+
+    statecov = property(fget=__get_statecov, doc='The procdim-by-procdim-dimensional covariance of the combined estimate of the state')
+
+    @property
+    def mean(self): return self.state
+
+    @property
+    def var(self): return self.statecov
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Special methods
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'IMMFilter(modelcount=%s, procdim=%s, modelprobs=%s)' % (self.modelcount, self.procdim, self.__modelprobs)
@@ -0,0 +1,383 @@
+import numpy as np
+import scipy.linalg as la
+
+import thalesians.maths.numpyutils as npu
+from thalesians.maths.constants import MINUS_HALF_LN_2PI
+
+def _choleskylogdet(cholesky):
+    return 2. * np.sum(np.log(np.diagonal(cholesky)))
+
+class InformationFilter(object):
+    r"""
+The information filter: the Kalman filter parameterised by the information matrix infomatrix = statecov^{-1} and the information
+vector infovector = statecov^{-1} * state.
+
+In this parameterisation assimilating an observation is additive: observe adds obsmap^T * obsnoisecov^{-1} * obsmap to the
+information matrix and obsmap^T * obsnoisecov^{-1} * (obs - obsoffset) to the information vector. These products, and the inverses
+of procmap and procnoisecov, are computed once and cached until the corresponding matrices are reassigned.
+
+When the observation noise covariance (obsnoisemap * obsnoisecov * obsnoisemap^T) is diagonal, it is kept as a vector of
+precisions, and observe costs O(obsdim * procdim) plus O(procdim^3); an observation with missing components only selects columns of
+the cached obsmap^T * obsnoisecov^{-1}, which adds O(obsdim * procdim^2). This makes it the right filter when obsdim is much larger
+than procdim or when many observations are missing; a zero information matrix represents a diffuse prior. A correlated observation
+noise covariance is factorised once, at O(obsdim^3), after which observe costs O(obsdim^2). With m components missing, the inverse
+of the remaining block is obtained from the cached inverse, at an additional O(obsdim * (procdim + m)^2 + m^3), rather
+than by refactorising.
+
+The state and statecov properties interoperate with
+:class:`thalesians.filtering.lowlevel.kalman.KalmanFilter`: they are converted from the information form lazily, only when read.
+
+The predict step requires procmap and procnoisecov to be invertible.
+
+:param state: The initial procdim-dimensional estimate of the state of the system
+:param statecov: The procdim-by-procdim-dimensional a posteriori error covariance matrix
+:param procnoisecov: The covariance matrix of the state noise process
+:param obsnoisecov: The obsdim-by-obsdim-dimensional covariance matrix of the measurement noise process
+:param procmap: The procdim-by-procdim-dimensional transition matrix; identity by default
+:param obsmap: The obsdim-by-procdim-dimensional measurement matrix
+:param procoffset: The procdim-dimensional offset added to the state at the predict step
+:param obsoffset: The obsdim-dimensional offset added to the predicted observation
+:param procnoisemap: The matrix applied to the process noise; identity by default
+:param obsnoisemap: The matrix applied to the measurement noise; identity by default
+:param infomatrix: The initial information matrix; an alternative to statecov
+:param infovector: The initial information vector; an alternative to state
+    """
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Constructor
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, state=None, statecov=None, procnoisecov=None, obsnoisecov=None, procmap=None, obsmap=None, procoffset=None, obsoffset=None, procnoisemap=None, obsnoisemap=None, infomatrix=None, infovector=None):
+        assert (statecov is None) != (infomatrix is None), 'Exactly one of statecov, infomatrix must be specified (not None)'
+        self.procdim = None
+        self.obsdim = None
+
+        self.__procmapinv = None
+        self.__procnoisemodel = None
+        self.__obsmodel = None
+
+        if infomatrix is not None:
+            self.infomatrix = infomatrix
+            self.infovector = np.zeros((self.procdim, 1)) if infovector is None else infovector
+        else:
+            self.__infomatrix = np.linalg.inv(npu.tondim2(statecov))
+            self.procdim = np.shape(self.__infomatrix)[0]
+            self.__infovector = np.zeros((self.procdim, 1)) if state is None else np.dot(self.__infomatrix, npu.tondim2(state, ndim1tocolumn=True))
+            self.__invalidatemoments()
+
+        self.procnoisemap = procnoisemap
+        self.obsnoisemap = obsnoisemap
+        self.procnoisecov = procnoisecov
+        self.obsnoisecov = obsnoisecov
+        self.procmap = procmap
+        self.obsmap = obsmap
+        self.procoffset = procoffset
+        self.obsoffset = obsoffset
+
+        self.lastobs = None
+        self.loglikelihood = 0.0
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Predict and observe
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def predict(self, **kwargs):
+        assert self.__procnoisecov is not None, 'The process noise covariance is not set'
+
+        if self.__procnoisemodel is None:
+            procnoisemap = np.eye(self.procdim) if self.__procnoisemap is None else self.__procnoisemap
+            self.__procnoisemodel = (procnoisemap, np.linalg.inv(self.__procnoisecov))
+        procnoisemap, procnoisecovinv = self.__procnoisemodel
+
+        # With M = procmap^{-T} * infomatrix * procmap^{-1} and
+        # C = M * procnoisemap * (procnoisemap^T * M * procnoisemap + procnoisecov^{-1})^{-1}, the prior information matrix is
+        # M - C * procnoisemap^T * M and the prior information vector is (I - C * procnoisemap^T) * procmap^{-T} * infovector.
+        if self.__procmap is None:
+            m = self.__infomatrix
+            procmapinvtinfovector = self.__infovector
+        else:
+            if self.__procmapinv is None:
+                self.__procmapinv = np.linalg.inv(self.__procmap)
+            m = np.dot(np.dot(self.__procmapinv.T, self.__infomatrix), self.__procmapinv)
+            procmapinvtinfovector = np.dot(self.__procmapinv.T, self.__infovector)
+        mprocnoisemap = np.dot(m, procnoisemap)
+        c = la.solve(np.dot(procnoisemap.T, mprocnoisemap) + procnoisecovinv, mprocnoisemap.T, assume_a='sym').T
+        infomatrix = m - np.dot(c, mprocnoisemap.T)
+        self.__infomatrix = .5 * (infomatrix + infomatrix.T)
+        self.__infovector = procmapinvtinfovector - np.dot(c, np.dot(procnoisemap.T, procmapinvtinfovector))
+        if self.__procoffset is not None:
+            self.__infovector += np.dot(self.__infomatrix, self.__procoffset)
+
+        self.__invalidatemoments()
+
+    def observe(self, obs, **kwargs):
+        r"""
+Assimilates the observation obs. NaN components of obs are treated as missing. The log-likelihood contribution is computed from
+the information-form quantities via the matrix determinant lemma; it is skipped while the prior information matrix is singular
+(a diffuse prior).
+        """
+        assert self.__obsnoisecov is not None, 'The covariance matrix obsnoisecov is not set'
+        assert self.__obsmap is not None, 'The measurement matrix obsmap is not set'
+
+        obs = npu.tondim2(obs, ndim1tocolumn=True, copy=True)
+        self.lastobs = obs.copy()
+        if self.__obsoffset is not None:
+            obs -= self.__obsoffset
+
+        missing = np.isnan(np.ravel(obs))
+        if np.all(missing):
+            return
+        if self.__obsmodel is None:
+            self.__obsmodel = self.__makeobsmodel()
+        missingcholesky = None
+        if np.any(missing):
+            keep, missing = np.flatnonzero(~missing), np.flatnonzero(missing)
+            obsmap, obsprecisions, obsnoisecovinv, obsmaptobsnoisecovinv, obsinfomatrix, obsnoisecovlogdet, missingcholesky = \
+                    self.__restrictobsmodel(keep, missing)
+            fullobs = obs
+            obs = obs[keep]
+        else:
+            obsmap, obsprecisions, obsnoisecovinv, obsmaptobsnoisecovinv, obsinfomatrix, obsnoisecovlogdet = self.__obsmodel
+
+        priorinfomatrix = self.__infomatrix
+        priorinfovector = self.__infovector
+        self.__infomatrix = priorinfomatrix + obsinfomatrix
+        self.__infovector = priorinfovector + np.dot(obsmaptobsnoisecovinv, obs)
+        self.__invalidatemoments()
+
+        # By the matrix determinant lemma and the Woodbury identity, with innov = obs - obsmap * priorstate,
+        #     log det innovcov = log det obsnoisecov + log det infomatrix - log det priorinfomatrix,
+        #     innov^T * innovcov^{-1} * innov = innov^T * obsnoisecov^{-1} * innov - u^T * infomatrix^{-1} * u,
+        # where u = obsmap^T * obsnoisecov^{-1} * innov.
+        try:
+            priorcholesky = np.linalg.cholesky(priorinfomatrix)
+            cholesky = np.linalg.cholesky(self.__infomatrix)
+        except np.linalg.LinAlgError:
+            pass
+        else:
+            priorstate = la.cho_solve((priorcholesky, True), priorinfovector, check_finite=False)
+            innov = obs - np.dot(obsmap, priorstate)
+            u = np.dot(obsmaptobsnoisecovinv, innov)
+            whitenedu = la.solve_triangular(cholesky, u, lower=True, check_finite=False)
+            logdet = obsnoisecovlogdet + _choleskylogdet(cholesky) - _choleskylogdet(priorcholesky)
+            if obsprecisions is not None:
+                mahalanobis = np.sum(obsprecisions * innov**2)
+            elif missingcholesky is None:
+                mahalanobis = np.vdot(innov, np.dot(obsnoisecovinv, innov))
+            else:
+                # With innov padded with zeros at the missing components, innov^T * P_kk * innov is its quadratic form in P, and
+                # P_mk * innov is the missing part of its product with P.
+                fullobs[keep], fullobs[missing] = innov, 0.
+                product = np.dot(obsnoisecovinv, fullobs)
+                whitened = la.solve_triangular(missingcholesky, product[missing], lower=True, check_finite=False)
+                mahalanobis = np.vdot(fullobs, product) - np.vdot(whitened, whitened)
+            mahalanobis -= np.vdot(whitenedu, whitenedu)
+            self.loglikelihood += len(obs) * MINUS_HALF_LN_2PI - .5 * (logdet + mahalanobis)
+
+    def predictAndObserve(self, obs, **kwargs):
+        self.predict(**kwargs)
+        self.observe(obs, **kwargs)
+
+    def __makeobsmodel(self):
+        # Exactly one of obsprecisions (a column of the reciprocals of the variances, for a diagonal obsnoisecov) and
+        # obsnoisecovinv is set.
+        if self.__obsnoisemap is None:
+            obsnoisecov = self.__obsnoisecov
+        else:
+            obsnoisecov = np.dot(np.dot(self.__obsnoisemap, self.__obsnoisecov), self.__obsnoisemap.T)
+        obsmap = self.__obsmap
+        obsvars = np.diagonal(obsnoisecov)
+        if np.count_nonzero(obsnoisecov) == np.count_nonzero(obsvars):
+            obsprecisions, obsnoisecovinv = (1. / obsvars)[:,np.newaxis], None
+            obsmaptobsnoisecovinv = obsmap.T * obsprecisions.T
+            obsnoisecovlogdet = np.sum(np.log(obsvars))
+        else:
+            cholesky = np.linalg.cholesky(obsnoisecov)
+            obsprecisions, obsnoisecovinv = None, la.cho_solve((cholesky, True), np.eye(len(obsvars)), check_finite=False)
+            obsmaptobsnoisecovinv = np.dot(obsmap.T, obsnoisecovinv)
+            obsnoisecovlogdet = _choleskylogdet(cholesky)
+        return obsmap, obsprecisions, obsnoisecovinv, obsmaptobsnoisecovinv, np.dot(obsmaptobsnoisecovinv, obsmap), obsnoisecovlogdet
+
+    def __restrictobsmodel(self, keep, missing):
+        obsmap, obsprecisions, obsnoisecovinv, obsmaptobsnoisecovinv, _, obsnoisecovlogdet = self.__obsmodel
+        obsmap = obsmap[keep]
+        if obsprecisions is not None:
+            cholesky = None
+            obsprecisions = obsprecisions[keep]
+            obsmaptobsnoisecovinv = obsmaptobsnoisecovinv[:,keep]
+            obsnoisecovlogdet = -np.sum(np.log(obsprecisions))
+        else:
+            # With P = obsnoisecov^{-1}, the inverse of the kept block of obsnoisecov is the Schur complement
+            # P_kk - P_km * P_mm^{-1} * P_mk, and log det obsnoisecov_kk = log det obsnoisecov + log det P_mm. The kept block of P
+            # itself is never formed; P is returned whole, with the Cholesky factor of P_mm.
+            cholesky = np.linalg.cholesky(obsnoisecovinv[np.ix_(missing, missing)])
+            correction = la.cho_solve((cholesky, True), obsnoisecovinv[np.ix_(missing, keep)], check_finite=False)
+            obsmaptobsnoisecovinv = obsmaptobsnoisecovinv[:,keep] - np.dot(obsmaptobsnoisecovinv[:,missing], correction)
+            obsnoisecovlogdet = obsnoisecovlogdet + _choleskylogdet(cholesky)
+        return obsmap, obsprecisions, obsnoisecovinv, obsmaptobsnoisecovinv, np.dot(obsmaptobsnoisecovinv, obsmap), obsnoisecovlogdet, \
+                cholesky
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Properties
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __invalidatemoments(self):
+        self.__state = None
+        self.__statecov = None
+
+    def __setprocdim(self, procdim, message):
+        assert (self.procdim is None) or (self.procdim == procdim), message
+        self.procdim = procdim
+
+    def __setobsdim(self, obsdim, message):
+        assert (self.obsdim is None) or (self.obsdim == obsdim), message
+        self.obsdim = obsdim
+
+    def __get_infomatrix(self):
+        return self.__infomatrix
+
+    def __set_infomatrix(self, value):
+        self.__infomatrix = npu.tondim2(value, copy=True)
+        shape = np.shape(self.__infomatrix)
+        assert shape[0] == shape[1], 'The information matrix must be square'
+        self.__setprocdim(shape[0], 'The information matrix must be procdim-by-procdim-dimensional')
+        self.__invalidatemoments()
+
+    infomatrix = property(fget=__get_infomatrix, fset=__set_infomatrix, doc='The procdim-by-procdim-dimensional information matrix, statecov^{-1}')
+
+    def __get_infovector(self):
+        return self.__infovector
+
+    def __set_infovector(self, value):
+        self.__infovector = npu.tondim2(value, ndim1tocolumn=True, copy=True)
+        self.__setprocdim(np.shape(self.__infovector)[0], 'The information vector must be procdim-dimensional')
+        self.__invalidatemoments()
+
+    infovector = property(fget=__get_infovector, fset=__set_infovector, doc='The procdim-dimensional information vector, statecov^{-1} * state')
+
+    def __get_state(self):
+        if self.__state is None:
+            self.__state = np.linalg.solve(self.__infomatrix, self.__infovector)
+        return self.__state
+
+    def __set_state(self, value):
+        # The covariance is unchanged, so the information vector is statecov^{-1} * state.
+        self.__infovector = np.dot(self.__infomatrix, npu.tondim2(value, ndim1tocolumn=True))
+        self.__invalidatemoments()
+
+    state = property(fget=__get_state, fset=__set_state, doc='The procdim-dimensional estimate of the state of the system, converted from the information form when read')
+
+    def __get_statecov(self):
+        if self.__statecov is None:
+            self.__statecov = np.linalg.inv(self.__infomatrix)
+        return self.__statecov
+
+    def __set_statecov(self, value):
+        state = self.state
+        self.__infomatrix = np.linalg.inv(npu.tondim2(value))
+        self.__infovector = np.dot(self.__infomatrix, state)
+        self.__invalidatemoments()
+
+    statecov = property(fget=__get_statecov, fset=__set_statecov, doc='The procdim-by-procdim-dimensional a posteriori error covariance matrix, converted from the information form when read')
+
+    def __get_procnoisecov(self):
+        return self.__procnoisecov
+
+    def __set_procnoisecov(self, value):
+        self.__procnoisecov = None if value is None else npu.tondim2(value, copy=True)
+        self.__procnoisemodel = None
+
+    procnoisecov = property(fget=__get_procnoisecov, fset=__set_procnoisecov)
+
+    def __get_obsnoisecov(self):
+        return self.__obsnoisecov
+
+    def __set_obsnoisecov(self, value):
+        if value is not None:
+            self.__obsnoisecov = npu.tondim2(value, copy=True)
+            if self.__obsnoisemap is None:
+                self.__setobsdim(np.shape(self.__obsnoisecov)[0], 'The covariance matrix obsnoisecov must be obsdim-by-obsdim-dimensional')
+        else:
+            self.__obsnoisecov = None
+        self.__obsmodel = None
+
+    obsnoisecov = property(fget=__get_obsnoisecov, fset=__set_obsnoisecov)
+
+    def __get_procmap(self):
+        return self.__procmap
+
+    def __set_procmap(self, value):
+        if value is not None:
+            self.__procmap = npu.tondim2(value, copy=True)
+            self.__setprocdim(np.shape(self.__procmap)[0], 'The transition matrix procmap must be procdim-by-procdim-dimensional')
+        else:
+            self.__procmap = None
+        self.__procmapinv = None
+
+    procmap = property(fget=__get_procmap, fset=__set_procmap)
+
+    def __get_obsmap(self):
+        return self.__obsmap
+
+    def __set_obsmap(self, value):
+        if value is not None:
+            self.__obsmap = npu.tondim2(value, copy=True)
+            self.__setobsdim(np.shape(self.__obsmap)[0], 'The measurement matrix obsmap must have obsdim rows')
+            self.__setprocdim(np.shape(self.__obsmap)[1], 'The measurement matrix obsmap must have procdim columns')
+        else:
+            self.__obsmap = None
+        self.__obsmodel = None
+
+    obsmap = property(fget=__get_obsmap, fset=__set_obsmap)
+
+    def __get_procoffset(self):
+        return self.__procoffset
+
+    def __set_procoffset(self, value):
+        self.__procoffset = None if value is None else npu.tondim2(value, ndim1tocolumn=True, copy=True)
+
+    procoffset = property(fget=__get_procoffset, fset=__set_procoffset)
+
+    def __get_obsoffset(self):
+        return self.__obsoffset
+
+    def __set_obsoffset(self, value):
+        self.__obsoffset = None if value is None else npu.tondim2(value, ndim1tocolumn=True, copy=True)
+
+    obsoffset = property(fget=__get_obsoffset, fset=__set_obsoffset)
+
+    def __get_procnoisemap(self):
+        return self.__procnoisemap
+
+    def __set_procnoisemap(self, value):
+        self.__procnoisemap = None if value is None else npu.tondim2(value, copy=True)
+        self.__procnoisemodel = None
+
+    procnoisemap = property(fget=__get_procnoisemap, fset=__set_procnoisemap)
+
+    def __get_obsnoisemap(self):
+        return self.__obsnoisemap
+
+    def __set_obsnoisemap(self, value):
+        if value is not None:
+            self.__obsnoisemap = npu.tondim2(value, copy=True)
+            self.__setobsdim(np.shape(self.__obsnoisemap)[0], 'The matrix obsnoisemap must have obsdim rows')
+        else:
+            self.__obsnoisemap = None
+        self.__obsmodel = None
+
+    obsnoisemap = property(fget=__get_obsnoisemap, fset=__set_obsnoisemap)
+
+    @property
+    def mean(self): return self.state
+
+    @property
+    def var(self): return self.statecov
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Special methods
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'InformationFilter(procdim=%s, obsdim=%s, infovector=%s, infomatrix=%s)' % (
+            self.procdim, self.obsdim, self.infovector, self.infomatrix)
@@ -3,7 +3,6 @@
 # TODO Shorten observation to obs
 # TODO Shorten innovation to innov
 # TODO innovcov, not innovvar
-# TODO Cater for the multidimensional observation case
 # TODO Complete the docs
 # TODO Mention all parameters in the docs
 # TODO __str__
@@ -11,13 +10,149 @@
 # TODO Don't store priors, innovations, etc., return them if necessary
 # TODO Stop referring to Haykin, refer to the handbook chapter
 
+from collections import namedtuple
+from enum import Enum
+import math
 import warnings
 
 import numpy as np
+import scipy.linalg as la
+import scipy.sparse as sp
 
+from thalesians.filtering.lowlevel.forecasting import ForecastCache
+from thalesians.filtering.lowlevel.score import loglikelihoodandscore as _loglikelihoodandscore
+from thalesians.maths.nearpd import repairedcholesky
 import thalesians.maths.numpyutils as npu
 from thalesians.maths.constants import MINUS_HALF_LN_2PI
 
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Products with the system matrices
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# procmap, obsmap, procnoisemap and obsnoisemap may be scipy.sparse matrices. The products below keep them sparse, so that, with a
+# sparse matrix, they cost O(nnz * procdim) rather than O(procdim^3); the state and the covariances themselves remain dense.
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def _tosystemmatrix(value):
+    return sp.csr_matrix(value, dtype=float, copy=True) if sp.issparse(value) else npu.tondim2(value, copy=True)
+
+def _todense(matrix):
+    return matrix.toarray() if sp.issparse(matrix) else matrix
+
+def _dot(matrix, other):
+    # matrix * other
+    return matrix.dot(other) if sp.issparse(matrix) else np.dot(matrix, other)
+
+def _dott(other, matrix):
+    # other * matrix^T
+    return matrix.dot(other.T).T if sp.issparse(matrix) else np.dot(other, matrix.T)
+
+def _sandwich(matrix, cov):
+    # matrix * cov * matrix^T, for a symmetric cov
+    return matrix.dot(matrix.dot(cov).T) if sp.issparse(matrix) else np.dot(np.dot(matrix, cov), matrix.T)
+
+def _identitylike(matrix, dim):
+    return sp.identity(dim, format='csr') if sp.issparse(matrix) else np.eye(dim)
+
+def _innovsolve(innovcov, covobsmapt, innov, repairstrategy=None):
+    r"""
+Given the innovation covariance innovcov, statecov * obsmap^T and the innovation, returns the gain, the log-determinant of innovcov
+and the Mahalanobis term innov^T * innovcov^{-1} * innov. innovcov is factorised once, by Cholesky; the gain comes from triangular
+solves against that factor and the log-determinant and the Mahalanobis term are read off the same factor. If innovcov is not
+positive definite, we repair it according to repairstrategy (a :class:`thalesians.maths.nearpd.RepairStrategy`) or, if that is
+None, fall back to its pseudoinverse and pseudo-determinant.
+    """
+    try:
+        cholesky = la.cho_factor(innovcov, lower=True, check_finite=False)
+    except la.LinAlgError:
+        if repairstrategy is not None:
+            warnings.warn('Encountered an innovation covariance that is not positive definite. Repairing it')
+            cholesky = (repairedcholesky(innovcov, repairstrategy), True)
+        else:
+            warnings.warn('Encountered an innovation covariance that is not positive definite. Falling back to the pseudoinverse')
+            pinv = np.linalg.pinv(innovcov)
+            eigvals = np.linalg.eigvalsh(innovcov)
+            eigvals = eigvals[eigvals > np.finfo(float).eps * np.max(np.abs(eigvals))]
+            return np.dot(covobsmapt, pinv), np.sum(np.log(eigvals)), np.vdot(innov, np.dot(pinv, innov))
+    gain = la.cho_solve(cholesky, covobsmapt.T, check_finite=False).T
+    whitenedinnov = la.solve_triangular(cholesky[0], innov, lower=True, check_finite=False)
+    logdet = 2. * np.sum(np.log(np.diagonal(cholesky[0])))
+    return gain, logdet, np.vdot(whitenedinnov, whitenedinnov)
+
+class KalmanFilterSeriesData(namedtuple('KalmanFilterSeriesData', (
+        'states',
+        'statecovs',
+        'innovs',
+        'innovcovs',
+        'gains',
+        'loglikelihoods',
+        'priorstates',
+        'priorstatecovs',
+        'initialstate',
+        'initialstatecov'))):
+    r"""
+The output of :meth:`KalmanFilter.filterseries`. Each field is a contiguous array whose leading dimension is the time index: the
+timecount-by-procdim posterior states, the timecount-by-procdim-by-procdim posterior state covariances, the timecount-by-obsdim
+innovations, the timecount-by-obsdim-by-obsdim innovation covariances, the timecount-by-procdim-by-obsdim gains and the
+timecount per-step log-likelihood contributions, followed by the timecount-by-procdim prior (predicted) states and the
+timecount-by-procdim-by-procdim prior state covariances, and finally the procdim-dimensional state and procdim-by-procdim
+covariance that the filter started from. Rows where the observation was missing have NaN innovations, innovation covariances and
+gains and a zero log-likelihood contribution. The priors and the initial state are what
+:func:`thalesians.filtering.lowlevel.smoothing.rtssmooth` needs for the backward pass.
+    """
+    __slots__ = ()
+
+def _sequentialupdate(state, statecov, obs, obsmap, obsvars):
+    r"""
+Assimilates the components of obs one at a time, as obsdim scalar observations with independent noises of variances obsvars,
+by rank-one updates of the (one-dimensional) state and of statecov. NaN components are skipped. Returns the updated state and
+statecov (both modified in place) and the sum of the scalar log-likelihood contributions.
+    """
+    loglikelihood = 0.
+    for i in range(len(obs)):
+        if np.isnan(obs[i]): continue
+        obsrow = obsmap[i]
+        covobsrow = np.dot(statecov, obsrow)
+        innovvar = np.dot(obsrow, covobsrow) + obsvars[i]
+        innov = obs[i] - np.dot(obsrow, state)
+        gain = covobsrow / innovvar
+        state += gain * innov
+        statecov -= np.outer(gain, covobsrow)
+        loglikelihood += MINUS_HALF_LN_2PI - .5 * (math.log(innovvar) + innov * innov / innovvar)
+    return state, statecov, loglikelihood
+
+def totimestack(stack, observations, shape):
+    r"""
+Turns an argument of :meth:`KalmanFilter.filterseries` (or of
+:func:`thalesians.filtering.lowlevel.parallelkalman.parallelfilterseries`) that makes the system time-varying into a contiguous
+timecount-by-shape array (or None, if it is None). stack is either such an array or a function of the observations that returns
+one.
+    """
+    if stack is None: return None
+    if callable(stack): stack = stack(observations)
+    timecount = np.shape(observations)[0]
+    stack = np.asarray(stack, dtype=float)
+    assert np.size(stack) == timecount * int(np.prod(shape)), 'Expected a stack of %d arrays of shape %s' % (timecount, shape)
+    return np.ascontiguousarray(np.reshape(stack, (timecount,) + shape))
+
+class UpdateStrategy(Enum):
+    # Assimilate the obsdim-dimensional observation in one go, factorising the obsdim-by-obsdim innovation covariance:
+    joint = 0
+
+    # Assimilate the observation one component at a time by rank-one updates. Exact if the effective observation noise
+    # covariance is diagonal; otherwise the observation is first decorrelated by the Cholesky factor of that covariance. Costs
+    # O(obsdim * procdim^2) rather than O(obsdim^3) and skips NaN components:
+    sequential = 1
+
+    # Project the observation onto the procdim-dimensional generalised least squares statistic for the state, using a cached
+    # factorisation of the observation model, filter on that, and add back the log-likelihood of the part of the observation that
+    # carries no information about the state. Exact; the per-step cost of the update depends on procdim rather than obsdim (bar
+    # the O(obsdim * procdim) projection), which pays off when obsdim is much larger than procdim:
+    collapsed = 2
+
+_CollapsedObsModel = namedtuple('_CollapsedObsModel', ('obsnoisecovinvsqrt', 'obsnoisecovcholesky', 'projection', 'obsmap', 'logdet'))
+
+_SteadyState = namedtuple('_SteadyState', ('gain', 'statecov', 'priorstatecov', 'innovcov', 'innovcovcholesky', 'logdet'))
+
 class KalmanFilter(object):
     r"""
 The Kalman filter.
@@ -28,16 +163,42 @@ The Kalman filter.
 :param obsnoisecov: The obsdim-by-obsdim-dimensional covariance matrix of the measurement noise process
 :param procmap: The procdim-by-procdim-dimensional transition matrix taking the state from time k to time k+1
 :param obsmap: The obsdim-by-procdim-dimensional measurement matrix. Applied to a state, it produces the corresponding observable
+:param procnoisemap: The procdim-by-procnoisedim-dimensional matrix through which the process noise enters the state (identity by default)
+:param obsnoisemap: The obsdim-by-obsnoisedim-dimensional matrix through which the observation noise enters the observation (identity by default)
+:param updatestrategy: An :class:`UpdateStrategy`. With UpdateStrategy.sequential and UpdateStrategy.collapsed, observe does not
+    form the joint innovation covariance and gain, so innovcov and gain are left as None
+:param steadystatetol: If not None, the filter watches the gain and statecov for convergence: once neither changes by more than
+    steadystatetol (elementwise) from one observe to the next, the Riccati recursion is frozen and predict and observe only
+    propagate the state, using the converged gain and covariances. Reassigning any of the system matrices (or statecov) switches
+    the filter back to the full recursion. Only used with UpdateStrategy.joint. See also :meth:`solvesteadystate`
+:param repairstrategy: The :class:`thalesians.maths.nearpd.RepairStrategy` applied to an innovation covariance that turns out not
+    to be positive definite; if None, the pseudoinverse of the innovation covariance is used instead
+
+procmap, obsmap, procnoisemap and obsnoisemap may be scipy.sparse matrices (they are stored in CSR format). They are then kept
+sparse in the predict and observe products, which cost O(nnz * procdim) instead of O(procdim^3); the state covariance stays dense.
+Where a noise map is not set, it defaults to a sparse identity if the corresponding procmap or obsmap is sparse.
     """
     
 # --------------------------------------------------------------------------------------------------------------------------------------------------------------
 # Constructor
 # --------------------------------------------------------------------------------------------------------------------------------------------------------------
 
-    def __init__(self, state=None, statecov=None, procnoisecov=None, obsnoisecov=None, procmap=None, obsmap=None, procoffset=None, obsoffset=None, procnoisemap=None, obsnoisemap=None):
+    def __init__(self, state=None, statecov=None, procnoisecov=None, obsnoisecov=None, procmap=None, obsmap=None, procoffset=None, obsoffset=None, procnoisemap=None, obsnoisemap=None, updatestrategy=UpdateStrategy.joint, steadystatetol=None, repairstrategy=None):
         self.procdim = None
         self.obsdim = None
 
+        self.updatestrategy = updatestrategy
+        self.repairstrategy = repairstrategy
+        self.__sequentialobsmodel = None
+        self.__collapsedobsmodel = None
+
+        self.steadystatetol = steadystatetol
+        self.__steadystate = None
+        self.__previousgain = None
+        self.__previousstatecov = None
+
+        self.__forecastcache = None
+
         # The procdim-dimensional state of the system.
         self.state = state
         self.statecov = statecov
@@ -70,6 +231,12 @@ The Kalman filter.
     def predict(self, **kwargs):
         assert not self.procnoisecov is None, 'The process noise covariance is not set'
 
+        if self.__steadystate is not None:
+            if self.__statecov is self.__steadystate.statecov:
+                return self.__predictsteadystate()
+            # Two predicts in a row (a missing observation) take statecov off its steady-state path.
+            self.__steadystate = None
+
         # By default, our transition matrix is the procdim-by-procdim-dimensional identity
         # matrix: the state stays the same as time passes.
         if self.procmap is None:
@@ -80,24 +247,24 @@ The Kalman filter.
         assert not self.procmap is None, 'The transition matrix procmap is not set'
         
         if self.procnoisemap is None:
-            self.procnoisemap = np.eye(self.procdim)
+            self.procnoisemap = _identitylike(self.procmap, self.procdim)
             
         if self.procnoisemap is None:
             if not self.procdim is None:
                 warnings.warn('The matrix procnoisemap is not set. Defaulting to procdim-by-procdim-dimensional identity')
-                self.procnoisemap = np.eye(self.procdim)
+                self.procnoisemap = _identitylike(self.procmap, self.procdim)
 
         assert not self.procnoisemap is None, 'The matrix procnoisemap is not set'
 
         # Here we shall refer to the steps given in [Haykin-2001]_.
 
         # State estimate propagation (step 1):
-        self.state = np.dot(self.procmap, self.state)
+        self.state = _dot(self.procmap, self.state)
         if self.procoffset is not None:
             self.state += self.procoffset
 
         # Error covariance propagation (step 2):
-        self.statecov = np.dot(np.dot(self.procmap, self.statecov), self.procmap.T) + np.dot(np.dot(self.procnoisemap, self.procnoisecov), self.procnoisemap.T)
+        self.statecov = _sandwich(self.procmap, self.statecov) + _sandwich(self.procnoisemap, self.procnoisecov)
 
         self.__priorstate = self.state
         self.__priorstatecov = self.statecov
@@ -112,6 +279,11 @@ The Kalman filter.
 
         assert not obsnoisecov is None, 'The covariance matrix obsnoisecov is not set'
 
+        if self.__steadystate is not None:
+            if 'obsnoisecov' not in kwargs and self.__statecov is self.__steadystate.priorstatecov:
+                return self.__observesteadystate(obs)
+            self.__steadystate = None
+
         # By default, our measurement matrix is the procdim-by-procdim-dimensional identity
         # matrix: we are observing the state directly. This only makes sense if
         # procdim == obsdim.
@@ -125,7 +297,7 @@ The Kalman filter.
         if self.obsnoisemap is None:
             if self.obsdim is not None:
                 warnings.warn('The matrix obsnoisemap is not set. Defaulting to obsdim-by-obsdim-dimensional identity')
-                self.obsnoisemap = np.eye(self.obsdim)
+                self.obsnoisemap = _identitylike(self.obsmap, self.obsdim)
 
         assert not self.obsnoisemap is None, 'The matrix obsnoisemap is not set'
 
@@ -133,31 +305,519 @@ The Kalman filter.
 
         # Here we shall refer to the steps given in [Haykin-2001]_.
 
-        # Kalman gain matrix (step 3):
-        self.innovcov = np.dot(np.dot(self.obsmap, self.statecov), self.obsmap.T) + np.dot(np.dot(self.obsnoisemap, obsnoisecov), self.obsnoisemap.T)
-
-        self.gain = np.dot(np.dot(self.statecov, self.obsmap.T), np.linalg.pinv(self.innovcov))
-        
-        self.predictedobs = np.dot(self.obsmap, self.state)
+        self.predictedobs = _dot(self.obsmap, self.state)
         if self.obsoffset is not None:
             self.predictedobs += self.obsoffset
+        self.innov = obs - self.predictedobs
+
+        if self.updatestrategy == UpdateStrategy.sequential:
+            state, statecov, loglikelihood = self.__observesequentially(np.ravel(self.state).copy(), self.statecov.copy(), np.ravel(obs),
+                    obsnoisecov if 'obsnoisecov' in kwargs else None)
+            self.state = state
+            self.statecov = statecov
+            self.innovcov = None
+            self.gain = None
+            self.loglikelihood += loglikelihood
+            self._lastobs = obs
+            return self.state
+
+        if self.updatestrategy == UpdateStrategy.collapsed:
+            state, statecov, loglikelihood = self.__observecollapsed(np.ravel(self.state), self.statecov, np.ravel(obs),
+                    obsnoisecov if 'obsnoisecov' in kwargs else None)
+            self.state = state
+            self.statecov = statecov
+            self.innovcov = None
+            self.gain = None
+            self.loglikelihood += loglikelihood
+            self._lastobs = obs
+            return self.state
+
+        # Kalman gain matrix (step 3):
+        covobsmapt = _dott(self.statecov, self.obsmap)
+        self.innovcov = _dot(self.obsmap, covobsmapt) + _sandwich(self.obsnoisemap, npu.tondim2(obsnoisecov))
+        self.gain, logdet, mahalanobis = _innovsolve(self.innovcov, covobsmapt, self.innov, self.repairstrategy)
 
         # State estimate update (step 4):
-        self.innov = obs - self.predictedobs
         self.state = self.state + np.dot(self.gain, self.innov)
-        self.statecov = np.dot(np.identity(self.procdim) - np.dot(self.gain, self.obsmap), self.statecov)
+        self.statecov = self.statecov - np.dot(self.gain, covobsmapt.T)
 
-        # TODO Cater for the multidimensional observation case
-        self.loglikelihood += MINUS_HALF_LN_2PI - .5 * (np.log(self.innovcov) + self.innov * self.innov / self.innovcov)
+        self.loglikelihood += self.obsdim * MINUS_HALF_LN_2PI - .5 * (logdet + mahalanobis)
         
         self._lastobs = obs
 
+        if self.steadystatetol is not None and 'obsnoisecov' not in kwargs:
+            self.__checksteadystate()
+
         return self.state
 
     def predictAndObserve(self, obs, **kwargs):
         self.predict(**kwargs)
         return self.observe(obs, **kwargs)
 
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Forecasting
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def forecast(self, horizons):
+        r"""
+Returns a :class:`thalesians.filtering.lowlevel.forecasting.KalmanForecast` with the means and covariances of the state and of
+the observation (if obsmap and obsnoisecov are set) for each of the nonnegative integer horizons, counted in predicts from the
+current state. The filter itself is not advanced. The powers of procmap and the cumulative process noise and offsets are cached
+and reused across calls until the process model is reassigned.
+        """
+        assert self.procnoisecov is not None, 'The process noise covariance is not set'
+        if self.__forecastcache is None:
+            procmap = np.eye(self.procdim) if self.procmap is None else _todense(self.procmap)
+            procnoisecov = self.procnoisecov if self.procnoisemap is None else _todense(_sandwich(self.procnoisemap, self.procnoisecov))
+            procoffset = np.zeros((self.procdim,)) if self.procoffset is None else np.ravel(self.procoffset)
+            self.__forecastcache = ForecastCache(procmap, procnoisecov, procoffset)
+        obsmap, obsoffset, obsnoisecov = None, None, None
+        if self.obsmap is not None and self.obsnoisecov is not None:
+            obsmap = _todense(self.obsmap)
+            obsoffset = None if self.obsoffset is None else np.ravel(self.obsoffset)
+            obsnoisecov = self.obsnoisecov if self.obsnoisemap is None else _todense(_sandwich(self.obsnoisemap, self.obsnoisecov))
+        return self.__forecastcache.forecast(horizons, np.ravel(self.state), self.statecov, obsmap, obsoffset, obsnoisecov)
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Sequential processing of observations
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __makesequentialobsmodel(self, obsnoisecov, keep=None):
+        # Returns the (possibly decorrelated) obsmap, the variances of the resulting independent scalar observations, the Cholesky
+        # factor used to decorrelate them (None if the effective noise covariance is already diagonal) and the log-determinant of
+        # that factor, which is the log-likelihood correction for the change of variables.
+        obsnoisemap = np.eye(self.obsdim) if self.obsnoisemap is None else self.obsnoisemap
+        obsnoisecov = _todense(_sandwich(obsnoisemap, npu.tondim2(obsnoisecov)))
+        obsmap = _todense(self.obsmap)
+        if keep is not None:
+            obsnoisecov = obsnoisecov[np.ix_(keep, keep)]
+            obsmap = obsmap[keep]
+        obsvars = np.diagonal(obsnoisecov).copy()
+        if not np.any(obsnoisecov - np.diag(obsvars)):
+            return obsmap, obsvars, None, 0.
+        cholesky = np.linalg.cholesky(obsnoisecov)
+        return la.solve_triangular(cholesky, obsmap, lower=True), np.ones(len(obsvars)), cholesky, np.sum(np.log(np.diagonal(cholesky)))
+
+    def __observesequentially(self, state, statecov, obs, obsnoisecov=None):
+        if obsnoisecov is None:
+            if self.__sequentialobsmodel is None:
+                self.__sequentialobsmodel = self.__makesequentialobsmodel(self.obsnoisecov)
+            obsmodel = self.__sequentialobsmodel
+        else:
+            obsmodel = self.__makesequentialobsmodel(obsnoisecov)
+        if self.obsoffset is not None:
+            obs = obs - np.ravel(self.obsoffset)
+        if obsmodel[2] is not None:
+            # A NaN component would contaminate all the decorrelated components after it, so in that case we decorrelate only
+            # the components that are present.
+            missing = np.isnan(obs)
+            if np.any(missing):
+                keep = np.flatnonzero(~missing)
+                obsmodel = self.__makesequentialobsmodel(self.obsnoisecov if obsnoisecov is None else obsnoisecov, keep)
+                obs = obs[keep]
+            # The components that are present may be uncorrelated with each other, in which case there is nothing to decorrelate.
+            if obsmodel[2] is not None:
+                obs = la.solve_triangular(obsmodel[2], obs, lower=True, check_finite=False)
+        state, statecov, loglikelihood = _sequentialupdate(state, statecov, obs, obsmodel[0], obsmodel[1])
+        return state, statecov, loglikelihood - obsmodel[3]
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Collapsed observations
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# With L the Cholesky factor of the effective observation noise covariance and L^{-1} * obsmap = Q * U its thin QR
+# decomposition, the whitened observation w = L^{-1} * (obs - obsoffset) = Q * U * state + noise, noise ~ N(0, I). Its projection
+# z = Q^T * w = U * state + noise', noise' ~ N(0, I) of dimension procdim, is a sufficient statistic for the state, and the
+# remainder, of squared norm |w|^2 - |z|^2, is pure noise. So the log-likelihood of obs is that of z, plus the log-density of the
+# remainder, minus log |L|.
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __makecollapsedobsmodel(self, obsnoisecov):
+        obsnoisecov = _todense(_sandwich(self.obsnoisemap, npu.tondim2(obsnoisecov))) if self.obsnoisemap is not None else npu.tondim2(obsnoisecov)
+        obsvars = np.diagonal(obsnoisecov)
+        if not np.any(obsnoisecov - np.diag(obsvars)):
+            obsnoisecovinvsqrt, cholesky = 1. / np.sqrt(obsvars), None
+            whitenedobsmap = obsnoisecovinvsqrt[:,np.newaxis] * _todense(self.obsmap)
+            logdet = .5 * np.sum(np.log(obsvars))
+        else:
+            obsnoisecovinvsqrt, cholesky = None, np.linalg.cholesky(obsnoisecov)
+            whitenedobsmap = la.solve_triangular(cholesky, _todense(self.obsmap), lower=True)
+            logdet = np.sum(np.log(np.diagonal(cholesky)))
+        q, r = np.linalg.qr(whitenedobsmap)
+        return _CollapsedObsModel(obsnoisecovinvsqrt=obsnoisecovinvsqrt, obsnoisecovcholesky=cholesky,
+                projection=np.ascontiguousarray(q.T), obsmap=r, logdet=logdet)
+
+    def __observecollapsed(self, state, statecov, obs, obsnoisecov=None):
+        if obsnoisecov is None:
+            if self.__collapsedobsmodel is None:
+                self.__collapsedobsmodel = self.__makecollapsedobsmodel(self.obsnoisecov)
+            obsmodel = self.__collapsedobsmodel
+        else:
+            obsmodel = self.__makecollapsedobsmodel(obsnoisecov)
+        if self.obsoffset is not None:
+            obs = obs - np.ravel(self.obsoffset)
+        if obsmodel.obsnoisecovcholesky is None:
+            whitenedobs = obsmodel.obsnoisecovinvsqrt * obs
+        else:
+            whitenedobs = la.solve_triangular(obsmodel.obsnoisecovcholesky, obs, lower=True, check_finite=False)
+        collapsedobs = np.dot(obsmodel.projection, whitenedobs)
+        collapsedobsdim = len(collapsedobs)
+
+        covobsmapt = np.dot(statecov, obsmodel.obsmap.T)
+        innovcov = np.dot(obsmodel.obsmap, covobsmapt) + np.eye(collapsedobsdim)
+        innov = collapsedobs - np.dot(obsmodel.obsmap, state)
+        gain, logdet, mahalanobis = _innovsolve(innovcov, covobsmapt, innov, self.repairstrategy)
+        state = state + np.dot(gain, innov)
+        statecov = statecov - np.dot(gain, covobsmapt.T)
+
+        loglikelihood = collapsedobsdim * MINUS_HALF_LN_2PI - .5 * (logdet + mahalanobis)
+        loglikelihood += (len(obs) - collapsedobsdim) * MINUS_HALF_LN_2PI - \
+                .5 * (np.dot(whitenedobs, whitenedobs) - np.dot(collapsedobs, collapsedobs)) - obsmodel.logdet
+        return state, statecov, loglikelihood
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Steady state
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# When procmap, obsmap, procnoisecov and obsnoisecov are constant, the Riccati recursion for statecov (and hence the gain) does
+# not depend on the data and converges. Once it has, there is no need to pay O(procdim^3) per step to recompute it: the frozen
+# predict and observe below are O(procdim^2 + obsdim^2).
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __get_steadystate(self):
+        return self.__steadystate is not None
+
+    steadystate = property(fget=__get_steadystate, doc='Whether the gain and covariances are currently frozen at their steady-state values')
+
+    def __invalidatesteadystate(self):
+        self.__steadystate = None
+        self.__previousgain = None
+        self.__previousstatecov = None
+
+    def __freeze(self, gain, statecov, priorstatecov, innovcov):
+        innovcovcholesky = np.linalg.cholesky(innovcov)
+        self.__steadystate = _SteadyState(gain=gain, statecov=statecov, priorstatecov=priorstatecov, innovcov=innovcov,
+                innovcovcholesky=innovcovcholesky, logdet=2. * np.sum(np.log(np.diagonal(innovcovcholesky))))
+
+    def __checksteadystate(self):
+        if self.__previousgain is not None and \
+                np.max(np.abs(self.gain - self.__previousgain)) < self.steadystatetol and \
+                np.max(np.abs(self.__statecov - self.__previousstatecov)) < self.steadystatetol:
+            try:
+                self.__freeze(self.gain, self.__statecov, self.__priorstatecov, self.innovcov)
+            except np.linalg.LinAlgError:
+                pass
+        self.__previousgain = self.gain
+        self.__previousstatecov = self.__statecov
+
+    def solvesteadystate(self):
+        r"""
+Solves the discrete algebraic Riccati equation for the steady-state a priori statecov of the (time-invariant) system, freezes the
+gain and covariances at their steady-state values and sets statecov to the steady-state a posteriori covariance, so that
+subsequent predicts and observes only propagate the state.
+        """
+        assert self.procnoisecov is not None, 'The process noise covariance is not set'
+        assert self.obsnoisecov is not None, 'The covariance matrix obsnoisecov is not set'
+        assert self.obsmap is not None, 'The measurement matrix obsmap is not set'
+        # As in predict, the transition matrix defaults to the identity; it is set here, because the frozen predict step uses it.
+        if self.procmap is None:
+            self.procmap = np.eye(self.procdim)
+        procmap = _todense(self.procmap)
+        obsmap = _todense(self.obsmap)
+        procnoisecov = self.procnoisecov if self.procnoisemap is None else _todense(_sandwich(self.procnoisemap, self.procnoisecov))
+        obsnoisecov = self.obsnoisecov if self.obsnoisemap is None else _todense(_sandwich(self.obsnoisemap, self.obsnoisecov))
+
+        priorstatecov = la.solve_discrete_are(procmap.T, obsmap.T, procnoisecov, obsnoisecov)
+        priorstatecov = .5 * (priorstatecov + priorstatecov.T)
+        covobsmapt = np.dot(priorstatecov, obsmap.T)
+        innovcov = np.dot(obsmap, covobsmapt) + obsnoisecov
+        gain = la.solve(innovcov, covobsmapt.T, assume_a='pos').T
+        statecov = priorstatecov - np.dot(gain, covobsmapt.T)
+
+        self.statecov = statecov
+        self.__freeze(gain, self.__statecov, priorstatecov, innovcov)
+
+    def __predictsteadystate(self):
+        state = _dot(self.procmap, self.__state)
+        if self.procoffset is not None:
+            state += self.procoffset
+        self.__state = state
+        self.__statecov = self.__steadystate.priorstatecov
+        self.__priorstate = state
+        self.__priorstatecov = self.__statecov
+        return state
+
+    def __observesteadystate(self, obs):
+        obs = npu.tondim2(obs, ndim1tocolumn=True, copy=False)
+        steadystate = self.__steadystate
+        self.predictedobs = _dot(self.obsmap, self.__state)
+        if self.obsoffset is not None:
+            self.predictedobs += self.obsoffset
+        self.innov = obs - self.predictedobs
+        self.__state = self.__state + np.dot(steadystate.gain, self.innov)
+        self.__statecov = steadystate.statecov
+        self.innovcov = steadystate.innovcov
+        self.gain = steadystate.gain
+        whitenedinnov = la.solve_triangular(steadystate.innovcovcholesky, self.innov, lower=True, check_finite=False)
+        self.loglikelihood += self.obsdim * MINUS_HALF_LN_2PI - .5 * (steadystate.logdet + np.vdot(whitenedinnov, whitenedinnov))
+        self._lastobs = obs
+        return self.__state
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Whole-series filtering
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Equivalent to calling predictAndObserve once per row, but without going through the property setters at every step. The
+# system matrices are read once, the products that do not depend on the data are precomputed, and the recursion writes into
+# preallocated workspaces and output arrays.
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __fillsteadystate(self, steadystate, start, end, statecovs, priorstatecovs, innovcovs, gains):
+        statecovs[start:end] = steadystate.statecov
+        priorstatecovs[start:end] = steadystate.priorstatecov
+        innovcovs[start:end] = steadystate.innovcov
+        gains[start:end] = steadystate.gain
+
+    def filterseries(self, observations, procmaps=None, obsmaps=None, procoffsets=None, obsoffsets=None):
+        r"""
+Runs predictAndObserve over every row of the timecount-by-obsdim array observations (a one-dimensional array is treated as a
+series of scalar observations) and returns a :class:`KalmanFilterSeriesData`. Rows containing a NaN are treated as missing: for
+those only the predict step is carried out. (With UpdateStrategy.sequential, only rows that are entirely NaN are missing and the NaN
+components of other rows are skipped. With UpdateStrategy.sequential and UpdateStrategy.collapsed, the innovation covariances and
+gains, which are not formed, are returned as NaN.) On return the filter is left in the same state as after the last predictAndObserve.
+
+procmaps, obsmaps, procoffsets and obsoffsets make the system time-varying. Each is either a stack whose leading dimension is
+the time index (timecount-by-procdim-by-procdim for procmaps, timecount-by-obsdim-by-procdim for obsmaps, timecount-by-procdim and
+timecount-by-obsdim for the offsets) or a function that takes the timecount-by-obsdim array of observations and returns such a
+stack for the whole series at once. procmaps[t] and procoffsets[t] take the state from time t-1 to time t, and obsmaps[t] and
+obsoffsets[t] apply to observations[t]. The filter's own procmap, obsmap, procoffset and obsoffset are used where no stack is
+given, and are left unchanged. A time-varying system has no steady state, so steadystatetol is ignored; obsmaps and obsoffsets
+can only be combined with UpdateStrategy.joint.
+        """
+        assert self.procnoisecov is not None, 'The process noise covariance is not set'
+        assert self.obsnoisecov is not None, 'The covariance matrix obsnoisecov is not set'
+        assert self.obsmap is not None, 'The measurement matrix obsmap is not set'
+
+        observations = np.asarray(observations, dtype=float)
+        if np.ndim(observations) == 1: observations = observations[:,np.newaxis]
+        timecount, obsdim = np.shape(observations)
+        assert obsdim == self.obsdim, 'The observations must be obsdim-dimensional'
+        procdim = self.procdim
+
+        procmaps = totimestack(procmaps, observations, (procdim, procdim))
+        obsmaps = totimestack(obsmaps, observations, (obsdim, procdim))
+        procoffsets = totimestack(procoffsets, observations, (procdim,))
+        obsoffsets = totimestack(obsoffsets, observations, (obsdim,))
+        timevarying = procmaps is not None or obsmaps is not None or procoffsets is not None or obsoffsets is not None
+        assert (obsmaps is None and obsoffsets is None) or self.updatestrategy == UpdateStrategy.joint, \
+                'obsmaps and obsoffsets can only be used with UpdateStrategy.joint'
+
+        procmap = np.eye(procdim) if self.procmap is None else self.procmap
+        procnoisecov = self.procnoisecov if self.procnoisemap is None else _todense(_sandwich(self.procnoisemap, self.procnoisecov))
+        obsmap = self.obsmap
+        obsnoisecov = self.obsnoisecov if self.obsnoisemap is None else _todense(_sandwich(self.obsnoisemap, self.obsnoisecov))
+        # Sparse maps go through the sparse products; dense ones through np.dot into the preallocated workspaces.
+        sparseprocmap = sp.issparse(procmap) and procmaps is None
+        sparseobsmap = sp.issparse(obsmap) and obsmaps is None
+        procmapt = None if sparseprocmap else np.ascontiguousarray(procmap.T)
+        obsmapt = None if sparseobsmap else np.ascontiguousarray(obsmap.T)
+        procoffset = None if self.procoffset is None else np.ravel(self.procoffset)
+        obsoffset = None if self.obsoffset is None else np.ravel(self.obsoffset)
+
+        states = np.empty((timecount, procdim))
+        statecovs = np.empty((timecount, procdim, procdim))
+        innovs = np.empty((timecount, obsdim))
+        innovcovs = np.empty((timecount, obsdim, obsdim))
+        gains = np.empty((timecount, procdim, obsdim))
+        loglikelihoods = np.zeros((timecount,))
+        priorstates = np.empty((timecount, procdim))
+        priorstatecovs = np.empty((timecount, procdim, procdim))
+
+        state = np.ravel(self.state).copy()
+        statecov = self.statecov.copy()
+        initialstate = state.copy()
+        initialstatecov = statecov.copy()
+        priorstate = np.empty((procdim,))
+        priorstatecov = np.empty((procdim, procdim))
+        procmapstatecov = np.empty((procdim, procdim))
+        covobsmapt = np.empty((procdim, obsdim))
+        predictedobs = np.empty((obsdim,))
+
+        # With the sequential update strategy, only rows that are entirely NaN are missing; NaN components are skipped.
+        sequential = self.updatestrategy == UpdateStrategy.sequential
+        collapsed = self.updatestrategy == UpdateStrategy.collapsed
+        missing = np.isnan(observations).all(axis=1) if sequential else np.isnan(observations).any(axis=1)
+        scalarobs = obsdim == 1
+        loglikelihoodconst = obsdim * MINUS_HALF_LN_2PI
+
+        # While the gain and covariances are frozen (see steadystatetol), only the state is propagated; the frozen covariances
+        # are written out in bulk when the steady state ends.
+        steadystate = self.__steadystate if (not timevarying and self.__steadystate is not None and self.__statecov is self.__steadystate.statecov) else None
+        steadystatetol = None if timevarying else self.steadystatetol
+        steadystart = 0
+        if steadystate is not None: steadyinnovcovinv = np.linalg.inv(steadystate.innovcov)
+        previousgain, previousstatecov = self.__previousgain, self.__previousstatecov
+
+        for t in range(timecount):
+            if steadystate is not None:
+                if not missing[t]:
+                    if sparseprocmap: priorstate[:] = procmap.dot(state)
+                    else: np.dot(procmap, state, out=priorstate)
+                    if procoffset is not None: priorstate += procoffset
+                    priorstates[t] = priorstate
+                    innov = innovs[t]
+                    if sparseobsmap: predictedobs[:] = obsmap.dot(priorstate)
+                    else: np.dot(obsmap, priorstate, out=predictedobs)
+                    if obsoffset is not None: predictedobs += obsoffset
+                    np.subtract(observations[t], predictedobs, out=innov)
+                    np.dot(steadystate.gain, innov, out=state)
+                    state += priorstate
+                    states[t] = state
+                    loglikelihoods[t] = loglikelihoodconst - .5 * (steadystate.logdet + np.dot(innov, np.dot(steadyinnovcovinv, innov)))
+                    continue
+                self.__fillsteadystate(steadystate, steadystart, t, statecovs, priorstatecovs, innovcovs, gains)
+                statecov[:] = steadystate.statecov
+                steadystate = None
+                previousgain, previousstatecov = None, None
+
+            if timevarying:
+                if procmaps is not None:
+                    procmap = procmaps[t]
+                    procmapt = procmap.T
+                if obsmaps is not None:
+                    obsmap = obsmaps[t]
+                    obsmapt = obsmap.T
+                if procoffsets is not None: procoffset = procoffsets[t]
+                if obsoffsets is not None: obsoffset = obsoffsets[t]
+
+            if sparseprocmap:
+                priorstate[:] = procmap.dot(state)
+                priorstatecov[:] = _sandwich(procmap, statecov)
+            else:
+                np.dot(procmap, state, out=priorstate)
+                np.dot(procmap, statecov, out=procmapstatecov)
+                np.dot(procmapstatecov, procmapt, out=priorstatecov)
+            if procoffset is not None: priorstate += procoffset
+            priorstatecov += procnoisecov
+            priorstates[t] = priorstate
+            priorstatecovs[t] = priorstatecov
+
+            if missing[t]:
+                state[:] = priorstate
+                statecov[:] = priorstatecov
+                states[t] = state
+                statecovs[t] = statecov
+                innovs[t] = np.nan
+                innovcovs[t] = np.nan
+                gains[t] = np.nan
+                previousgain, previousstatecov = None, None
+                continue
+
+            if sequential or collapsed:
+                innov = innovs[t]
+                if sparseobsmap: predictedobs[:] = obsmap.dot(priorstate)
+                else: np.dot(obsmap, priorstate, out=predictedobs)
+                if obsoffset is not None: predictedobs += obsoffset
+                np.subtract(observations[t], predictedobs, out=innov)
+                if sequential:
+                    state[:] = priorstate
+                    statecov[:] = priorstatecov
+                    _, _, loglikelihoods[t] = self.__observesequentially(state, statecov, observations[t])
+                else:
+                    state[:], statecov[:], loglikelihoods[t] = self.__observecollapsed(priorstate, priorstatecov, observations[t])
+                states[t] = state
+                statecovs[t] = statecov
+                innovcovs[t] = np.nan
+                gains[t] = np.nan
+                continue
+
+            innovcov = innovcovs[t]
+            if sparseobsmap:
+                covobsmapt[:] = _dott(priorstatecov, obsmap)
+                innovcov[:] = obsmap.dot(covobsmapt)
+            else:
+                np.dot(priorstatecov, obsmapt, out=covobsmapt)
+                np.dot(obsmap, covobsmapt, out=innovcov)
+            innovcov += obsnoisecov
+
+            innov = innovs[t]
+            if sparseobsmap: predictedobs[:] = obsmap.dot(priorstate)
+            else: np.dot(obsmap, priorstate, out=predictedobs)
+            if obsoffset is not None: predictedobs += obsoffset
+            np.subtract(observations[t], predictedobs, out=innov)
+
+            gain = gains[t]
+            if scalarobs and innovcov[0,0] > 0.:
+                innovvar = innovcov[0,0]
+                np.divide(covobsmapt, innovvar, out=gain)
+                logdet = math.log(innovvar)
+                mahalanobis = innov[0] * innov[0] / innovvar
+            else:
+                gain[:], logdet, mahalanobis = _innovsolve(innovcov, covobsmapt, innov, self.repairstrategy)
+
+            np.dot(gain, innov, out=state)
+            state += priorstate
+            np.dot(gain, covobsmapt.T, out=statecov)
+            np.subtract(priorstatecov, statecov, out=statecov)
+
+            states[t] = state
+            statecovs[t] = statecov
+            loglikelihoods[t] = loglikelihoodconst - .5 * (logdet + mahalanobis)
+
+            if steadystatetol is not None:
+                if previousgain is not None and \
+                        np.max(np.abs(gain - previousgain)) < steadystatetol and \
+                        np.max(np.abs(statecov - previousstatecov)) < steadystatetol:
+                    # As in __checksteadystate, a converged innovation covariance that is not positive definite is not frozen.
+                    try:
+                        innovcovcholesky = np.linalg.cholesky(innovcov)
+                    except np.linalg.LinAlgError:
+                        innovcovcholesky = None
+                    if innovcovcholesky is not None:
+                        steadystate = _SteadyState(gain=gain.copy(), statecov=statecov.copy(), priorstatecov=priorstatecov.copy(),
+                                innovcov=innovcov.copy(), innovcovcholesky=innovcovcholesky,
+                                logdet=2. * np.sum(np.log(np.diagonal(innovcovcholesky))))
+                        steadyinnovcovinv = np.linalg.inv(steadystate.innovcov)
+                        steadystart = t + 1
+                previousgain, previousstatecov = gain, statecov.copy()
+
+        self.state = state
+        if steadystate is not None:
+            self.__fillsteadystate(steadystate, steadystart, timecount, statecovs, priorstatecovs, innovcovs, gains)
+            self.__statecov = steadystate.statecov
+            self.__priorstatecov = steadystate.priorstatecov
+            self.__steadystate = steadystate
+        else:
+            self.statecov = statecov
+            self.__priorstatecov = priorstatecov.copy()
+        self.__previousgain, self.__previousstatecov = previousgain, previousstatecov
+        self.__priorstate = npu.tondim2(priorstate, ndim1tocolumn=True, copy=True)
+        if timecount > 0:
+            self.predictedobs = npu.tondim2(predictedobs, ndim1tocolumn=True, copy=True)
+            self.innov = npu.tondim2(innovs[-1], ndim1tocolumn=True, copy=True)
+            self.innovcov = innovcovs[-1].copy()
+            self.gain = gains[-1].copy()
+            self._lastobs = npu.tondim2(observations[-1], ndim1tocolumn=True, copy=True)
+        self.loglikelihood += np.sum(loglikelihoods)
+
+        return KalmanFilterSeriesData(
+                states=states,
+                statecovs=statecovs,
+                innovs=innovs,
+                innovcovs=innovcovs,
+                gains=gains,
+                loglikelihoods=loglikelihoods,
+                priorstates=priorstates,
+                priorstatecovs=priorstatecovs,
+                initialstate=initialstate,
+                initialstatecov=initialstatecov)
+
+    def loglikelihoodandscore(self, observations, params, parameterisation):
+        r"""
+Returns the log-likelihood of observations and its gradient with respect to params, propagating the derivatives of the state,
+statecov and log-likelihood alongside the recursion. parameterisation maps the names of the system matrices (and of the initial
+state and statecov) to functions of params that return their values and Jacobians; everything else is taken from this filter,
+which is not advanced. See :func:`thalesians.filtering.lowlevel.score.loglikelihoodandscore`.
+        """
+        return _loglikelihoodandscore(self, observations, params, parameterisation)
+
 # --------------------------------------------------------------------------------------------------------------------------------------------------------------
 # Properties
 # --------------------------------------------------------------------------------------------------------------------------------------------------------------
@@ -184,6 +844,7 @@ The Kalman filter.
         return self.__statecov
 
     def __set_statecov(self, value):
+        self.__steadystate = None
         if value is not None:
             self.__statecov = npu.tondim2(value, copy=True)
             shape = np.shape(self.__statecov)
@@ -209,6 +870,8 @@ The Kalman filter.
         return self.__procnoisecov
 
     def __set_procnoisecov(self, value):
+        self.__invalidatesteadystate()
+        self.__forecastcache = None
         if value is not None:
             self.__procnoisecov = npu.tondim2(value, copy=True)
             shape = np.shape(self.__procnoisecov)
@@ -224,6 +887,9 @@ The Kalman filter.
         return self.__obsnoisecov
 
     def __set_obsnoisecov(self, value):
+        self.__invalidatesteadystate()
+        self.__sequentialobsmodel = None
+        self.__collapsedobsmodel = None
         if value is not None:
             self.__obsnoisecov = npu.tondim2(value, copy=True)
             shape = np.shape(self.__obsnoisecov)
@@ -239,9 +905,11 @@ The Kalman filter.
         return self.__procmap
 
     def __set_procmap(self, value):
+        self.__invalidatesteadystate()
+        self.__forecastcache = None
         if value is not None:
-            self.__procmap = npu.tondim2(value, copy=True)
-            shape = np.shape(self.__procmap)
+            self.__procmap = _tosystemmatrix(value)
+            shape = self.__procmap.shape
             assert shape[0] == shape[1], 'The transition matrix procmap must be square'
             assert (self.procdim is None) or (self.procdim == shape[0]), 'The transition matrix procmap must be procdim-by-procdim-dimensional'
             self.procdim = shape[0]
@@ -254,9 +922,12 @@ The Kalman filter.
         return self.__obsmap
 
     def __set_obsmap(self, value):
+        self.__invalidatesteadystate()
+        self.__sequentialobsmodel = None
+        self.__collapsedobsmodel = None
         if value is not None:
-            self.__obsmap = npu.tondim2(value, copy=True)
-            shape = np.shape(self.__obsmap)
+            self.__obsmap = _tosystemmatrix(value)
+            shape = self.__obsmap.shape
             assert (self.obsdim is None) or (self.obsdim == shape[0]), 'The measurement matrix obsmap must have obsdim (%d) rows; it has %d rows' % (self.obsdim, shape[0])
             assert (self.procdim is None) or (self.procdim == shape[1]), 'The measurement matrix obsmap must have procdim (%d) columns; it has %d columns' % (self.procdim, shape[1])
             self.obsdim = shape[0]
@@ -270,6 +941,7 @@ The Kalman filter.
         return self.__procoffset
     
     def __set_procoffset(self, value):
+        self.__forecastcache = None
         if value is not None:
             self.__procoffset = npu.tondim2(value, ndim1tocolumn=True, copy=True)
         else:
@@ -287,6 +959,27 @@ The Kalman filter.
             self.__obsoffset = None
     
     obsoffset = property(fget=__get_obsoffset, fset=__set_obsoffset)
+
+    def __get_procnoisemap(self):
+        return self.__procnoisemap
+
+    def __set_procnoisemap(self, value):
+        self.__invalidatesteadystate()
+        self.__forecastcache = None
+        self.__procnoisemap = None if value is None else _tosystemmatrix(value)
+
+    procnoisemap = property(fget=__get_procnoisemap, fset=__set_procnoisemap)
+
+    def __get_obsnoisemap(self):
+        return self.__obsnoisemap
+
+    def __set_obsnoisemap(self, value):
+        self.__invalidatesteadystate()
+        self.__sequentialobsmodel = None
+        self.__collapsedobsmodel = None
+        self.__obsnoisemap = None if value is None else _tosystemmatrix(value)
+
+    obsnoisemap = property(fget=__get_obsnoisemap, fset=__set_obsnoisemap)
     
     @property
     def mean(self): return self.state
@@ -0,0 +1,235 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from thalesians.filtering.lowlevel.kalman import KalmanFilterSeriesData, totimestack
+from thalesians.filtering.lowlevel.smoothing import SmoothedSeriesData
+from thalesians.maths.constants import MINUS_HALF_LN_2PI
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Associative scan
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# An element is a tuple of arrays whose leading dimension indexes the elements. combine(lefts, rights) combines two equally long
+# stacks of elements pairwise. The scan pairs up neighbouring elements, scans the pairs recursively and then fills in the
+# remaining positions, so it does O(timecount) work in O(log timecount) batched steps. Each batched step can be split into
+# blocks that are processed by a thread pool (NumPy releases the GIL inside its stacked linear algebra).
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def _take(elements, index):
+    return tuple(e[index] for e in elements)
+
+def _inblocks(function, arrays, executor, blocksize):
+    # Applies function, which maps a tuple of arrays to a tuple of arrays elementwise along the leading dimension, to arrays, one
+    # block at a time in the executor if there is one.
+    count = len(arrays[0])
+    if executor is None or count <= blocksize:
+        return function(*arrays)
+    starts = range(0, count, blocksize)
+    results = list(executor.map(lambda start: function(*(a[start:start+blocksize] for a in arrays)), starts))
+    return tuple(np.concatenate(r) for r in zip(*results))
+
+def _scan(elements, combine, executor, blocksize):
+    count = len(elements[0])
+    if count == 1: return elements
+    combineblocks = lambda lefts, rights: _inblocks(lambda *a: combine(a[:len(a)//2], a[len(a)//2:]), lefts + rights, executor, blocksize)
+    pairs = combineblocks(_take(elements, slice(0, count - 1, 2)), _take(elements, slice(1, count, 2)))
+    scannedpairs = _scan(pairs, combine, executor, blocksize)
+    results = tuple(np.empty_like(e) for e in elements)
+    for r, e, s in zip(results, elements, scannedpairs):
+        r[0] = e[0]
+        r[1::2] = s
+    if count > 2:
+        evens = combineblocks(_take(scannedpairs, slice(0, (count - 1) // 2)), _take(elements, slice(2, count, 2)))
+        for r, e in zip(results, evens): r[2::2] = e
+    return results
+
+def _transpose(stack):
+    return np.swapaxes(stack, -1, -2)
+
+def _symmetrise(stack):
+    return .5 * (stack + _transpose(stack))
+
+def _matvec(stack, vectors):
+    return np.einsum('tij,tj->ti', stack, vectors)
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Filtering
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Filtering element t is the conditional distribution of the state at time t given the state at time t-1 and observations[t],
+# N(A * x + b, C), together with the information that observations[t] carries about the state at time t-1, in the form of the
+# likelihood exp(-x^T * J * x / 2 + eta^T * x) (up to a constant). The prefix combinations of the elements are the filtered
+# distributions (Särkkä and García-Fernández, Temporal parallelization of Bayesian smoothers, 2021).
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def _combinefilteringelements(lefts, rights):
+    lefta, leftb, leftc, lefteta, leftj = lefts
+    righta, rightb, rightc, righteta, rightj = rights
+    # (I + leftc * rightj)^T = I + rightj * leftc, since covariances and precisions are symmetric.
+    identitypluscj = np.eye(np.shape(lefta)[-1]) + np.matmul(leftc, rightj)
+    rightatimesinv = _transpose(np.linalg.solve(_transpose(identitypluscj), _transpose(righta)))
+    leftattimesinv = _transpose(np.linalg.solve(identitypluscj, lefta))
+    return (np.matmul(rightatimesinv, lefta),
+            _matvec(rightatimesinv, leftb + _matvec(leftc, righteta)) + rightb,
+            _symmetrise(np.matmul(np.matmul(rightatimesinv, leftc), _transpose(righta))) + rightc,
+            _matvec(leftattimesinv, righteta - _matvec(rightj, leftb)) + lefteta,
+            _symmetrise(np.matmul(np.matmul(leftattimesinv, rightj), lefta)) + leftj)
+
+def _filteringelements(procmaps, procnoisecovs, procoffsets, obsmaps, obsnoisecovs, obsoffsets, observations, missing):
+    hq = np.matmul(obsmaps, procnoisecovs)
+    innovcovs = np.matmul(hq, _transpose(obsmaps)) + obsnoisecovs
+    gains = _transpose(np.linalg.solve(innovcovs, hq))
+    gains[missing] = 0.
+    resids = observations - _matvec(obsmaps, procoffsets) - obsoffsets
+    resids[missing] = 0.
+    kh = np.matmul(gains, obsmaps)
+    hf = np.matmul(obsmaps, procmaps)
+    hft = _transpose(hf)
+    solvedresids = np.linalg.solve(innovcovs, resids[:,:,np.newaxis])[:,:,0]
+    return (procmaps - np.matmul(kh, procmaps),
+            procoffsets + _matvec(gains, resids),
+            _symmetrise(procnoisecovs - np.matmul(kh, procnoisecovs)),
+            np.where(missing[:,np.newaxis], 0., _matvec(hft, solvedresids)),
+            np.where(missing[:,np.newaxis,np.newaxis], 0., np.matmul(hft, np.linalg.solve(innovcovs, hf))))
+
+def parallelfilterseries(kalmanfilter, observations, procmaps=None, obsmaps=None, procoffsets=None, obsoffsets=None, workers=None, blocksize=4096):
+    r"""
+A parallel-in-time equivalent of :meth:`thalesians.filtering.lowlevel.kalman.KalmanFilter.filterseries`: filters observations
+with the model and the initial state of kalmanfilter, which is not modified, and returns a
+:class:`thalesians.filtering.lowlevel.kalman.KalmanFilterSeriesData` with the same contents, up to rounding. Rows of observations
+containing a NaN are treated as missing, and procmaps, obsmaps, procoffsets and obsoffsets have the same meaning as in
+filterseries.
+
+The filtering recursion is expressed as an associative scan: the per-step elements are computed for all time steps at once,
+combined in O(log timecount) batched steps, and the innovations, gains and log-likelihoods are then recovered from the filtered
+states, again for all time steps at once. This does a few times more arithmetic than the sequential recursion, but no Python
+work per time step. If workers is greater than one, each batched step is split into blocks of at most blocksize time steps,
+which are processed by a pool of that many threads.
+    """
+    assert kalmanfilter.procnoisecov is not None, 'The process noise covariance is not set'
+    assert kalmanfilter.obsnoisecov is not None, 'The covariance matrix obsnoisecov is not set'
+    assert kalmanfilter.obsmap is not None or obsmaps is not None, 'The measurement matrix obsmap is not set'
+
+    observations = np.asarray(observations, dtype=float)
+    if np.ndim(observations) == 1: observations = observations[:,np.newaxis]
+    timecount, obsdim = np.shape(observations)
+    assert timecount > 0, 'There is nothing to filter'
+    procdim = kalmanfilter.procdim
+
+    def stack(series, value, shape):
+        series = totimestack(series, observations, shape)
+        if series is not None: return series
+        return np.broadcast_to(np.zeros(shape) if value is None else np.reshape(value, shape), (timecount,) + shape)
+
+    procmaps = stack(procmaps, np.eye(procdim) if kalmanfilter.procmap is None else kalmanfilter.procmap, (procdim, procdim))
+    obsmaps = stack(obsmaps, kalmanfilter.obsmap, (obsdim, procdim))
+    procoffsets = stack(procoffsets, kalmanfilter.procoffset, (procdim,))
+    obsoffsets = stack(obsoffsets, kalmanfilter.obsoffset, (obsdim,))
+    procnoisemap = np.eye(procdim) if kalmanfilter.procnoisemap is None else kalmanfilter.procnoisemap
+    procnoisecov = np.dot(np.dot(procnoisemap, kalmanfilter.procnoisecov), procnoisemap.T)
+    obsnoisemap = np.eye(obsdim) if kalmanfilter.obsnoisemap is None else kalmanfilter.obsnoisemap
+    obsnoisecov = np.dot(np.dot(obsnoisemap, kalmanfilter.obsnoisecov), obsnoisemap.T)
+    missing = np.isnan(observations).any(axis=1)
+
+    initialstate = np.ravel(kalmanfilter.state).copy()
+    initialstatecov = np.array(kalmanfilter.statecov, dtype=float)
+
+    # The first element starts from the prior at time 0 rather than from the state at time -1, so its A, eta and J vanish.
+    procnoisecovs = np.array(np.broadcast_to(procnoisecov, (timecount, procdim, procdim)))
+    procnoisecovs[0] = np.dot(np.dot(procmaps[0], initialstatecov), procmaps[0].T) + procnoisecov
+    firstprocoffsets = np.array(procoffsets)
+    firstprocoffsets[0] = np.dot(procmaps[0], initialstate) + procoffsets[0]
+
+    executor = ThreadPoolExecutor(max_workers=workers) if workers is not None and workers > 1 else None
+    try:
+        elements = _inblocks(
+                lambda pm, pnc, po, om, o, obs, miss: _filteringelements(pm, pnc, po, om, np.broadcast_to(obsnoisecov, (len(pm), obsdim, obsdim)), o, obs, miss),
+                (procmaps, procnoisecovs, firstprocoffsets, obsmaps, obsoffsets, observations, missing), executor, blocksize)
+        elements[0][0] = 0.
+        elements[3][0] = 0.
+        elements[4][0] = 0.
+        _, states, statecovs, _, _ = _scan(elements, _combinefilteringelements, executor, blocksize)
+    finally:
+        if executor is not None: executor.shutdown()
+
+    previousstates = np.concatenate((initialstate[np.newaxis,:], states[:-1]))
+    previousstatecovs = np.concatenate((initialstatecov[np.newaxis,:,:], statecovs[:-1]))
+    priorstates = _matvec(procmaps, previousstates) + procoffsets
+    priorstatecovs = _symmetrise(np.matmul(np.matmul(procmaps, previousstatecovs), _transpose(procmaps))) + procnoisecov
+    innovs = observations - _matvec(obsmaps, priorstates) - obsoffsets
+    covobsmapts = np.matmul(priorstatecovs, _transpose(obsmaps))
+    innovcovs = np.matmul(obsmaps, covobsmapts) + obsnoisecov
+    gains = _transpose(np.linalg.solve(innovcovs, _transpose(covobsmapts)))
+    _, logdets = np.linalg.slogdet(innovcovs)
+    mahalanobis = np.einsum('ti,ti->t', innovs, np.linalg.solve(innovcovs, np.where(missing[:,np.newaxis], 0., innovs)[:,:,np.newaxis])[:,:,0])
+    loglikelihoods = np.where(missing, 0., obsdim * MINUS_HALF_LN_2PI - .5 * (logdets + mahalanobis))
+    innovs[missing] = np.nan
+    innovcovs[missing] = np.nan
+    gains[missing] = np.nan
+
+    return KalmanFilterSeriesData(
+            states=states,
+            statecovs=statecovs,
+            innovs=innovs,
+            innovcovs=innovcovs,
+            gains=gains,
+            loglikelihoods=loglikelihoods,
+            priorstates=priorstates,
+            priorstatecovs=priorstatecovs,
+            initialstate=initialstate,
+            initialstatecov=initialstatecov)
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Smoothing
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Smoothing element t is the conditional distribution of the state at time t-1 given the state at time t and the observations up
+# to time t-1, N(E * x + g, L). Their suffix combinations are the smoothed distributions.
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def _combinesmoothingelements(lefts, rights):
+    # lefts are the later elements: the scan runs backwards in time.
+    latere, laterg, laterl = lefts
+    earliere, earlierg, earlierl = rights
+    return (np.matmul(earliere, latere),
+            _matvec(earliere, laterg) + earlierg,
+            _symmetrise(np.matmul(np.matmul(earliere, laterl), _transpose(earliere))) + earlierl)
+
+def parallelrtssmooth(seriesdata, procmap=None, workers=None, blocksize=4096):
+    r"""
+A parallel-in-time equivalent of :func:`thalesians.filtering.lowlevel.smoothing.rtssmooth`, taking the same arguments and
+returning the same :class:`thalesians.filtering.lowlevel.smoothing.SmoothedSeriesData`, up to rounding. The backward recursion
+is evaluated as an associative scan in O(log timecount) batched steps; workers and blocksize are as in
+:func:`parallelfilterseries`.
+    """
+    states, statecovs, priorstates, priorstatecovs = seriesdata.states, seriesdata.statecovs, seriesdata.priorstates, seriesdata.priorstatecovs
+    timecount, procdim = np.shape(states)
+    assert timecount > 0, 'There is nothing to smooth'
+
+    previousstates = np.concatenate((seriesdata.initialstate[np.newaxis,:], states[:-1]))
+    previousstatecovs = np.concatenate((seriesdata.initialstatecov[np.newaxis,:,:], statecovs[:-1]))
+
+    if procmap is None: procmap = np.eye(procdim)
+    procmap = np.asarray(procmap, dtype=float)
+    if np.ndim(procmap) == 2: procmap = np.broadcast_to(procmap, (timecount, procdim, procdim))
+
+    smoothergains = np.swapaxes(np.linalg.solve(priorstatecovs, np.matmul(procmap, previousstatecovs)), 1, 2)
+
+    # Elements for times -1, ..., timecount-2, followed by the last filtered state, in reverse order.
+    elements = (np.concatenate((np.zeros((1, procdim, procdim)), smoothergains[::-1])),
+            np.concatenate((states[-1:], (previousstates - _matvec(smoothergains, priorstates))[::-1])),
+            np.concatenate((statecovs[-1:], _symmetrise(previousstatecovs - np.matmul(np.matmul(smoothergains, priorstatecovs), _transpose(smoothergains)))[::-1])))
+
+    executor = ThreadPoolExecutor(max_workers=workers) if workers is not None and workers > 1 else None
+    try:
+        _, smoothedstates, smoothedstatecovs = _scan(elements, _combinesmoothingelements, executor, blocksize)
+    finally:
+        if executor is not None: executor.shutdown()
+    smoothedstates, smoothedstatecovs = smoothedstates[::-1], smoothedstatecovs[::-1]
+
+    lagonecovs = np.matmul(smoothedstatecovs[1:], np.swapaxes(smoothergains, 1, 2))
+
+    return SmoothedSeriesData(
+            states=np.ascontiguousarray(smoothedstates[1:]),
+            statecovs=np.ascontiguousarray(smoothedstatecovs[1:]),
+            lagonecovs=lagonecovs,
+            initialstate=smoothedstates[0].copy(),
+            initialstatecov=smoothedstatecovs[0].copy())
@@ -1,16 +1,173 @@
-class MultivariateWienerProcess(object):
-    def __init__(self, drift, covariance):
-        self.__drift = drift
-        self.__covariance = covariance
-        
-    def kalmanprocnoisecov(self):
-        pass
-        
-    def kalmanprocmap(self):
-        pass
-    
-    def kalmanprocoffset(self):
-        pass
-    
-    def kalmanprocnoisemap(self):
-        pass
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+import scipy.linalg as la
+
+import thalesians.maths.numpyutils as npu
+
+class KalmanDiscretisation(namedtuple('KalmanDiscretisation', (
+        'procmap',
+        'procnoisecov',
+        'procoffset'))):
+    r"""
+The transition of a continuous-time process over a time step dt, in the form used by
+:class:`thalesians.filtering.lowlevel.kalman.KalmanFilter`: the state after dt is procmap * state + procoffset plus a Gaussian
+noise with covariance procnoisecov.
+    """
+    __slots__ = ()
+
+class LinearSDEProcess(object):
+    r"""
+The multivariate linear stochastic differential equation
+
+    dX_t = (driftmatrix * X_t + driftoffset) dt + dW_t,
+
+where W is a Brownian motion with covariance matrix covariance per unit time (which may be singular). Its transition over any time
+step dt is Gaussian; :meth:`discretise` returns it as a :class:`KalmanDiscretisation`. The matrix exponential and the noise
+covariance integral are evaluated together by Van Loan's method, and the results are kept in a least-recently-used cache of up
+to cachesize entries keyed on dt, since irregularly spaced data typically repeat a small set of time steps.
+
+:param driftmatrix: The processdim-by-processdim drift matrix
+:param driftoffset: The processdim-dimensional constant drift
+:param covariance: The processdim-by-processdim covariance matrix of the driving Brownian motion per unit time
+:param cachesize: The maximum number of time steps whose discretisations are kept
+    """
+
+    def __init__(self, driftmatrix, driftoffset, covariance, cachesize=128):
+        self.__driftmatrix = npu.immutablecopyof(npu.tondim2(np.asarray(driftmatrix, dtype=float)))
+        self.__driftoffset = npu.immutablecopyof(npu.tondim1(np.asarray(driftoffset, dtype=float)))
+        self.__covariance = npu.immutablecopyof(npu.tondim2(np.asarray(covariance, dtype=float)))
+        self.processdim = np.shape(self.__driftmatrix)[0]
+        assert np.shape(self.__driftmatrix) == (self.processdim, self.processdim), 'The drift matrix must be square'
+        assert np.shape(self.__driftoffset) == (self.processdim,), 'The drift offset must be processdim-dimensional'
+        assert np.shape(self.__covariance) == (self.processdim, self.processdim), 'The covariance must be processdim-by-processdim-dimensional'
+        assert cachesize > 0, 'The cache size must be positive'
+        self.__cachesize = cachesize
+        self.__cache = OrderedDict()
+
+    def _discretise(self, dt):
+        # Van Loan: with n = processdim, the exponential of
+        #     [[-a, c, 0], [0, a^T, 0], [0, 0, 0]] * dt
+        # and of [[a, b], [0, 0]] * dt give exp(a * dt), the noise covariance integral and the integral of exp(a * s) * b.
+        n = self.processdim
+        a, b, c = self.__driftmatrix, self.__driftoffset, self.__covariance
+        covblock = np.zeros((2*n, 2*n))
+        covblock[:n,:n] = -a
+        covblock[:n,n:] = c
+        covblock[n:,n:] = a.T
+        covexp = la.expm(covblock * dt)
+        procmap = covexp[n:,n:].T
+        procnoisecov = np.dot(procmap, covexp[:n,n:])
+        offsetblock = np.zeros((n+1, n+1))
+        offsetblock[:n,:n] = a
+        offsetblock[:n,n] = b
+        procoffset = la.expm(offsetblock * dt)[:n,n]
+        return KalmanDiscretisation(procmap=procmap, procnoisecov=.5 * (procnoisecov + procnoisecov.T), procoffset=procoffset)
+
+    def discretise(self, dt):
+        r"""
+Returns the :class:`KalmanDiscretisation` of the process over the time step dt, from the cache if possible. The arrays are shared
+with the cache and must not be modified.
+        """
+        dt = float(dt)
+        discretisation = self.__cache.get(dt)
+        if discretisation is not None:
+            self.__cache.move_to_end(dt)
+            return discretisation
+        discretisation = KalmanDiscretisation(*(npu.immutablecopyof(m) for m in self._discretise(dt)))
+        self.__cache[dt] = discretisation
+        if len(self.__cache) > self.__cachesize:
+            self.__cache.popitem(last=False)
+        return discretisation
+
+    def discretiseseries(self, dts):
+        r"""
+Returns the :class:`KalmanDiscretisation` for each of the time steps dts, as len(dts)-by-processdim-by-processdim stacks of
+procmaps and procnoisecovs and a len(dts)-by-processdim stack of procoffsets, each distinct time step being discretised once.
+procmaps and procoffsets can be passed to :meth:`thalesians.filtering.lowlevel.kalman.KalmanFilter.filterseries` as they are.
+        """
+        uniquedts, indices = np.unique(np.ravel(np.asarray(dts, dtype=float)), return_inverse=True)
+        discretisations = [self.discretise(dt) for dt in uniquedts]
+        return KalmanDiscretisation(*(np.array([getattr(d, field) for d in discretisations])[indices] for field in KalmanDiscretisation._fields))
+
+    def kalmanprocmap(self, dt): return self.discretise(dt).procmap
+
+    def kalmanprocnoisecov(self, dt): return self.discretise(dt).procnoisecov
+
+    def kalmanprocoffset(self, dt): return self.discretise(dt).procoffset
+
+    def kalmanprocnoisemap(self, dt): return np.eye(self.processdim)
+
+    def __get_driftmatrix(self):
+        return self.__driftmatrix
+
+    driftmatrix = property(fget=__get_driftmatrix)
+
+    def __get_driftoffset(self):
+        return self.__driftoffset
+
+    driftoffset = property(fget=__get_driftoffset)
+
+    def __get_covariance(self):
+        return self.__covariance
+
+    covariance = property(fget=__get_covariance)
+
+class MultivariateWienerProcess(LinearSDEProcess):
+    r"""
+The Brownian motion with drift, dX_t = drift dt + dW_t, W having covariance matrix covariance per unit time.
+    """
+
+    def __init__(self, drift, covariance, cachesize=128):
+        drift = npu.tondim1(np.asarray(drift, dtype=float))
+        super(MultivariateWienerProcess, self).__init__(np.zeros((len(drift), len(drift))), drift, covariance, cachesize)
+
+    def _discretise(self, dt):
+        return KalmanDiscretisation(procmap=np.eye(self.processdim), procnoisecov=self.covariance * dt, procoffset=self.driftoffset * dt)
+
+    def __get_drift(self):
+        return self.driftoffset
+
+    drift = property(fget=__get_drift)
+
+class MultivariateOrnsteinUhlenbeckProcess(LinearSDEProcess):
+    r"""
+The Ornstein-Uhlenbeck process dX_t = -transition * (X_t - mean) dt + dW_t, W having covariance matrix covariance per unit time.
+The process mean-reverts to mean if the eigenvalues of transition have positive real parts.
+    """
+
+    def __init__(self, transition, mean, covariance, cachesize=128):
+        transition = npu.tondim2(np.asarray(transition, dtype=float))
+        mean = npu.tondim1(np.asarray(mean, dtype=float))
+        super(MultivariateOrnsteinUhlenbeckProcess, self).__init__(-transition, np.dot(transition, mean), covariance, cachesize)
+        self.__mean = npu.immutablecopyof(mean)
+
+    def _discretise(self, dt):
+        discretisation = super(MultivariateOrnsteinUhlenbeckProcess, self)._discretise(dt)
+        # (I - procmap) * mean is more accurate than the integral of the drift offset when transition is nearly singular.
+        return discretisation._replace(procoffset=self.__mean - np.dot(discretisation.procmap, self.__mean))
+
+    def __get_mean(self):
+        return self.__mean
+
+    mean = property(fget=__get_mean)
+
+class IntegratedOrnsteinUhlenbeckProcess(LinearSDEProcess):
+    r"""
+The integral Y of an Ornstein-Uhlenbeck process X: dY_t = X_t dt, dX_t = -transition * (X_t - mean) dt + dW_t, W having
+covariance matrix covariance per unit time. The state is (Y, X), of dimension twice that of X, and the noise covariances
+describe the joint transition of both.
+    """
+
+    def __init__(self, transition, mean, covariance, cachesize=128):
+        transition = npu.tondim2(np.asarray(transition, dtype=float))
+        mean = npu.tondim1(np.asarray(mean, dtype=float))
+        covariance = npu.tondim2(np.asarray(covariance, dtype=float))
+        n = len(mean)
+        driftmatrix = np.zeros((2*n, 2*n))
+        driftmatrix[:n,n:] = np.eye(n)
+        driftmatrix[n:,n:] = -transition
+        driftoffset = np.concatenate((np.zeros(n), np.dot(transition, mean)))
+        fullcovariance = np.zeros((2*n, 2*n))
+        fullcovariance[n:,n:] = covariance
+        super(IntegratedOrnsteinUhlenbeckProcess, self).__init__(driftmatrix, driftoffset, fullcovariance, cachesize)
@@ -0,0 +1,111 @@
+import numpy as np
+import scipy.linalg as la
+
+import thalesians.maths.numpyutils as npu
+from thalesians.maths.constants import MINUS_HALF_LN_2PI
+
+PARAMETERISABLES = ('state', 'statecov', 'procmap', 'procnoisecov', 'obsmap', 'obsnoisecov', 'procoffset', 'obsoffset')
+
+def loglikelihoodandscore(kalmanfilter, observations, params, parameterisation):
+    r"""
+Runs the Kalman filter over observations (as :meth:`thalesians.filtering.lowlevel.kalman.KalmanFilter.filterseries` does,
+treating rows that contain a NaN as missing) while propagating the derivatives of the state, of statecov and of the
+log-likelihood with respect to the parameter vector params, and returns the log-likelihood and its gradient (the score).
+
+parameterisation maps some of the names in :data:`PARAMETERISABLES` to functions of params. Each function returns a pair: the
+value of that matrix (or vector) at params and its Jacobian, an array of shape (len(params),) + value.shape whose k-th element is
+the derivative of the value with respect to params[k]. 'state' and 'statecov' refer to the initial state and its covariance.
+Everything that is not parameterised is taken, as a constant, from kalmanfilter, which is not modified. procnoisemap and
+obsnoisemap, if set on kalmanfilter, are treated as constants.
+
+A single pass costs about (1 + len(params)) filter passes' worth of arithmetic, all of it vectorised over the parameters, and
+gives the exact gradient, in place of the 2 * len(params) + 1 filter runs of a central finite-difference scheme.
+    """
+    assert all(name in PARAMETERISABLES for name in parameterisation), 'Can only parameterise %s' % (PARAMETERISABLES,)
+    params = np.ravel(np.asarray(params, dtype=float))
+    paramcount = len(params)
+
+    observations = np.asarray(observations, dtype=float)
+    if np.ndim(observations) == 1: observations = observations[:,np.newaxis]
+    obsdim = np.shape(observations)[1]
+    procdim = kalmanfilter.procdim
+
+    defaults = dict(state=kalmanfilter.state, statecov=kalmanfilter.statecov,
+            procmap=np.eye(procdim) if kalmanfilter.procmap is None else kalmanfilter.procmap,
+            procnoisecov=kalmanfilter.procnoisecov, obsmap=kalmanfilter.obsmap, obsnoisecov=kalmanfilter.obsnoisecov,
+            procoffset=np.zeros((procdim,)) if kalmanfilter.procoffset is None else kalmanfilter.procoffset,
+            obsoffset=np.zeros((obsdim,)) if kalmanfilter.obsoffset is None else kalmanfilter.obsoffset)
+    values = {}
+    for name in PARAMETERISABLES:
+        if name in parameterisation:
+            value, jacobian = parameterisation[name](params)
+        else:
+            value, jacobian = defaults[name], None
+        # The state and the offsets are propagated as one-dimensional arrays, the rest as two-dimensional ones.
+        value = np.ravel(value) if name in ('state', 'procoffset', 'obsoffset') else npu.tondim2(value)
+        value = np.asarray(value, dtype=float)
+        jacobian = np.zeros((paramcount,) + np.shape(value)) if jacobian is None else \
+                np.reshape(np.asarray(jacobian, dtype=float), (paramcount,) + np.shape(value))
+        values[name] = value, jacobian
+
+    # The noise maps are constant; fold them into the noise covariances and their derivatives.
+    for name, noisemap in (('procnoisecov', kalmanfilter.procnoisemap), ('obsnoisecov', kalmanfilter.obsnoisemap)):
+        if noisemap is not None:
+            value, jacobian = values[name]
+            values[name] = np.dot(np.dot(noisemap, value), noisemap.T), np.matmul(np.matmul(noisemap, jacobian), noisemap.T)
+
+    state, dstate = values['state']
+    statecov, dstatecov = values['statecov']
+    procmap, dprocmap = values['procmap']
+    procnoisecov, dprocnoisecov = values['procnoisecov']
+    obsmap, dobsmap = values['obsmap']
+    obsnoisecov, dobsnoisecov = values['obsnoisecov']
+    procoffset, dprocoffset = values['procoffset']
+    obsoffset, dobsoffset = values['obsoffset']
+
+    dobsmapt = np.swapaxes(dobsmap, 1, 2)
+
+    loglikelihood = 0.
+    score = np.zeros((paramcount,))
+    missing = np.isnan(observations).any(axis=1)
+
+    for t in range(np.shape(observations)[0]):
+        # Predict.
+        dstate = np.dot(dprocmap, state) + np.dot(dstate, procmap.T) + dprocoffset
+        state = np.dot(procmap, state) + procoffset
+        procmapstatecov = np.dot(procmap, statecov)
+        dprocmapstatecovprocmapt = np.matmul(np.matmul(dprocmap, statecov), procmap.T)
+        dstatecov = dprocmapstatecovprocmapt + np.swapaxes(dprocmapstatecovprocmapt, 1, 2) + \
+                np.matmul(np.matmul(procmap, dstatecov), procmap.T) + dprocnoisecov
+        statecov = np.dot(procmapstatecov, procmap.T) + procnoisecov
+
+        if missing[t]: continue
+
+        # Observe.
+        innov = observations[t] - np.dot(obsmap, state) - obsoffset
+        dinnov = -np.dot(dobsmap, state) - np.dot(dstate, obsmap.T) - dobsoffset
+        covobsmapt = np.dot(statecov, obsmap.T)
+        dcovobsmapt = np.matmul(dstatecov, obsmap.T) + np.matmul(statecov, dobsmapt)
+        innovcov = np.dot(obsmap, covobsmapt) + obsnoisecov
+        dobsmapcovobsmapt = np.matmul(dobsmap, covobsmapt)
+        dinnovcov = dobsmapcovobsmapt + np.swapaxes(dobsmapcovobsmapt, 1, 2) + np.matmul(np.matmul(obsmap, dstatecov), obsmap.T) + dobsnoisecov
+
+        cholesky = la.cho_factor(innovcov, lower=True, check_finite=False)
+        innovcovinv = la.cho_solve(cholesky, np.eye(obsdim), check_finite=False)
+        gain = np.dot(covobsmapt, innovcovinv)
+        dgain = np.matmul(dcovobsmapt - np.matmul(gain, dinnovcov), innovcovinv)
+        solvedinnov = np.dot(innovcovinv, innov)
+
+        logdet = 2. * np.sum(np.log(np.diagonal(cholesky[0])))
+        loglikelihood += obsdim * MINUS_HALF_LN_2PI - .5 * (logdet + np.dot(innov, solvedinnov))
+        score -= .5 * (np.einsum('ij,kji->k', innovcovinv, dinnovcov) + 2. * np.dot(dinnov, solvedinnov) -
+                np.einsum('i,kij,j->k', solvedinnov, dinnovcov, solvedinnov))
+
+        dstate = dstate + np.dot(dgain, innov) + np.dot(dinnov, gain.T)
+        state = state + np.dot(gain, innov)
+        gaininnovcov = np.dot(gain, innovcov)
+        dgaininnovcovgaint = np.matmul(dgain, gaininnovcov.T)
+        dstatecov = dstatecov - dgaininnovcovgaint - np.swapaxes(dgaininnovcovgaint, 1, 2) - np.matmul(np.matmul(gain, dinnovcov), gain.T)
+        statecov = statecov - np.dot(gaininnovcov, gain.T)
+
+    return loglikelihood, score
@@ -0,0 +1,66 @@
+from collections import namedtuple
+
+import numpy as np
+
+class SmoothedSeriesData(namedtuple('SmoothedSeriesData', (
+        'states',
+        'statecovs',
+        'lagonecovs',
+        'initialstate',
+        'initialstatecov'))):
+    r"""
+The output of :func:`rtssmooth`: the timecount-by-procdim smoothed states, the timecount-by-procdim-by-procdim smoothed state
+covariances, the timecount-by-procdim-by-procdim lag-one cross-covariances, lagonecovs[t] being the smoothed covariance of the
+state at time t with the state at time t-1, and the smoothed state the filter started from and its covariance (the state "at
+time -1", with which lagonecovs[0] is the cross-covariance).
+    """
+    __slots__ = ()
+
+def rtssmooth(seriesdata, procmap=None):
+    r"""
+The Rauch-Tung-Striebel smoother.
+
+Takes the :class:`thalesians.filtering.lowlevel.kalman.KalmanFilterSeriesData` recorded by
+:meth:`thalesians.filtering.lowlevel.kalman.KalmanFilter.filterseries` and the transition matrix used in the forward pass (a
+procdim-by-procdim matrix, or a timecount-by-procdim-by-procdim stack whose t-th element takes the state from time t-1 to time t;
+identity by default) and returns a :class:`SmoothedSeriesData`.
+
+The smoother gains depend only on the filtered quantities, so they are computed for all time steps at once with a single batched
+solve; only the (cheap) mean and covariance recursions run backwards step by step.
+    """
+    states, statecovs, priorstates, priorstatecovs = seriesdata.states, seriesdata.statecovs, seriesdata.priorstates, seriesdata.priorstatecovs
+    timecount, procdim = np.shape(states)
+    assert timecount > 0, 'There is nothing to smooth'
+
+    # The filtered (a posteriori) states and covariances at time t-1 for t = 0, ..., timecount-1, the first being where the filter
+    # started from.
+    previousstates = np.concatenate((seriesdata.initialstate[np.newaxis,:], states[:-1]))
+    previousstatecovs = np.concatenate((seriesdata.initialstatecov[np.newaxis,:,:], statecovs[:-1]))
+
+    if procmap is None: procmap = np.eye(procdim)
+    procmap = np.asarray(procmap, dtype=float)
+    if np.ndim(procmap) == 2: procmap = np.broadcast_to(procmap, (timecount, procdim, procdim))
+
+    # smoothergains[t] = previousstatecovs[t] * procmap[t]^T * priorstatecovs[t]^{-1}. Since priorstatecovs[t] is symmetric, its
+    # transpose solves priorstatecovs[t] * X = procmap[t] * previousstatecovs[t].
+    smoothergains = np.swapaxes(np.linalg.solve(priorstatecovs, np.matmul(procmap, previousstatecovs)), 1, 2)
+
+    smoothedstates = np.empty((timecount, procdim))
+    smoothedstatecovs = np.empty((timecount, procdim, procdim))
+    smoothedstate = states[-1].copy()
+    smoothedstatecov = statecovs[-1].copy()
+    for t in range(timecount - 1, -1, -1):
+        smoothedstates[t] = smoothedstate
+        smoothedstatecovs[t] = smoothedstatecov
+        smoothergain = smoothergains[t]
+        smoothedstate = previousstates[t] + np.dot(smoothergain, smoothedstate - priorstates[t])
+        smoothedstatecov = previousstatecovs[t] + np.dot(np.dot(smoothergain, smoothedstatecov - priorstatecovs[t]), smoothergain.T)
+
+    lagonecovs = np.matmul(smoothedstatecovs, np.swapaxes(smoothergains, 1, 2))
+
+    return SmoothedSeriesData(
+            states=smoothedstates,
+            statecovs=smoothedstatecovs,
+            lagonecovs=lagonecovs,
+            initialstate=smoothedstate,
+            initialstatecov=smoothedstatecov)
@@ -0,0 +1,361 @@
+import numpy as np
+import scipy.linalg as la
+
+import thalesians.maths.numpyutils as npu
+from thalesians.maths.constants import MINUS_HALF_LN_2PI
+
+def sqrtfactor(cov, dtype=np.float64):
+    r"""
+Returns a lower-triangular A such that A * A^T = cov. If cov is only positive semidefinite (e.g. a process noise covariance of
+reduced rank), the Cholesky factorisation fails and we return the (non-triangular) symmetric square root instead, which is all
+that the QR-based updates below require.
+    """
+    cov = npu.tondim2(cov, copy=False).astype(dtype)
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        eigvals, eigvecs = np.linalg.eigh(.5 * (cov + cov.T))
+        return (eigvecs * np.sqrt(np.maximum(eigvals, 0.))).astype(dtype)
+
+def triangularise(prearray):
+    r"""
+Given a pre-array M, returns a lower-triangular B with B * B^T = M * M^T, computed from the QR decomposition of M^T. The diagonal
+of B is made nonnegative.
+    """
+    r = np.linalg.qr(prearray.T, mode='r')
+    signs = np.sign(np.diagonal(r))
+    signs[signs == 0.] = 1.
+    return (r * signs[:,np.newaxis]).T
+
+def cholupdate(factor, vector, downdate=False):
+    r"""
+Given a lower-triangular A with a positive diagonal and a vector u, returns the lower-triangular B with B * B^T = A * A^T + u * u^T
+(or A * A^T - u * u^T if downdate is True), in O(n^2) operations rather than the O(n^3) of refactorising. Raises
+numpy.linalg.LinAlgError if the downdated matrix is not positive definite.
+    """
+    factor = np.array(factor, dtype=np.result_type(factor, np.float64))
+    u = np.array(np.ravel(vector), dtype=factor.dtype)
+    sign = -1. if downdate else 1.
+    for k in range(len(u)):
+        diag = factor[k,k]
+        rsquared = diag * diag + sign * u[k] * u[k]
+        if rsquared <= 0.: raise np.linalg.LinAlgError('The downdated matrix is not positive definite')
+        r = np.sqrt(rsquared)
+        c, s = r / diag, u[k] / diag
+        factor[k,k] = r
+        factor[k+1:,k] = (factor[k+1:,k] + sign * s * u[k+1:]) / c
+        u[k+1:] = c * u[k+1:] - s * factor[k+1:,k]
+    return factor
+
+class SquareRootKalmanFilter(object):
+    r"""
+The square-root (factored covariance) Kalman filter.
+
+Has the same predict/observe surface as :class:`thalesians.filtering.lowlevel.kalman.KalmanFilter`, but instead of statecov it
+propagates a lower-triangular factor statecovsqrt, with statecov = statecovsqrt * statecovsqrt^T. Both the time update and the
+measurement update are carried out by QR-triangularising pre-arrays built from the factors, so the implied statecov is symmetric
+and positive semidefinite by construction and no symmetrisation or jitter is ever needed. This also makes the filter usable in
+single precision: pass dtype=np.float32.
+
+:param state: The initial procdim-dimensional estimate of the state of the system
+:param statecov: The procdim-by-procdim-dimensional a posteriori error covariance matrix
+:param procnoisecov: The procdim-by-procdim-dimensional covariance matrix of the state noise process
+:param obsnoisecov: The obsdim-by-obsdim-dimensional covariance matrix of the measurement noise process
+:param procmap: The procdim-by-procdim-dimensional transition matrix; identity by default
+:param obsmap: The obsdim-by-procdim-dimensional measurement matrix
+:param procoffset: The procdim-dimensional offset added to the state at the predict step
+:param obsoffset: The obsdim-dimensional offset added to the predicted observation
+:param procnoisemap: The matrix applied to the process noise; identity by default
+:param obsnoisemap: The matrix applied to the measurement noise; identity by default
+:param dtype: The floating point type in which the filter is run
+    """
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Constructor
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, state=None, statecov=None, procnoisecov=None, obsnoisecov=None, procmap=None, obsmap=None, procoffset=None, obsoffset=None, procnoisemap=None, obsnoisemap=None, dtype=np.float64):
+        self.dtype = dtype
+        self.procdim = None
+        self.obsdim = None
+
+        self.state = state
+        self.statecov = statecov
+        self.__priorstate = None
+        self.__priorstatecovsqrt = None
+        self.__procnoisecov = None
+        self.__obsnoisecov = None
+        self.procnoisemap = procnoisemap
+        self.obsnoisemap = obsnoisemap
+        self.procnoisecov = procnoisecov
+        self.obsnoisecov = obsnoisecov
+        self.procmap = procmap
+        self.obsmap = obsmap
+        self.procoffset = procoffset
+        self.obsoffset = obsoffset
+
+        self.predictedobs = None
+        self.lastobs = None
+        self.innov = None
+        self.innovcovsqrt = None
+        self.gain = None
+
+        self.loglikelihood = 0.0
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Predict and observe
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def predict(self, **kwargs):
+        assert self.__procnoisecovsqrt is not None, 'The process noise covariance is not set'
+
+        if self.__procmap is None:
+            self.__state = self.__state.copy()
+            procmapstatecovsqrt = self.__statecovsqrt
+        else:
+            self.__state = np.dot(self.__procmap, self.__state)
+            procmapstatecovsqrt = np.dot(self.__procmap, self.__statecovsqrt)
+        if self.__procoffset is not None:
+            self.__state += self.__procoffset
+
+        # The time update: [procmap * statecovsqrt, procnoisecovsqrt] is a (non-triangular) square root of the prior statecov.
+        self.__statecovsqrt = triangularise(np.hstack((procmapstatecovsqrt, self.__procnoisecovsqrt)))
+
+        self.__priorstate = self.__state
+        self.__priorstatecovsqrt = self.__statecovsqrt
+
+        return self.__state
+
+    def observe(self, obs, **kwargs):
+        if 'obsnoisecov' in kwargs:
+            obsnoisecovsqrt = self.__noisecovsqrt(kwargs['obsnoisecov'], self.__obsnoisemap)
+        else:
+            obsnoisecovsqrt = self.__obsnoisecovsqrt
+
+        assert obsnoisecovsqrt is not None, 'The covariance matrix obsnoisecov is not set'
+        assert self.__obsmap is not None, 'The measurement matrix obsmap is not set'
+
+        obs = npu.tondim2(obs, ndim1tocolumn=True, copy=False).astype(self.dtype)
+
+        self.predictedobs = np.dot(self.__obsmap, self.__state)
+        if self.__obsoffset is not None:
+            self.predictedobs += self.__obsoffset
+        self.innov = obs - self.predictedobs
+
+        # The measurement update. Triangularising the pre-array
+        #
+        #     [ obsnoisecovsqrt  obsmap * statecovsqrt ]
+        #     [ 0                statecovsqrt          ]
+        #
+        # gives the post-array
+        #
+        #     [ innovcovsqrt     0                     ]
+        #     [ scaledgain       posterior statecovsqrt ]
+        #
+        # where gain = scaledgain * innovcovsqrt^{-1}.
+        obsdim, procdim = self.obsdim, self.procdim
+        prearray = np.zeros((obsdim + procdim, obsdim + procdim), dtype=self.dtype)
+        prearray[:obsdim,:obsdim] = obsnoisecovsqrt
+        prearray[:obsdim,obsdim:] = np.dot(self.__obsmap, self.__statecovsqrt)
+        prearray[obsdim:,obsdim:] = self.__statecovsqrt
+        postarray = triangularise(prearray)
+        self.innovcovsqrt = postarray[:obsdim,:obsdim]
+        scaledgain = postarray[obsdim:,:obsdim]
+        self.__statecovsqrt = np.array(postarray[obsdim:,obsdim:])
+
+        whitenedinnov = la.solve_triangular(self.innovcovsqrt, self.innov, lower=True, check_finite=False)
+        self.__state = self.__state + np.dot(scaledgain, whitenedinnov)
+        self.gain = la.solve_triangular(self.innovcovsqrt, scaledgain.T, lower=True, trans='T', check_finite=False).T
+
+        logdet = 2. * float(np.sum(np.log(np.abs(np.diagonal(self.innovcovsqrt)))))
+        self.loglikelihood += obsdim * MINUS_HALF_LN_2PI - .5 * (logdet + float(np.vdot(whitenedinnov, whitenedinnov)))
+
+        self.lastobs = obs
+
+        return self.__state
+
+    def predictAndObserve(self, obs, **kwargs):
+        self.predict(**kwargs)
+        return self.observe(obs, **kwargs)
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Properties
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# The noise covariances are factorised once, when they are set, together with their noise maps. statecov, priorstatecov and
+# innovcov are formed from their factors only when they are read.
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __noisecovsqrt(self, cov, noisemap):
+        covsqrt = sqrtfactor(cov, self.dtype)
+        return covsqrt if noisemap is None else np.dot(noisemap, covsqrt)
+
+    def __todtype(self, value, ndim1tocolumn=False):
+        return npu.tondim2(value, ndim1tocolumn=ndim1tocolumn, copy=True).astype(self.dtype)
+
+    def __setprocdim(self, procdim, message):
+        assert (self.procdim is None) or (self.procdim == procdim), message
+        self.procdim = procdim
+
+    def __setobsdim(self, obsdim, message):
+        assert (self.obsdim is None) or (self.obsdim == obsdim), message
+        self.obsdim = obsdim
+
+    def __get_state(self):
+        return self.__state
+
+    def __set_state(self, value):
+        if value is not None:
+            self.__state = self.__todtype(value, ndim1tocolumn=True)
+            self.__setprocdim(np.shape(self.__state)[0], 'The state must be procdim-dimensional')
+        else:
+            self.__state = None
+
+    state = property(fget=__get_state, fset=__set_state, doc='The procdim-dimensional estimate of the state of the system')
+
+    def __get_statecovsqrt(self):
+        return self.__statecovsqrt
+
+    def __set_statecovsqrt(self, value):
+        if value is not None:
+            self.__statecovsqrt = self.__todtype(value)
+            self.__setprocdim(np.shape(self.__statecovsqrt)[0], 'The state covariance factor must be procdim-by-procdim-dimensional')
+        else:
+            self.__statecovsqrt = None
+
+    statecovsqrt = property(fget=__get_statecovsqrt, fset=__set_statecovsqrt, doc='The lower-triangular factor of statecov')
+
+    def __get_statecov(self):
+        return None if self.__statecovsqrt is None else np.dot(self.__statecovsqrt, self.__statecovsqrt.T)
+
+    def __set_statecov(self, value):
+        if value is not None:
+            value = npu.tondim2(value)
+            assert np.shape(value)[0] == np.shape(value)[1], 'The state covariance must be square'
+            self.statecovsqrt = sqrtfactor(value, self.dtype)
+        else:
+            self.__statecovsqrt = None
+
+    statecov = property(fget=__get_statecov, fset=__set_statecov, doc='The procdim-by-procdim-dimensional a posteriori error covariance matrix (a measure of the estimated accuracy of the state estimate)')
+
+    def __get_priorstate(self):
+        return self.__priorstate
+
+    priorstate = property(fget=__get_priorstate, doc='The procdim-dimensional predicted state of the system')
+
+    def __get_priorstatecov(self):
+        return None if self.__priorstatecovsqrt is None else np.dot(self.__priorstatecovsqrt, self.__priorstatecovsqrt.T)
+
+    priorstatecov = property(fget=__get_priorstatecov, doc='The procdim-by-procdim-dimensional a priori error covariance matrix')
+
+    def __get_innovcov(self):
+        return None if self.innovcovsqrt is None else np.dot(self.innovcovsqrt, self.innovcovsqrt.T)
+
+    innovcov = property(fget=__get_innovcov, doc='The obsdim-by-obsdim-dimensional covariance of the latest innovation')
+
+    def __get_procnoisecov(self):
+        return self.__procnoisecov
+
+    def __set_procnoisecov(self, value):
+        if value is not None:
+            self.__procnoisecov = npu.tondim2(value, copy=True)
+            assert np.shape(self.__procnoisecov)[0] == np.shape(self.__procnoisecov)[1], 'The covariance matrix procnoisecov must be square'
+            self.__procnoisecovsqrt = self.__noisecovsqrt(self.__procnoisecov, self.__procnoisemap)
+            self.__setprocdim(np.shape(self.__procnoisecovsqrt)[0], 'The process noise covariance must map to procdim dimensions')
+        else:
+            self.__procnoisecov = None
+            self.__procnoisecovsqrt = None
+
+    procnoisecov = property(fget=__get_procnoisecov, fset=__set_procnoisecov, doc='The covariance matrix of the state noise process')
+
+    def __get_obsnoisecov(self):
+        return self.__obsnoisecov
+
+    def __set_obsnoisecov(self, value):
+        if value is not None:
+            self.__obsnoisecov = npu.tondim2(value, copy=True)
+            assert np.shape(self.__obsnoisecov)[0] == np.shape(self.__obsnoisecov)[1], 'The covariance matrix obsnoisecov must be square'
+            self.__obsnoisecovsqrt = self.__noisecovsqrt(self.__obsnoisecov, self.__obsnoisemap)
+            self.__setobsdim(np.shape(self.__obsnoisecovsqrt)[0], 'The covariance matrix obsnoisecov must map to obsdim dimensions')
+        else:
+            self.__obsnoisecov = None
+            self.__obsnoisecovsqrt = None
+
+    obsnoisecov = property(fget=__get_obsnoisecov, fset=__set_obsnoisecov, doc='The covariance matrix of the measurement noise process')
+
+    def __get_procmap(self):
+        return self.__procmap
+
+    def __set_procmap(self, value):
+        if value is not None:
+            self.__procmap = self.__todtype(value)
+            shape = np.shape(self.__procmap)
+            assert shape[0] == shape[1], 'The transition matrix procmap must be square'
+            self.__setprocdim(shape[0], 'The transition matrix procmap must be procdim-by-procdim-dimensional')
+        else:
+            self.__procmap = None
+
+    procmap = property(fget=__get_procmap, fset=__set_procmap, doc='The procdim-by-procdim-dimensional transition matrix taking the state from time k to time k+1')
+
+    def __get_obsmap(self):
+        return self.__obsmap
+
+    def __set_obsmap(self, value):
+        if value is not None:
+            self.__obsmap = self.__todtype(value)
+            shape = np.shape(self.__obsmap)
+            self.__setobsdim(shape[0], 'The measurement matrix obsmap must have obsdim rows')
+            self.__setprocdim(shape[1], 'The measurement matrix obsmap must have procdim columns')
+        else:
+            self.__obsmap = None
+
+    obsmap = property(fget=__get_obsmap, fset=__set_obsmap, doc='The obsdim-by-procdim-dimensional measurement matrix')
+
+    def __get_procoffset(self):
+        return self.__procoffset
+
+    def __set_procoffset(self, value):
+        self.__procoffset = None if value is None else self.__todtype(value, ndim1tocolumn=True)
+
+    procoffset = property(fget=__get_procoffset, fset=__set_procoffset)
+
+    def __get_obsoffset(self):
+        return self.__obsoffset
+
+    def __set_obsoffset(self, value):
+        self.__obsoffset = None if value is None else self.__todtype(value, ndim1tocolumn=True)
+
+    obsoffset = property(fget=__get_obsoffset, fset=__set_obsoffset)
+
+    def __get_procnoisemap(self):
+        return self.__procnoisemap
+
+    def __set_procnoisemap(self, value):
+        self.__procnoisemap = None if value is None else self.__todtype(value)
+        if self.__procnoisecov is not None:
+            self.procnoisecov = self.__procnoisecov
+
+    procnoisemap = property(fget=__get_procnoisemap, fset=__set_procnoisemap)
+
+    def __get_obsnoisemap(self):
+        return self.__obsnoisemap
+
+    def __set_obsnoisemap(self, value):
+        self.__obsnoisemap = None if value is None else self.__todtype(value)
+        if self.__obsnoisecov is not None:
+            self.obsnoisecov = self.__obsnoisecov
+
+    obsnoisemap = property(fget=__get_obsnoisemap, fset=__set_obsnoisemap)
+
+    @property
+    def mean(self): return self.state
+
+    @property
+    def var(self): return self.statecov
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# Special methods
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __str__(self):
+        return 'SquareRootKalmanFilter(procdim=%s, obsdim=%s, state=%s, statecov=%s, innov=%s, innovcov=%s)' % (
+            self.procdim, self.obsdim, self.state, self.statecov, self.innov, self.innovcov)
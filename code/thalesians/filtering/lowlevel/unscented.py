@@ -3,170 +3,237 @@ import warnings
 import numpy as np
 import scipy.linalg as la
 
-from filtering.nearpd import nearpd
-
-def sigmaPoints(x, P, alef=3.0):
-    n = np.shape(x)[0]
-    lmbda = alef - n
-    # lambda is a keyword in Python, hence "lmbda".
-    nPlusLambda = n + lmbda
-
-    # NB! Depending on convention, by a matrix square root pf P we may mean
-    # either (i) A such that A^T * A = P or (ii) A such that A * A^T = P.
-    # Unfortunately, [Wan-2000]_ does not explain why it is important to use the
-    # right convention. As pointed our in [Julier-2004]_, page 406, footnote 5,
-    # if the matrix square root follows convention (i), then the sigma points
-    # are formed from the ROWS of A. However, if the matrix square root follows
-    # convention (ii), then the sigma points are formed from the COLUMNS of A.
-    # Python's scipy.linalg.cholesky follows convention (i):
-    #
-    # >>> P = np.array([[1.,2.],[2.,5.]])
-    # >>> A = scipy.linalg.cholesky(P)
-    # >>> np.dot(A.T, A)    # matches P; convention (i)
-    # >>> np.dot(A, A.T)    # does not match P; convention (ii)
-    #
-    # However, we would like to use convention (ii), in which the sigma points
-    # are formed from the columns of A. Therefore we transpose the result of
-    # scipy.linalg.cholesky.
-
-    sqrtP = la.cholesky(nPlusLambda * P).T
-
-    # The above is a Cholesky square root. Could also use a symmetric square
-    # root:
-    #
-    #     sqrtP = scipy.linalg.matfuncs.toreal(
-    #         scipy.linalg.matfuncs.sqrtm(nPlusLambda * P))
-    #
-    # This method relies on the work by Higham [Higham-1986]_, [Higham-1984]_.
-
-    sigmaPointCount = 2*n+1
-    X = np.zeros((n, sigmaPointCount))
-    Wm = np.zeros(sigmaPointCount)
-    Wc = np.zeros(sigmaPointCount)
-    X[:,0] = x.reshape(n)
-    Wm[0] = lmbda / nPlusLambda
-    Wc[0] = 1.0/(2.0*nPlusLambda)
-
-
-    weight = 1.0 / (2.0 * nPlusLambda)
-    for i in range(0, n):
-        index0 = i+1
-        index1 = i+1+n
-        X[:,index0] = x.reshape(n) + sqrtP[:,i].reshape(n)
-        X[:,index1] = x.reshape(n) - sqrtP[:,i].reshape(n)
-        Wm[index0]  = weight
-        Wm[index1]  = weight
-        Wc[index0]  = weight
-        Wc[index1]  = weight
-
+from thalesians.filtering.lowlevel.gaussian import GaussianFilter, PointSet
+from thalesians.filtering.lowlevel.sqrtkalman import cholupdate, sqrtfactor, triangularise
+from thalesians.maths.nearpd import RepairStrategy, repairedcholesky
+import thalesians.maths.numpyutils as npu
+from thalesians.maths.constants import MINUS_HALF_LN_2PI
+
+_sigmaPointWeights = {}
+
+def sigmaPointWeights(n, alef=3.0):
+    r"""
+Returns the (read-only) mean and covariance weights Wm and Wc of the 2n+1 sigma points of :func:`sigmaPoints`. They depend only on n
+and alef, and are computed once for each pair.
+    """
+    key = (n, alef)
+    weights = _sigmaPointWeights.get(key)
+    if weights is None:
+        lmbda = alef - n
+        # lambda is a keyword in Python, hence "lmbda".
+        nPlusLambda = n + lmbda
+        Wm = np.full(2*n+1, 1.0 / (2.0 * nPlusLambda))
+        Wc = Wm.copy()
+        Wm[0] = lmbda / nPlusLambda
+        weights = (npu.immutablecopyof(Wm), npu.immutablecopyof(Wc))
+        _sigmaPointWeights[key] = weights
+    return weights
+
+def sigmaPoints(x, P, alef=3.0, sqrtP=None):
+    r"""
+Returns the n-by-(2n+1) matrix X whose columns are the sigma points of the mean x and covariance P, together with their weights
+Wm and Wc (see :func:`sigmaPointWeights`).
+
+:param x: The n-dimensional mean, or a B-by-n stack of means
+:param P: The n-by-n covariance, or a B-by-n-by-n stack of covariances. Not used (and may be None) if sqrtP is given
+:param alef: The spread parameter n + lambda
+:param sqrtP: Optionally, the already computed lower Cholesky factor of P (or a stack of them), so that P need not be factorised
+    again. With stacks, X is B-by-n-by-(2n+1)
+    """
+    if sqrtP is None:
+        # NB! Depending on convention, by a matrix square root pf P we may mean
+        # either (i) A such that A^T * A = P or (ii) A such that A * A^T = P.
+        # Unfortunately, [Wan-2000]_ does not explain why it is important to use the
+        # right convention. As pointed our in [Julier-2004]_, page 406, footnote 5,
+        # if the matrix square root follows convention (i), then the sigma points
+        # are formed from the ROWS of A. However, if the matrix square root follows
+        # convention (ii), then the sigma points are formed from the COLUMNS of A.
+        # numpy.linalg.cholesky follows convention (ii), returning the lower
+        # triangular factor, and factorises a stack of matrices in one call.
+        #
+        # Could also use a symmetric square root:
+        #
+        #     sqrtP = scipy.linalg.matfuncs.toreal(
+        #         scipy.linalg.matfuncs.sqrtm(P))
+        #
+        # This method relies on the work by Higham [Higham-1986]_, [Higham-1984]_.
+        sqrtP = np.linalg.cholesky(np.asarray(P, dtype=float))
+    sqrtP = np.asarray(sqrtP, dtype=float)
+    n = np.shape(sqrtP)[-1]
+    x = np.reshape(np.asarray(x, dtype=float), np.shape(sqrtP)[:-2] + (n, 1))
+    Wm, Wc = sigmaPointWeights(n, alef)
+
+    # The spread n + lambda equals alef.
+    scaledSqrtP = np.sqrt(alef) * sqrtP
+    X = x + np.concatenate((np.zeros_like(x), scaledSqrtP, -scaledSqrtP), axis=-1)
     return X, Wm, Wc
 
 def unscentedTransform(X, Wm, Wc, f):
-    Y = None
-    Ymean = None
-    fdim = None
-    N = np.shape(X)[1]
-    for j in range(0,N):
-        fImage = f(X[:,j])
-        if Y is None:
-            fdim = np.size(fImage)
-            Y = np.zeros((fdim, np.shape(X)[1]))
-            Ymean = np.zeros(fdim)
-        Y[:,j] = fImage
-        Ymean += Wm[j] * Y[:,j]
-    Ycov = np.zeros((fdim, fdim))
-    for j in range(0, N):
-        meanAdjustedYj = Y[:,j] - Ymean
-        Ycov += np.outer(Wc[j] * meanAdjustedYj, meanAdjustedYj)
+    r"""
+Propagates the sigma points, the columns of X, through f and returns their images Y (one column per sigma point), the weighted
+mean of Y and its weighted covariance. If f is marked with :func:`thalesians.maths.numpyutils.vectorised`, it is called once on the
+whole of X and must return the matrix Y; otherwise it is called on each column of X in turn. A vectorised f may also be given a
+B-by-n-by-(2n+1) stack of sigma points from :func:`sigmaPoints`, and must then return a stack; the means and covariances are
+stacked likewise.
+    """
+    if npu.isvectorised(f):
+        Y = np.asarray(f(X), dtype=float)
+        if np.ndim(Y) < 2: Y = npu.tondim2(Y)
+    else:
+        Y = np.column_stack([np.ravel(f(X[:,j])) for j in range(np.shape(X)[1])])
+    Ymean = np.matmul(Y, Wm)
+    meanAdjustedY = Y - Ymean[...,np.newaxis]
+    Ycov = np.matmul(meanAdjustedY * Wc, np.swapaxes(meanAdjustedY, -1, -2))
     return Y, Ymean, Ycov
 
-class UnscentedKalmanFilter(object):
-    MINUS_HALF_LN_2PI = -.5 * np.log(2. * np.pi)
-
-    def __init__(self, x0, P0, Q, R, cor, f, h):        
-        self.Q = Q
-        self.R = R
-        self.cor = cor
-        self.fa = lambda col: f(col[0], col[2])
-        self.ha = lambda col: h(col[0], col[1])
-        
-        Pxx = P0
-        Pxv = 0.
-        self.xa = np.array( ((x0,), (0.,), (0.,), (0.,)) )
-        self.Pa = np.array( ((Pxx, Pxv   , 0.      , 0.      ),
-                             (Pxv, self.R, 0.      , 0.      ),
-                             (0. , 0.    , self.Q  , self.cor),
-                             (0. , 0.    , self.cor, self.R  )) )
-        
-        self.lastobservation = np.NAN
-        self.predictedobservation = np.NAN
-        self.innov = np.NAN
-        self.innovcov = np.NAN
-        self.gain = np.NAN
-        
+def _weightedsqrt(deviations, Wc):
+    # The lower-triangular factor of sum_j Wc[j] * deviations[:,j] * deviations[:,j]^T: a QR of the columns with the (equal,
+    # positive) weights of the outer sigma points, followed by a rank-one update or, if Wc[0] is negative, downdate.
+    factor = triangularise(deviations[:,1:] * np.sqrt(Wc[1:]))
+    return cholupdate(factor, np.sqrt(np.abs(Wc[0])) * deviations[:,0], downdate=Wc[0] < 0.)
+
+class UnscentedPointSet(PointSet):
+    r"""
+The 2n+1 sigma points of :func:`sigmaPoints`, as a :class:`thalesians.filtering.lowlevel.gaussian.PointSet`.
+    """
+
+    def __init__(self, alef=3.0):
+        super(UnscentedPointSet, self).__init__()
+        self.alef = alef
+
+    def _unitpoints(self, n):
+        Z, _, _ = sigmaPoints(np.zeros(n), None, self.alef, sqrtP=np.eye(n))
+        return (Z,) + sigmaPointWeights(n, self.alef)
+
+    def points(self, mean, sqrtcov):
+        return sigmaPoints(mean, None, self.alef, sqrtP=sqrtcov)
+
+    def __str__(self):
+        return 'UnscentedPointSet(alef=%s)' % self.alef
+
+class UnscentedKalmanFilter(GaussianFilter):
+    r"""
+The unscented Kalman filter: the :class:`thalesians.filtering.lowlevel.gaussian.GaussianFilter`, for the same system and with the
+same parameters, with the sigma points of :func:`sigmaPoints`, whose spread parameter n + lambda is alef.
+    """
+
+    def __init__(self, x0, P0, Q, R, cor, f, h, alef=3.0, repairstrategy=RepairStrategy.jitter):
+        super(UnscentedKalmanFilter, self).__init__(x0, P0, Q, R, cor, f, h, UnscentedPointSet(alef), repairstrategy)
+        self.alef = alef
+
+class SquareRootUnscentedKalmanFilter(object):
+    r"""
+The square-root form of :class:`UnscentedKalmanFilter`, for the same system and with the same parameters. Instead of the covariance
+of the state it carries its lower-triangular Cholesky factor statecovsqrt, and the factors are never formed by a Cholesky
+decomposition: the sigma points are drawn directly from them, the factors of the predicted covariances are obtained from the
+weighted sigma-point deviations by a QR decomposition and a rank-one update, and the update of statecovsqrt at the observe step is a
+sequence of rank-one downdates. The covariances therefore stay positive definite without the nearest positive definite repairs
+that :class:`UnscentedKalmanFilter` may need, and each step has a fixed cost. Only if rounding makes a downdate fail (as with
+nearly noise-free observations) is the updated covariance formed and refactorised, repaired according to repairstrategy.
+    """
+
+    def __init__(self, x0, P0, Q, R, cor, f, h, alef=3.0, repairstrategy=RepairStrategy.jitter):
+        self.__x = np.array(npu.tondim2(x0, ndim1tocolumn=True), dtype=float)
+        self.__S = sqrtfactor(P0)
+        self.Q = np.array(npu.tondim2(Q), dtype=float)
+        self.R = np.array(npu.tondim2(R), dtype=float)
+        self.n, self.q, self.r = np.shape(self.__x)[0], np.shape(self.Q)[0], np.shape(self.R)[0]
+        self.cor = np.reshape(np.array(cor, dtype=float), (self.q, self.r))
+        assert np.shape(self.__S) == (self.n, self.n), 'P0 must be n-by-n-dimensional'
+        assert np.shape(self.Q) == (self.q, self.q) and np.shape(self.R) == (self.r, self.r), 'Q and R must be square'
+        self.alef = alef
+        self.repairstrategy = repairstrategy
+
+        n, q = self.n, self.q
+        self.fa = npu.vectorised(lambda X: f(X[:n], X[n:n+q]))
+        self.ha = npu.vectorised(lambda X: h(X[:n], X[n:]))
+        self.__noisecovsqrt = sqrtfactor(np.vstack((np.hstack((self.Q, self.cor)), np.hstack((self.cor.T, self.R)))))
+        self.__Rsqrt = sqrtfactor(self.R)
+        # The factor of the joint covariance of the state and the observation noise v_t that will accompany it, set by predict.
+        self.__jointcovsqrt = None
+
+        self.lastobservation = np.nan
+        self.predictedobservation = np.nan
+        self.innov = np.nan
+        self.innovcovsqrt = np.nan
+        self.gain = np.nan
+
         self.loglikelihood = 0.0
-        
+
     def predict(self):
-        try:
-            X, Wm, Wc = sigmaPoints(self.xa, self.Pa)
-        except:
-            warnings.warn('Encountered a matrix that is not positive definite in the sigma points calculation at the predict step')
-            self.Pa = nearpd(self.Pa)
-            X, Wm, Wc = sigmaPoints(self.xa, self.Pa)
-        fX, x, Pxx = unscentedTransform(X, Wm, Wc, self.fa)
-        x = np.asscalar(x)
-        Pxx = np.asscalar(Pxx)
-
-        Pxv = 0.
-        N = np.shape(X)[1]
-        for j in range(0, N):
-            Pxv += Wc[j] * fX[0,j] * X[3,j]
-        
-        self.xa = np.array( ((x,), (0.,), (0.,), (0.,)) )
-        self.Pa = np.array( ((Pxx, Pxv   , 0.      , 0.      ),
-                             (Pxv, self.R, 0.      , 0.      ),
-                             (0. , 0.    , self.Q  , self.cor),
-                             (0. , 0.    , self.cor, self.R  )) )
+        n, q = self.n, self.q
+        xa = np.concatenate((self.__x[:,0], np.zeros(q + self.r)))
+        X, Wm, Wc = sigmaPoints(xa, None, self.alef, sqrtP=la.block_diag(self.__S, self.__noisecovsqrt))
+        fX = npu.tondim2(np.asarray(self.fa(X), dtype=float))
+        x = np.dot(fX, Wm)
+        # The sigma points of v_t are centred at zero, so they are their own deviations from the mean.
+        self.__jointcovsqrt = _weightedsqrt(np.vstack((fX - x[:,np.newaxis], X[n+q:])), Wc)
+        self.__x = x[:,np.newaxis]
+        self.__S = self.__jointcovsqrt[:n,:n].copy()
+        return self.state
 
     def observe(self, y):
+        r"""
+Assimilates the m-dimensional observation y. NaN components are left out of the update.
+        """
         self.lastobservation = y
-        
-        xa = self.xa[0:2:1,0:1:1]
-        Pa = self.Pa[0:2:1,0:2:1]
+        y = np.ravel(np.asarray(y, dtype=float))
+        keep = ~np.isnan(y)
+        if not np.any(keep): return self.state
+
+        n = self.n
+        jointcovsqrt = self.__jointcovsqrt if self.__jointcovsqrt is not None else la.block_diag(self.__S, self.__Rsqrt)
+        X, Wm, Wc = sigmaPoints(np.concatenate((self.__x[:,0], np.zeros(self.r))), None, self.alef, sqrtP=jointcovsqrt)
+        hX = npu.tondim2(np.asarray(self.ha(X), dtype=float))
+        if not np.all(keep):
+            y, hX = y[keep], hX[keep]
+        predictedobservation = np.dot(hX, Wm)
+        hdeviations = hX - predictedobservation[:,np.newaxis]
+        self.innovcovsqrt = _weightedsqrt(hdeviations, Wc)
+        Pxy = np.dot((X[:n] - self.__x) * Wc, hdeviations.T)
+
+        self.predictedobservation = predictedobservation[:,np.newaxis]
+        self.innov = (y - predictedobservation)[:,np.newaxis]
+        # gain = Pxy * innovcov^{-1}; scaledgain = gain * innovcovsqrt.
+        scaledgain = la.solve_triangular(self.innovcovsqrt, Pxy.T, lower=True, check_finite=False).T
+        whitenedinnov = la.solve_triangular(self.innovcovsqrt, self.innov, lower=True, check_finite=False)
+        self.gain = la.solve_triangular(self.innovcovsqrt, scaledgain.T, lower=True, trans='T', check_finite=False).T
+
+        # statecov - gain * innovcov * gain^T = statecov - scaledgain * scaledgain^T, one downdate per column of scaledgain. The state
+        # and its factor are only assigned once both are known, so that the filter is never left half-updated.
+        x = self.__x + np.dot(scaledgain, whitenedinnov)
         try:
-            X, Wm, Wc = sigmaPoints(xa, Pa)
-        except:
-            warnings.warn('Encountered a matrix that is not positive definite in the sigma points calculation at the observe step')
-            Pa = nearpd(Pa)
-            X, Wm, Wc = sigmaPoints(xa, Pa)
-        hX, self.predictedobservation, Pyy = \
-                unscentedTransform(X, Wm, Wc, self.ha)
-        self.predictedobservation = np.asscalar(self.predictedobservation)
-        Pyy = np.asscalar(Pyy)
-        self.innovcov = Pyy
-
-        x = self.xa[0,0]
-        Pxy = 0.
-        Pvy = 0.
-        M = np.shape(X)[1]
-        for j in range(0, M):
-            haImage = self.ha(X[:,j])
-            Pxy += Wc[j] * (X[0,j] - x) * (haImage - self.predictedobservation)
-            Pvy += Wc[j] * X[1,j] * haImage
-
-        Pa = np.array( ((Pxy,), (Pvy,), (0.,), (0.,)) )
-        K = Pa * (1./Pyy)
-        self.gain = K[0,0]
-        
-        self.innov = y - self.predictedobservation        
-
-        self.xa += K * self.innov
-        self.Pa -= np.dot(K, Pa.T)
-        
-        self.loglikelihood += UnscentedKalmanFilter.MINUS_HALF_LN_2PI - .5 * (np.log(self.innovcov) + self.innov * self.innov / self.innovcov)
-        
+            S = self.__S
+            for j in range(np.shape(scaledgain)[1]):
+                S = cholupdate(S, scaledgain[:,j], downdate=True)
+        except np.linalg.LinAlgError:
+            warnings.warn('Encountered a downdate that is not positive definite at the observe step; refactorising the covariance')
+            S = repairedcholesky(np.dot(self.__S, self.__S.T) - np.dot(scaledgain, scaledgain.T), self.repairstrategy)
+        self.__x, self.__S = x, S
+        self.__jointcovsqrt = None
+
+        logdet = 2. * np.sum(np.log(np.abs(np.diagonal(self.innovcovsqrt))))
+        self.loglikelihood += len(y) * MINUS_HALF_LN_2PI - .5 * (logdet + float(np.vdot(whitenedinnov, whitenedinnov)))
+        return self.state
+
+    def predictAndObserve(self, y):
+        self.predict()
+        return self.observe(y)
+
+    @property
+    def state(self): return self.__x.copy()
+
     @property
-    def mean(self): return self.xa[0,0]
-    
+    def statecovsqrt(self): return self.__S.copy()
+
+    @property
+    def statecov(self): return np.dot(self.__S, self.__S.T)
+
+    @property
+    def innovcov(self): return np.dot(self.innovcovsqrt, self.innovcovsqrt.T)
+
+    @property
+    def mean(self): return self.state
+
     @property
-    def var(self): return self.Pa[0,0]
+    def var(self): return self.statecov
@@ -0,0 +1,73 @@
+from enum import Enum
+
+import numpy as np
+
+class RepairStrategy(Enum):
+    # Add a small multiple of the mean diagonal element to the diagonal, ten times larger at each attempt, until the Cholesky
+    # factorisation succeeds, and only project (as with RepairStrategy.projection) if none of the attempts does:
+    jitter = 0
+
+    # Replace the matrix with the nearest positive definite one, see nearpd:
+    projection = 1
+
+def _symmetrised(a):
+    return .5 * (a + np.swapaxes(a, -1, -2))
+
+def _clipeigvals(a, eigfloor):
+    eigvals, eigvecs = np.linalg.eigh(a)
+    floor = eigfloor * np.maximum(np.max(np.abs(eigvals), axis=-1, keepdims=True), np.finfo(float).tiny)
+    return np.matmul(eigvecs * np.maximum(eigvals, floor)[...,np.newaxis,:], np.swapaxes(eigvecs, -1, -2))
+
+def nearpd(a, keepdiag=False, eigfloor=1e-10, tol=1e-10, maxiter=100):
+    r"""
+Returns the nearest matrix to a, in the Frobenius norm, that is symmetric and whose eigenvalues are at least eigfloor times its
+largest absolute eigenvalue, so that it is positive definite. a may also be a stack (..., n, n) of matrices, which are all repaired
+together.
+
+Without further constraints, this is a single clipping of the eigenvalues of the symmetric part of a [Higham-1988]_. With
+keepdiag, the diagonal of a is kept as well (as when repairing a correlation matrix, or a covariance matrix whose variances are to
+be trusted), and the result is found by Higham's alternating projections with Dykstra's correction [Higham-2002]_. These stop once
+no matrix changes by more than tol, relative to its norm, from one iteration to the next, or after maxiter iterations.
+    """
+    a = _symmetrised(np.asarray(a, dtype=float))
+    if not keepdiag: return _clipeigvals(a, eigfloor)
+    n = np.shape(a)[-1]
+    diagindices = np.arange(n)
+    diag = a[...,diagindices,diagindices]
+    result, correction = a, np.zeros_like(a)
+    for _ in range(maxiter):
+        residual = result - correction
+        projected = _clipeigvals(residual, eigfloor)
+        correction = projected - residual
+        previous, result = result, projected.copy()
+        result[...,diagindices,diagindices] = diag
+        change = np.linalg.norm(result - previous, axis=(-2, -1)) / np.linalg.norm(result, axis=(-2, -1))
+        if np.all(change <= tol): break
+    return result
+
+def repairedcholesky(a, strategy=RepairStrategy.jitter, jitter=1e-10, maxjittertries=6, **kwargs):
+    r"""
+Returns the lower Cholesky factor of (the symmetric part of) a, repairing a first, according to strategy (a
+:class:`RepairStrategy`), if it is not positive definite. a may also be a stack (..., n, n) of matrices; only those that need it
+are repaired. kwargs are passed on to :func:`nearpd`.
+    """
+    a = _symmetrised(np.asarray(a, dtype=float))
+    try:
+        return np.linalg.cholesky(a)
+    except np.linalg.LinAlgError:
+        pass
+    if strategy == RepairStrategy.projection:
+        # The projection leaves positive definite matrices as they are (up to rounding), so a stack is projected in one go.
+        return np.linalg.cholesky(nearpd(a, **kwargs))
+    if np.ndim(a) > 2:
+        # numpy does not report which matrices of a stack failed, so we retry them one by one.
+        matrices = np.reshape(a, (-1,) + np.shape(a)[-2:])
+        return np.reshape([repairedcholesky(m, strategy, jitter, maxjittertries, **kwargs) for m in matrices], np.shape(a))
+    scale = max(np.mean(np.abs(np.diagonal(a))), np.finfo(float).tiny)
+    identity = np.eye(np.shape(a)[0])
+    for attempt in range(maxjittertries):
+        try:
+            return np.linalg.cholesky(a + (jitter * 10.**attempt * scale) * identity)
+        except np.linalg.LinAlgError:
+            pass
+    return np.linalg.cholesky(nearpd(a, **kwargs))
@@ -2,10 +2,10 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 import filtering.generation as gen
-import filtering.kalman
 import filtering.run
 import filtering.visualisation
 import maths.numpyutils as npu
+import thalesians.filtering.lowlevel.arma as arma
 
 OBSERVATIONNOISEFACTOR = .5
 
@@ -52,29 +52,7 @@ plt.plot(df['observation'], 'gx', label='noisy observation')
 plt.legend(loc='upper right', fancybox=True, framealpha=0.5, prop={'size': 8})
 plt.xlabel('time')
 
-m = max(p, q+1)
-ar = np.array([ar[i] if i < p else 0. for i in range(m)])
-ma = np.array([ma[i] if i < q else 0. for i in range(m)])
-F = np.zeros((m, m))
-F[:,0] = ar
-F[0:m-1,1:] = np.eye(m-1)
-Wdiag = np.empty((m, 1))
-Wdiag[0,0] = 1.
-Wdiag[1:,:] = ma[:-1]
-W = np.zeros((m, m))
-for i in range(m):
-    W[i,i] = Wdiag[i,0]
-H = np.zeros((1, m))
-H[0,0] = 1.
-
-x0 = np.zeros((m, 1))
-P0 = np.eye(m) * OBSERVATIONNOISEFACTOR * var
-Q = np.eye(m) * var
-R = OBSERVATIONNOISEFACTOR * var
-a = np.zeros((m, 1))
-b = np.zeros((1, 1))
-V = np.eye(1)
-stochfilter = filtering.kalman.KalmanFilter(x0, P0, Q, R, F, H, a, b, W, V)
+stochfilter = arma.ARMAKalmanFilter(ar, ma, var=var, obsnoisevar=OBSERVATIONNOISEFACTOR * var, const=const)
 filterrundata = filtering.run.runfilter(df, None, stochfilter, {}, 'state', 'observation')
 
 fig = plt.figure()
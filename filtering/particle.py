@@ -53,12 +53,15 @@ class ParticleFilter(object):
         
     # An auxiliary method of the constructor. Not called anywhere else.
     def _initialise(self):
-        # TODO Vectorise
-        for i in range(self.particlecount):
-            self._currentparticleidx = i
-            self._priorparticles[i,:] = npu.tondim1(self._initialdistribution.sample())
-            self._resampledparticles[i,:] = self._priorparticles[i,:]
-        self._currentparticleidx = None
+        if npu.isvectorised(self._initialdistribution.sample):
+            self._priorparticles[:] = np.reshape(self._initialdistribution.sample(size=self.particlecount), (self.particlecount, self._statedim))
+            self._resampledparticles[:] = self._priorparticles
+        else:
+            for i in range(self.particlecount):
+                self._currentparticleidx = i
+                self._priorparticles[i,:] = npu.tondim1(self._initialdistribution.sample())
+                self._resampledparticles[i,:] = self._priorparticles[i,:]
+            self._currentparticleidx = None
         self._unnormalisedweights[:] = np.NaN
         self._weights[:] = 1./self._particlecount
             
@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from filtering.particle import ParticleFilter
+import thalesians.maths.numpyutils as npu
+
+class BatchedInitialDistribution(object):
+    def __init__(self):
+        self.sizes = []
+    
+    @npu.vectorised
+    def sample(self, size=None):
+        self.sizes.append(size)
+        return np.arange(size, dtype=float)
+
+class SingleInitialDistribution(object):
+    def __init__(self):
+        self.count = 0
+    
+    def sample(self):
+        self.count += 1
+        return float(self.count)
+
+class ParticleFilterTest(unittest.TestCase):
+    
+    def test_initialise_with_batched_sample(self):
+        initialdistribution = BatchedInitialDistribution()
+        particlefilter = ParticleFilter(initialdistribution, None, None, 5)
+        self.assertEqual(initialdistribution.sizes, [5])
+        npt.assert_equal(particlefilter.priorparticles, np.arange(5.)[:,np.newaxis])
+        npt.assert_equal(particlefilter.resampledparticles, np.arange(5.)[:,np.newaxis])
+        npt.assert_almost_equal(particlefilter.weights, .2)
+    
+    def test_initialise_with_single_samples(self):
+        initialdistribution = SingleInitialDistribution()
+        particlefilter = ParticleFilter(initialdistribution, None, None, 5)
+        self.assertEqual(initialdistribution.count, 5)
+        npt.assert_equal(particlefilter.priorparticles, np.arange(1., 6.)[:,np.newaxis])
+        npt.assert_equal(particlefilter.resampledparticles, np.arange(1., 6.)[:,np.newaxis])
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -12,7 +12,14 @@ class LogVarInitialDistribution(object):
         randomstate = npu.getrandomstate() if randomstate is None else randomstate
         self.__normalvariatesgenerator = rnd.NormalVariatesGenerator(randomstate)
         
-    def sample(self, normalvariate=None):
+    # With size=None, returns a single draw; otherwise, an array of size draws, generated in one go. Either way, the normal
+    # variates are taken from the random state in the same order.
+    @npu.vectorised
+    def sample(self, normalvariate=None, size=None):
+        if size is not None:
+            if normalvariate is None:
+                normalvariate = self.__normalvariatesgenerator.generatenormalvariates(1., size)
+            return self.__scale * np.reshape(normalvariate, (size,))
         if normalvariate is None:
             normalvariate = self.__normalvariatesgenerator.generatenormalvariates(1., 1)
         normalvariate = npu.toscalar(normalvariate)
@@ -0,0 +1,29 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from sv import Params
+from sv.generation import LogVarInitialDistribution
+
+class GenerationTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.params = Params(meanlogvar=-1., persistence=.95, voloflogvar=.3, cor=-.5, jumpintensity=0., jumpvol=1.)
+    
+    def test_LogVarInitialDistribution_batched_sample_matches_single_samples(self):
+        singledistribution = LogVarInitialDistribution(self.params, np.random.RandomState(seed=42))
+        batcheddistribution = LogVarInitialDistribution(self.params, np.random.RandomState(seed=42))
+        singlesamples = np.array([singledistribution.sample() for _ in range(100)])
+        batchedsamples = batcheddistribution.sample(size=100)
+        self.assertEqual(np.shape(batchedsamples), (100,))
+        npt.assert_almost_equal(batchedsamples, singlesamples)
+    
+    def test_LogVarInitialDistribution_batched_sample_distribution(self):
+        samples = LogVarInitialDistribution(self.params, np.random.RandomState(seed=42)).sample(size=200000)
+        sd = np.sqrt(self.params.logvaruncondvar())
+        self.assertAlmostEqual(np.mean(samples) / sd, 0., delta=.01)
+        self.assertAlmostEqual(np.std(samples) / sd, 1., delta=.01)
+        
+if __name__ == '__main__':
+    unittest.main()
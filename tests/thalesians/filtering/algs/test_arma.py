@@ -0,0 +1,33 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.arma import ARMAKalmanFilter
+
+class ARMAKalmanFilterTest(unittest.TestCase):
+    def test_matches_dense_kalman_filter(self):
+        observations = np.random.RandomState(seed=42).normal(size=60)
+        observations[[4, 30]] = np.nan
+        for ar, ma, obsnoisevar in (((.75, -.4), (.7,), .05), ((.5,), (.3, -.2, .1), 0.), ((.2, .1, -.1, .05), (), .1)):
+            armafilter = ARMAKalmanFilter(ar, ma, var=.1, obsnoisevar=obsnoisevar, const=.2)
+            expected = armafilter.tokalmanfilter().filterseries(observations)
+            actual = armafilter.filterseries(observations)
+            for field in expected._fields:
+                npt.assert_allclose(getattr(actual, field), getattr(expected, field), rtol=1e-10, atol=1e-12, err_msg=field)
+
+            stepfilter = ARMAKalmanFilter(ar, ma, var=.1, obsnoisevar=obsnoisevar, const=.2)
+            for obs in observations: stepfilter.predictAndObserve(obs)
+            npt.assert_almost_equal(stepfilter.state, armafilter.state)
+            npt.assert_almost_equal(stepfilter.loglikelihood, armafilter.loglikelihood)
+
+    def test_stationary_initial_distribution(self):
+        armafilter = ARMAKalmanFilter((.75, -.4), (.7,), var=.1, const=.2)
+        npt.assert_almost_equal(armafilter.state[0,0], .2 / (1. - .75 + .4))
+        kalmanfilter = armafilter.tokalmanfilter()
+        kalmanfilter.predict()
+        npt.assert_almost_equal(kalmanfilter.statecov, armafilter.statecov)
+        npt.assert_almost_equal(kalmanfilter.state, armafilter.state)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.batchkalman import BatchKalmanFilter
+from thalesians.filtering.lowlevel.kalman import KalmanFilter
+
+class BatchKalmanFilterTest(unittest.TestCase):
+    def setUp(self):
+        randomstate = np.random.RandomState(seed=42)
+        self.batchsize = 5
+        self.procmap = np.array(((.9, .1), (0., .8)))
+        self.obsmap = np.array(((1., 0.), (1., 1.)))
+        self.procnoisecov = np.array(((.2, .05), (.05, .1)))
+        self.obsnoisecov = np.array(((.3, 0.), (0., .4)))
+        self.states = randomstate.normal(size=(self.batchsize, 2))
+        self.observations = randomstate.normal(size=(10, self.batchsize, 2))
+
+    def test_matches_independent_filters(self):
+        batch = BatchKalmanFilter(self.states, np.eye(2), self.procnoisecov, self.obsnoisecov, self.procmap, self.obsmap)
+        filters = [KalmanFilter(self.states[b], np.eye(2), self.procnoisecov, self.obsnoisecov, self.procmap, self.obsmap,
+                procnoisemap=np.eye(2), obsnoisemap=np.eye(2)) for b in range(self.batchsize)]
+        for obs in self.observations:
+            batch.predictAndObserve(obs)
+            for b, f in enumerate(filters):
+                f.predictAndObserve(obs[b])
+        for b, f in enumerate(filters):
+            npt.assert_almost_equal(batch.state[b], f.state)
+            npt.assert_almost_equal(batch.statecov[b], f.statecov)
+            npt.assert_almost_equal(batch.innov[b], f.innov)
+
+    def test_forecast_matches_independent_filters(self):
+        procmaps = np.array([self.procmap * (1. - .1 * b) for b in range(self.batchsize)])
+        batch = BatchKalmanFilter(self.states, np.eye(2), self.procnoisecov, self.obsnoisecov, procmaps, self.obsmap, procoffset=(.1, 0.))
+        filters = [KalmanFilter(self.states[b], np.eye(2), self.procnoisecov, self.obsnoisecov, procmaps[b], self.obsmap,
+                procoffset=(.1, 0.), procnoisemap=np.eye(2), obsnoisemap=np.eye(2)) for b in range(self.batchsize)]
+        batchforecast = batch.forecast((5, 0, 20))
+        for b, f in enumerate(filters):
+            forecast = f.forecast((5, 0, 20))
+            npt.assert_almost_equal(batchforecast.states[:,b], forecast.states)
+            npt.assert_almost_equal(batchforecast.statecovs[:,b], forecast.statecovs)
+            npt.assert_almost_equal(batchforecast.obs[:,b], forecast.obs)
+            npt.assert_almost_equal(batchforecast.obscovs[:,b], forecast.obscovs)
+
+    def test_missing_observation_leaves_prior(self):
+        batch = BatchKalmanFilter(self.states, np.eye(2), self.procnoisecov, self.obsnoisecov, self.procmap, self.obsmap)
+        obs = np.copy(self.observations[0])
+        obs[1, 0] = np.nan
+        batch.predict()
+        priorstate, priorstatecov = np.copy(batch.state), np.copy(batch.statecov)
+        batch.observe(obs)
+        npt.assert_almost_equal(batch.state[1], priorstate[1])
+        npt.assert_almost_equal(batch.statecov[1], priorstatecov[1])
+        self.assertEqual(batch.loglikelihood[1], 0.)
+        self.assertTrue(np.all(batch.loglikelihood[[0, 2, 3, 4]] != 0.))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.ensemble import EnsembleKalmanFilter, EnsembleUpdate
+from thalesians.filtering.lowlevel.kalman import KalmanFilter
+
+class EnsembleKalmanFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.randomstate = np.random.RandomState(seed=42)
+        self.mean = np.array((.5, -.2, .1))
+        self.cov = np.array(((1., .3, 0.), (.3, .5, .1), (0., .1, .8)))
+        self.obsmap = np.array(((1., 0., 0.), (1., 1., 1.)))
+        self.obsnoisecov = np.array(((.2, .05), (.05, .3)))
+
+    def _makeensemble(self, ensemblesize):
+        # An ensemble whose sample mean and covariance are exactly self.mean and self.cov.
+        noise = self.randomstate.normal(size=(ensemblesize, 3))
+        noise -= np.mean(noise, axis=0)
+        noise = np.dot(noise, np.linalg.inv(np.linalg.cholesky(np.cov(noise, rowvar=False))).T)
+        return self.mean + np.dot(noise, np.linalg.cholesky(self.cov).T)
+
+    def _makekalmanfilter(self):
+        return KalmanFilter(self.mean, self.cov, np.eye(3), self.obsnoisecov, np.eye(3), self.obsmap, procnoisemap=np.eye(3), obsnoisemap=np.eye(2))
+
+    def test_square_root_update_is_exact_for_linear_observations(self):
+        obs = np.array((.7, np.nan))
+        for obsfunc in (self.obsmap, lambda ensemble: np.dot(ensemble, self.obsmap.T)):
+            ensemblefilter = EnsembleKalmanFilter(self._makeensemble(10), lambda ensemble: ensemble, obsfunc, self.obsnoisecov)
+            ensemblefilter.observe((.7, .2))
+            kalmanfilter = self._makekalmanfilter()
+            kalmanfilter.observe((.7, .2))
+            npt.assert_almost_equal(ensemblefilter.state, kalmanfilter.state)
+            npt.assert_almost_equal(ensemblefilter.statecov, kalmanfilter.statecov)
+            npt.assert_almost_equal(ensemblefilter.loglikelihood, kalmanfilter.loglikelihood)
+        ensemblefilter = EnsembleKalmanFilter(self._makeensemble(10), lambda ensemble: ensemble, self.obsmap, self.obsnoisecov)
+        ensemblefilter.observe(obs)
+        kalmanfilter = KalmanFilter(self.mean, self.cov, np.eye(3), .2, np.eye(3), self.obsmap[:1], procnoisemap=np.eye(3), obsnoisemap=np.eye(1))
+        kalmanfilter.observe(.7)
+        npt.assert_almost_equal(ensemblefilter.state, kalmanfilter.state)
+        npt.assert_almost_equal(ensemblefilter.statecov, kalmanfilter.statecov)
+
+    def test_perturbed_update_approximates_kalman_update(self):
+        kalmanfilter = self._makekalmanfilter()
+        kalmanfilter.observe((.7, .2))
+        for localisation in (None, (np.ones((3, 2)), np.ones((2, 2)))):
+            ensemblefilter = EnsembleKalmanFilter(self._makeensemble(20000), lambda ensemble: ensemble, self.obsmap, self.obsnoisecov,
+                    updatemethod=EnsembleUpdate.perturbed, localisation=localisation, randomstate=self.randomstate)
+            ensemblefilter.observe((.7, .2))
+            npt.assert_allclose(ensemblefilter.state, kalmanfilter.state, atol=.03)
+            npt.assert_allclose(ensemblefilter.statecov, kalmanfilter.statecov, atol=.03)
+
+    def test_predict_adds_process_noise(self):
+        ensemblefilter = EnsembleKalmanFilter(self._makeensemble(20000), lambda ensemble: .5 * ensemble, self.obsmap, self.obsnoisecov,
+                procnoisecov=(.1, .2, .3), randomstate=self.randomstate)
+        ensemblefilter.predict()
+        npt.assert_allclose(ensemblefilter.state, .5 * self.mean[:,np.newaxis], atol=.02)
+        npt.assert_allclose(ensemblefilter.statecov, .25 * self.cov + np.diag((.1, .2, .3)), atol=.02)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+import numpy as np
+
+from thalesians.filtering.lowlevel.expectationmaximisation import emestimate
+from thalesians.filtering.lowlevel.kalman import KalmanFilter
+
+class EMEstimateTest(unittest.TestCase):
+    def test_recovers_ar1_plus_noise(self):
+        randomstate = np.random.RandomState(seed=42)
+        timecount = 1000
+        state = 0.
+        observations = np.empty((timecount,))
+        for t in range(timecount):
+            state = .8 * state + np.sqrt(.5) * randomstate.normal()
+            observations[t] = state + np.sqrt(.3) * randomstate.normal()
+        observations[100:110] = np.nan
+
+        initialguess = KalmanFilter(0., 1., procnoisecov=1., obsnoisecov=1., procmap=.3, obsmap=1.)
+        result = emestimate(initialguess, observations, estimate=('procmap', 'procnoisecov', 'obsnoisecov'), maxiterations=500, tol=1e-7)
+
+        self.assertTrue(result.converged)
+        self.assertTrue(np.all(np.diff(result.loglikelihoods) > -1e-6))
+        self.assertAlmostEqual(result.kalmanfilter.procmap[0,0], .8, delta=.05)
+
+        # The estimate should be (close to) the maximum likelihood estimate: no worse than the true parameters, nor than small
+        # perturbations of itself.
+        estimated = result.kalmanfilter
+        def loglikelihood(procmap, procnoisecov, obsnoisecov):
+            return np.sum(KalmanFilter(0., 1., procnoisecov, obsnoisecov, procmap, 1.).filterseries(observations).loglikelihoods)
+        maxloglikelihood = loglikelihood(estimated.procmap, estimated.procnoisecov, estimated.obsnoisecov)
+        self.assertGreater(maxloglikelihood, loglikelihood(.8, .5, .3))
+        for perturbation in (-.01, .01):
+            self.assertGreater(maxloglikelihood + 1e-4, loglikelihood(estimated.procmap + perturbation, estimated.procnoisecov, estimated.obsnoisecov))
+            self.assertGreater(maxloglikelihood + 1e-4, loglikelihood(estimated.procmap, estimated.procnoisecov + perturbation, estimated.obsnoisecov))
+            self.assertGreater(maxloglikelihood + 1e-4, loglikelihood(estimated.procmap, estimated.procnoisecov, estimated.obsnoisecov + perturbation))
+
+if __name__ == '__main__':
+    unittest.main()
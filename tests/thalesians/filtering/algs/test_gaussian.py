@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.gaussian import CubaturePointSet, GaussHermitePointSet, GaussianFilter
+from thalesians.filtering.lowlevel.kalman import KalmanFilter, UpdateStrategy
+from thalesians.filtering.lowlevel.unscented import UnscentedPointSet
+
+class GaussianFilterTest(unittest.TestCase):
+    def test_point_sets(self):
+        for pointset, pointcount in ((CubaturePointSet(), 6), (GaussHermitePointSet(order=4), 64), (UnscentedPointSet(), 7)):
+            Z, Wm, Wc = pointset.unitpoints(3)
+            self.assertEqual(np.shape(Z), (3, pointcount))
+            self.assertIs(pointset.unitpoints(3)[0], Z)
+            npt.assert_almost_equal(np.sum(Wm), 1.)
+            npt.assert_almost_equal(np.dot(Z, Wm), np.zeros(3))
+            npt.assert_almost_equal(np.dot(Z * Wc, Z.T), np.eye(3))
+
+        # Gauss-Hermite with order points is exact for polynomials of degree 2 * order - 1 in each coordinate.
+        Z, Wm, _ = GaussHermitePointSet(order=4).unitpoints(2)
+        npt.assert_almost_equal(np.dot(Z[0]**4 * Z[1]**6, Wm), 3. * 15.)
+
+        mean, sqrtcov = np.array([[1., 2.], [-1., 0.]]), np.array([np.eye(2), [[2., 0.], [1., 1.]]])
+        X, _, _ = CubaturePointSet().points(mean, sqrtcov)
+        npt.assert_almost_equal(X[1], mean[1][:,np.newaxis] + np.sqrt(2.) * np.hstack((sqrtcov[1], -sqrtcov[1])))
+
+    def test_matches_kalman_filter_on_linear_system(self):
+        procmap = np.array([[.9, .1], [-.2, .8]])
+        obsmap = np.array([[1., .5], [.3, -.4]])
+        procnoisecov, obsnoisecov = np.array([[.2, .05], [.05, .1]]), np.diag([.3, .4])
+        state, statecov = np.array([1., -1.]), np.array([[1., .2], [.2, .5]])
+        kf = KalmanFilter(state, statecov, procnoisecov, obsnoisecov, procmap, obsmap, procnoisemap=np.eye(2), obsnoisemap=np.eye(2),
+                updatestrategy=UpdateStrategy.sequential)
+        observations = np.random.RandomState(seed=42).normal(size=(20, 2))
+        observations[5, 1] = np.nan
+        expected = kf.filterseries(observations)
+        for pointset in (CubaturePointSet(), GaussHermitePointSet(order=2)):
+            gf = GaussianFilter(state, statecov, procnoisecov, obsnoisecov, np.zeros((2, 2)), lambda x, w: np.dot(procmap, x) + w,
+                    lambda x, v: np.dot(obsmap, x) + v, pointset)
+            for t, obs in enumerate(observations):
+                gf.predictAndObserve(obs)
+                npt.assert_almost_equal(gf.state[:,0], expected.states[t])
+                npt.assert_almost_equal(gf.statecov, expected.statecovs[t])
+            npt.assert_almost_equal(gf.loglikelihood, kf.loglikelihood)
+
+    def test_observe_twice(self):
+        # With x_t = x_{t-1} + w_t and y_t = x_t + v_t, only the first observation sees cov(x_t, v_t) = cor.
+        gf = GaussianFilter(0., 1., 1., 1., .5, lambda x, w: x + w, lambda x, v: x + v)
+        gf.predict()
+        gf.observe(1.)
+        npt.assert_almost_equal(gf.innovcov, [[4.]])
+        x, p = 2.5 / 4., 2. - 2.5 * 2.5 / 4.
+        npt.assert_almost_equal(gf.state, [[x]])
+        npt.assert_almost_equal(gf.statecov, [[p]])
+        gf.observe(.5)
+        npt.assert_almost_equal(gf.innovcov, [[p + 1.]])
+        npt.assert_almost_equal(gf.gain, [[p / (p + 1.)]])
+        npt.assert_almost_equal(gf.state, [[x + p / (p + 1.) * (.5 - x)]])
+        npt.assert_almost_equal(gf.statecov, [[p - p * p / (p + 1.)]])
+
+    def test_gauss_hermite_accuracy(self):
+        # With x ~ N(m, p) and y = v * exp(x / 2), var(y) = exp(m + p / 2); the Gauss-Hermite rule gets it right to high precision.
+        m, p = -1., .8
+        gf = GaussianFilter(m, p, 1., 1., 0., lambda x, w: x, lambda x, v: v * np.exp(.5 * x), GaussHermitePointSet(order=12))
+        gf.observe(0.)
+        npt.assert_almost_equal(gf.innovcov[0,0], np.exp(m + .5 * p), decimal=10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.imm import IMMFilter
+from thalesians.filtering.lowlevel.kalman import KalmanFilter
+
+class IMMFilterTest(unittest.TestCase):
+    def _makefilters(self):
+        return [KalmanFilter(np.zeros(2), np.eye(2), procnoisecov * np.eye(2), .2, np.array(((.9, .1), (0., .8))), np.array(((1., 1.),)),
+                procnoisemap=np.eye(2), obsnoisemap=np.eye(1)) for procnoisecov in (.01, .1, 1.)]
+
+    def test_matches_filter_by_filter_mixing(self):
+        transitionmatrix = np.array(((.9, .05, .05), (.1, .8, .1), (.05, .15, .8)))
+        observations = np.random.RandomState(seed=42).normal(size=20)
+        observations[7] = np.nan
+        imm = IMMFilter(self._makefilters(), transitionmatrix)
+
+        filters = self._makefilters()
+        modelprobs = np.full(3, 1. / 3.)
+        loglikelihood = 0.
+        for obs in observations:
+            predictedmodelprobs = np.dot(modelprobs, transitionmatrix)
+            states = [np.ravel(f.state) for f in filters]
+            statecovs = [f.statecov for f in filters]
+            for j, f in enumerate(filters):
+                weights = modelprobs * transitionmatrix[:,j] / predictedmodelprobs[j]
+                state = sum(w * s for w, s in zip(weights, states))
+                f.state = state
+                f.statecov = sum(w * (c + np.outer(s - state, s - state)) for w, s, c in zip(weights, states, statecovs))
+            likelihoods = np.ones(3)
+            for j, f in enumerate(filters):
+                previousloglikelihood = f.loglikelihood
+                f.predict()
+                if not np.isnan(obs):
+                    f.observe(obs)
+                    likelihoods[j] = np.exp(f.loglikelihood - previousloglikelihood)
+            modelprobs = predictedmodelprobs * likelihoods
+            loglikelihood += np.log(np.sum(modelprobs))
+            modelprobs /= np.sum(modelprobs)
+
+            imm.predictAndObserve(obs)
+            npt.assert_almost_equal(imm.modelprobs, modelprobs)
+            for j, f in enumerate(filters):
+                npt.assert_almost_equal(imm.models.state[j], f.state)
+                npt.assert_almost_equal(imm.models.statecov[j], f.statecov)
+        npt.assert_almost_equal(imm.loglikelihood, loglikelihood)
+        npt.assert_almost_equal(imm.state, sum(p * f.state for p, f in zip(modelprobs, filters)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.information import InformationFilter
+from thalesians.filtering.lowlevel.kalman import KalmanFilter, UpdateStrategy
+
+class InformationFilterTest(unittest.TestCase):
+    def setUp(self):
+        randomstate = np.random.RandomState(seed=42)
+        self.obsmap = randomstate.normal(size=(12, 2))
+        self.args = dict(state=np.array((.5, -.5)), statecov=np.eye(2), procnoisecov=np.array(((.2, .05), (.05, .1))),
+                procmap=np.array(((.9, .1), (0., .8))), obsmap=self.obsmap, procoffset=np.array((.1, 0.)),
+                obsoffset=np.linspace(-1., 1., 12), procnoisemap=np.eye(2), obsnoisemap=np.eye(12))
+        self.observations = randomstate.normal(size=(20, 12))
+
+    def test_matches_kalman_filter(self):
+        for obsnoisecov in (np.diag(np.linspace(.1, .5, 12)), np.diag(np.linspace(.1, .5, 12)) + .05):
+            kf = KalmanFilter(obsnoisecov=obsnoisecov, **self.args)
+            inf = InformationFilter(obsnoisecov=obsnoisecov, **self.args)
+            for obs in self.observations:
+                kf.predictAndObserve(obs)
+                inf.predictAndObserve(obs)
+                npt.assert_almost_equal(inf.state, kf.state)
+                npt.assert_almost_equal(inf.statecov, kf.statecov)
+            npt.assert_almost_equal(inf.loglikelihood, kf.loglikelihood)
+
+    def test_missing_observations(self):
+        observations = self.observations[:4].copy()
+        observations[1, np.arange(12) % 3 == 0] = np.nan
+        observations[2, 5] = np.nan
+        for obsnoisecov in (np.diag(np.linspace(.1, .5, 12)), np.diag(np.linspace(.1, .5, 12)) + .05):
+            # The sequential update, like the information filter, leaves out NaN components rather than whole observations.
+            for obsnoisemap in (np.eye(12), None):
+                kf = KalmanFilter(obsnoisecov=obsnoisecov, updatestrategy=UpdateStrategy.sequential, **self.args)
+                inf = InformationFilter(obsnoisecov=obsnoisecov, **dict(self.args, obsnoisemap=obsnoisemap))
+                expected = kf.filterseries(observations)
+                for t, obs in enumerate(observations):
+                    inf.predictAndObserve(obs)
+                    npt.assert_almost_equal(inf.state[:,0], expected.states[t])
+                    npt.assert_almost_equal(inf.statecov, expected.statecovs[t])
+                npt.assert_almost_equal(inf.loglikelihood, kf.loglikelihood)
+
+    def test_diffuse_prior(self):
+        inf = InformationFilter(infomatrix=np.zeros((2, 2)), procnoisecov=.1 * np.eye(2), obsnoisecov=.2 * np.eye(12), obsmap=self.obsmap)
+        inf.predictAndObserve(self.observations[0])
+        npt.assert_almost_equal(inf.state, np.linalg.lstsq(self.obsmap, self.observations[0], rcond=None)[0][:,np.newaxis])
+        self.assertEqual(inf.loglikelihood, 0.)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,13 @@
 import datetime
 import unittest
+import warnings
+
+import numpy as np
+import numpy.testing as npt
+import scipy.sparse as sp
+import scipy.stats
+
+from thalesians.filtering.lowlevel.kalman import KalmanFilter, UpdateStrategy
 
 class KalmanFilterTest(unittest.TestCase):
     
@@ -17,7 +25,236 @@ class KalmanFilterTest(unittest.TestCase):
     
     def test_kalman_filter_multidim(self):
         pass
+
+    # A system with a scalar observation and one with a four-dimensional observation, whose obsnoisecov is given by each test.
+    scalarsystem = dict(procnoisecov=.1 * np.eye(2), obsnoisecov=.05, procmap=np.array(((.75, 1.), (-.4, 0.))), obsmap=np.array(((1., 0.),)),
+            procnoisemap=np.eye(2), obsnoisemap=np.eye(1))
+    panelsystem = dict(procnoisecov=.1 * np.eye(2), procmap=np.array(((.9, .1), (0., .8))), obsmap=np.array(((1., 0.), (1., 1.), (0., 2.), (.5, -1.))),
+            obsoffset=np.array((.1, 0., -.1, 0.)), procnoisemap=np.eye(2), obsnoisemap=np.eye(4))
+
+    def _makefilter(self, system=None, **kwargs):
+        kwargs = dict(self.scalarsystem if system is None else system, **kwargs)
+        return KalmanFilter(np.zeros(2), np.eye(2), **kwargs)
+
+    def test_filterseries_matches_predict_and_observe(self):
+        observations = np.random.RandomState(seed=42).normal(size=50)
+        observations[10] = np.nan
+        seriesfilter = self._makefilter()
+        data = seriesfilter.filterseries(observations)
+        stepfilter = self._makefilter()
+        for t, obs in enumerate(observations):
+            if np.isnan(obs):
+                stepfilter.predict()
+                self.assertEqual(data.loglikelihoods[t], 0.)
+                self.assertTrue(np.isnan(data.innovs[t, 0]))
+            else:
+                stepfilter.predictAndObserve(obs)
+                npt.assert_almost_equal(data.innovs[t], np.ravel(stepfilter.innov))
+                npt.assert_almost_equal(data.gains[t], stepfilter.gain)
+            npt.assert_almost_equal(data.states[t], np.ravel(stepfilter.state))
+            npt.assert_almost_equal(data.statecovs[t], stepfilter.statecov)
+        npt.assert_almost_equal(seriesfilter.state, stepfilter.state)
+        npt.assert_almost_equal(seriesfilter.loglikelihood, np.ravel(stepfilter.loglikelihood)[0])
         
+    def test_filterseries_with_time_varying_system(self):
+        observations = np.random.RandomState(seed=42).normal(size=40)
+        observations[5] = np.nan
+        # The transition depends on the sign of the previous observation, as in Harvey-Shephard filtering of log-squared returns.
+        def procmaps(obs):
+            signs = np.concatenate(((1.,), np.where(obs[:-1,0] < 0., -1., 1.)))
+            return np.array([((.75 + .1 * sign, 1.), (-.4, 0.)) for sign in signs])
+        procoffsets = np.column_stack((np.linspace(-.1, .1, 40), np.zeros(40)))
+        obsmaps = np.array([((1., .1 * t / 40.),) for t in range(40)])
+        seriesfilter = self._makefilter()
+        data = seriesfilter.filterseries(observations, procmaps=procmaps, obsmaps=obsmaps, procoffsets=procoffsets)
+        stepfilter = self._makefilter()
+        for t, obs in enumerate(observations):
+            stepfilter.procmap = procmaps(observations[:,np.newaxis])[t]
+            stepfilter.procoffset = procoffsets[t]
+            stepfilter.obsmap = obsmaps[t]
+            if np.isnan(obs): stepfilter.predict()
+            else: stepfilter.predictAndObserve(obs)
+            npt.assert_almost_equal(data.states[t], np.ravel(stepfilter.state))
+            npt.assert_almost_equal(data.statecovs[t], stepfilter.statecov)
+        npt.assert_almost_equal(np.sum(data.loglikelihoods), stepfilter.loglikelihood)
+        npt.assert_almost_equal(seriesfilter.procmap, self._makefilter().procmap)
+
+    def test_sparse_system_matrices(self):
+        procdim, obsdim = 60, 4
+        randomstate = np.random.RandomState(seed=42)
+        procmap = sp.block_diag([np.array(((.9, .1), (-.1, .8)))] * (procdim // 2), format='csr')
+        obsmap = sp.random(obsdim, procdim, density=.1, random_state=randomstate, format='csr') + sp.hstack((sp.identity(obsdim), sp.csr_matrix((obsdim, procdim - obsdim))))
+        procnoisemap = sp.diags(np.linspace(.5, 1.5, procdim), format='csr')
+        observations = randomstate.normal(size=(20, obsdim))
+        observations[5] = np.nan
+        def makefilter(sparse):
+            maps = (procmap, obsmap, procnoisemap) if sparse else (procmap.toarray(), obsmap.toarray(), procnoisemap.toarray())
+            return KalmanFilter(np.zeros(procdim), np.eye(procdim), .1 * np.eye(procdim), .2 * np.eye(obsdim), maps[0], maps[1],
+                    procnoisemap=maps[2])
+        sparsefilter, densefilter = makefilter(True), makefilter(False)
+        self.assertTrue(sp.issparse(sparsefilter.procmap))
+        for obs in observations[:3]:
+            sparsefilter.predictAndObserve(obs)
+            densefilter.predictAndObserve(obs)
+            npt.assert_almost_equal(sparsefilter.state, densefilter.state)
+            npt.assert_almost_equal(sparsefilter.statecov, densefilter.statecov)
+        self.assertTrue(sp.issparse(sparsefilter.obsnoisemap))
+        sparsedata = makefilter(True).filterseries(observations)
+        densedata = makefilter(False).filterseries(observations)
+        for field in sparsedata._fields:
+            npt.assert_allclose(getattr(sparsedata, field), getattr(densedata, field), rtol=1e-10, atol=1e-12, err_msg=field)
+
+    def test_forecast_matches_repeated_predicts(self):
+        kalmanfilter = self._makefilter()
+        kalmanfilter.procoffset = np.array((.1, -.05))
+        kalmanfilter.predictAndObserve(.3)
+        forecast = kalmanfilter.forecast((0, 3, 1, 10))
+        for i, horizon in enumerate(forecast.horizons):
+            predictingfilter = self._makefilter()
+            predictingfilter.procoffset = np.array((.1, -.05))
+            predictingfilter.predictAndObserve(.3)
+            for _ in range(horizon): predictingfilter.predict()
+            npt.assert_almost_equal(forecast.states[i], np.ravel(predictingfilter.state))
+            npt.assert_almost_equal(forecast.statecovs[i], predictingfilter.statecov)
+            npt.assert_almost_equal(forecast.obs[i], np.dot(predictingfilter.obsmap, np.ravel(predictingfilter.state)))
+            npt.assert_almost_equal(forecast.obscovs[i], np.dot(np.dot(predictingfilter.obsmap, predictingfilter.statecov), predictingfilter.obsmap.T) + .05)
+        # The filter is not advanced, and the cache follows reassignments of the process model.
+        npt.assert_almost_equal(kalmanfilter.forecast((0,)).states[0], np.ravel(kalmanfilter.state))
+        kalmanfilter.procoffset = None
+        npt.assert_almost_equal(kalmanfilter.forecast((1,)).states[0], np.dot(kalmanfilter.procmap, np.ravel(kalmanfilter.state)))
+
+    def test_multidimensional_observation_loglikelihood(self):
+        obsmap = np.array(((1., 0.), (1., 1.), (0., 2.)))
+        obsnoisecov = np.diag((.3, .4, .5))
+        kf = KalmanFilter(np.zeros(2), np.eye(2), .1 * np.eye(2), obsnoisecov, np.eye(2), obsmap, procnoisemap=np.eye(2), obsnoisemap=np.eye(3))
+        kf.predict()
+        obs = np.array((.5, -.2, 1.))
+        expected = scipy.stats.multivariate_normal(np.zeros(3), np.dot(np.dot(obsmap, 1.1 * np.eye(2)), obsmap.T) + obsnoisecov).logpdf(obs)
+        kf.observe(obs)
+        npt.assert_almost_equal(kf.loglikelihood, expected)
+        data = KalmanFilter(np.zeros(2), np.eye(2), .1 * np.eye(2), obsnoisecov, np.eye(2), obsmap).filterseries(obs[np.newaxis,:])
+        npt.assert_almost_equal(data.loglikelihoods[0], expected)
+
+    def test_steady_state_freezes_and_matches_full_recursion(self):
+        observations = np.random.RandomState(seed=42).normal(size=200)
+        fullfilter = self._makefilter()
+        steadyfilter = self._makefilter(steadystatetol=1e-12)
+        for obs in observations:
+            fullfilter.predictAndObserve(obs)
+            steadyfilter.predictAndObserve(obs)
+        self.assertFalse(fullfilter.steadystate)
+        self.assertTrue(steadyfilter.steadystate)
+        npt.assert_almost_equal(steadyfilter.state, fullfilter.state)
+        npt.assert_almost_equal(steadyfilter.statecov, fullfilter.statecov)
+        npt.assert_almost_equal(steadyfilter.loglikelihood, fullfilter.loglikelihood)
+        steadyfilter.procmap = np.array(((.5, 1.), (-.4, 0.)))
+        self.assertFalse(steadyfilter.steadystate)
+
+    def test_steady_state_in_filterseries(self):
+        observations = np.random.RandomState(seed=42).normal(size=200)
+        observations[150] = np.nan
+        fulldata = self._makefilter().filterseries(observations)
+        steadyfilter = self._makefilter(steadystatetol=1e-12)
+        steadydata = steadyfilter.filterseries(observations)
+        self.assertTrue(steadyfilter.steadystate)
+        for full, steady in zip(fulldata, steadydata):
+            npt.assert_almost_equal(steady, full)
+
+    def test_steady_state_in_filterseries_with_singular_innovation_covariance(self):
+        # Two exact copies of the same observation: the innovation covariance converges, but is singular, so it must not be frozen.
+        observations = np.repeat(np.random.RandomState(seed=42).normal(size=(100, 1)), 2, axis=1)
+        kwargs = dict(self.scalarsystem, obsnoisecov=np.zeros((2, 2)), obsmap=np.array(((1., 0.), (1., 0.))), obsnoisemap=np.eye(2))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            fulldata = self._makefilter(**kwargs).filterseries(observations)
+            steadyfilter = self._makefilter(steadystatetol=1e-12, **kwargs)
+            steadydata = steadyfilter.filterseries(observations)
+        self.assertFalse(steadyfilter.steadystate)
+        for full, steady in zip(fulldata, steadydata):
+            npt.assert_almost_equal(steady, full)
+
+    def test_solve_steady_state(self):
+        converged = self._makefilter()
+        for obs in np.random.RandomState(seed=42).normal(size=200):
+            converged.predictAndObserve(obs)
+        solved = self._makefilter()
+        solved.solvesteadystate()
+        self.assertTrue(solved.steadystate)
+        npt.assert_almost_equal(solved.statecov, converged.statecov)
+        solved.predictAndObserve(1.)
+        npt.assert_almost_equal(solved.gain, converged.gain)
+
+        # Without procmap, which defaults to the identity.
+        solved = KalmanFilter(np.zeros(2), np.eye(2), .1 * np.eye(2), .05 * np.eye(2), obsmap=np.eye(2))
+        solved.solvesteadystate()
+        solved.predict()
+        solved.observe(np.array((1., -1.)))
+        self.assertTrue(solved.steadystate)
+        converged = KalmanFilter(np.zeros(2), solved.statecov, .1 * np.eye(2), .05 * np.eye(2), np.eye(2), np.eye(2), procnoisemap=np.eye(2),
+                obsnoisemap=np.eye(2))
+        converged.predict()
+        converged.observe(np.array((1., -1.)))
+        npt.assert_almost_equal(solved.state, converged.state)
+
+    def test_sequential_update_matches_joint_update(self):
+        observations = np.random.RandomState(seed=42).normal(size=(20, 4))
+        diagonal = np.diag((.3, .4, .5, .6))
+        correlated = diagonal + .1
+        for obsnoisecov in (diagonal, correlated):
+            jointfilter = self._makefilter(self.panelsystem, obsnoisecov=obsnoisecov, updatestrategy=UpdateStrategy.joint)
+            sequentialfilter = self._makefilter(self.panelsystem, obsnoisecov=obsnoisecov, updatestrategy=UpdateStrategy.sequential)
+            for obs in observations:
+                jointfilter.predictAndObserve(obs)
+                sequentialfilter.predictAndObserve(obs)
+            npt.assert_almost_equal(sequentialfilter.state, jointfilter.state)
+            npt.assert_almost_equal(sequentialfilter.statecov, jointfilter.statecov)
+            npt.assert_almost_equal(sequentialfilter.loglikelihood, jointfilter.loglikelihood)
+            data = self._makefilter(self.panelsystem, obsnoisecov=obsnoisecov, updatestrategy=UpdateStrategy.sequential).filterseries(observations)
+            npt.assert_almost_equal(data.states[-1], np.ravel(jointfilter.state))
+            npt.assert_almost_equal(np.sum(data.loglikelihoods), jointfilter.loglikelihood)
+
+    def test_collapsed_update_matches_joint_update(self):
+        randomstate = np.random.RandomState(seed=42)
+        obsdim = 30
+        obsmap = randomstate.normal(size=(obsdim, 2))
+        observations = randomstate.normal(size=(10, obsdim))
+        observations[4, 7] = np.nan
+        for obsnoisecov in (np.diag(np.linspace(.1, 1., obsdim)), .2 * np.eye(obsdim) + .05):
+            def makefilter(updatestrategy):
+                return KalmanFilter(np.zeros(2), np.eye(2), .1 * np.eye(2), obsnoisecov, np.array(((.9, .1), (0., .8))), obsmap,
+                        obsoffset=np.linspace(-1., 1., obsdim), procnoisemap=np.eye(2), obsnoisemap=np.eye(obsdim), updatestrategy=updatestrategy)
+            jointfilter, collapsedfilter = makefilter(UpdateStrategy.joint), makefilter(UpdateStrategy.collapsed)
+            for obs in observations[:3]:
+                jointfilter.predictAndObserve(obs)
+                collapsedfilter.predictAndObserve(obs)
+                npt.assert_almost_equal(collapsedfilter.state, jointfilter.state)
+                npt.assert_almost_equal(collapsedfilter.statecov, jointfilter.statecov)
+                npt.assert_almost_equal(collapsedfilter.loglikelihood, jointfilter.loglikelihood)
+            jointdata = makefilter(UpdateStrategy.joint).filterseries(observations)
+            collapseddata = makefilter(UpdateStrategy.collapsed).filterseries(observations)
+            npt.assert_almost_equal(collapseddata.states, jointdata.states)
+            npt.assert_almost_equal(collapseddata.statecovs, jointdata.statecovs)
+            npt.assert_almost_equal(collapseddata.loglikelihoods, jointdata.loglikelihoods)
+
+    def test_sequential_update_skips_missing_components(self):
+        obs = np.array((.5, np.nan, -.3, 1.))
+        # The last covariance only correlates the missing component with another, so the components left are uncorrelated.
+        correlatedwithmissing = np.diag((.3, .4, .5, .6))
+        correlatedwithmissing[0,1] = correlatedwithmissing[1,0] = .1
+        for obsnoisecov in (np.diag((.3, .4, .5, .6)), np.diag((.3, .4, .5, .6)) + .1, correlatedwithmissing):
+            sequentialfilter = self._makefilter(self.panelsystem, obsnoisecov=obsnoisecov, updatestrategy=UpdateStrategy.sequential)
+            sequentialfilter.predictAndObserve(obs)
+            data = self._makefilter(self.panelsystem, obsnoisecov=obsnoisecov, updatestrategy=UpdateStrategy.sequential).filterseries(obs[np.newaxis,:])
+            keep = [0, 2, 3]
+            reducedfilter = KalmanFilter(np.zeros(2), np.eye(2), .1 * np.eye(2), obsnoisecov[np.ix_(keep, keep)], np.array(((.9, .1), (0., .8))),
+                    np.array(((1., 0.), (1., 1.), (0., 2.), (.5, -1.)))[keep], obsoffset=np.array((.1, 0., -.1, 0.))[keep],
+                    procnoisemap=np.eye(2), obsnoisemap=np.eye(3))
+            reducedfilter.predictAndObserve(obs[keep])
+            npt.assert_almost_equal(sequentialfilter.state, reducedfilter.state)
+            npt.assert_almost_equal(sequentialfilter.loglikelihood, reducedfilter.loglikelihood)
+            npt.assert_almost_equal(data.states[0], np.ravel(reducedfilter.state))
+            npt.assert_almost_equal(data.loglikelihoods[0], reducedfilter.loglikelihood)
+
 if __name__ == '__main__':
     unittest.main()
     
\ No newline at end of file
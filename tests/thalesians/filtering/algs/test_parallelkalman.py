@@ -0,0 +1,32 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.kalman import KalmanFilter
+from thalesians.filtering.lowlevel.parallelkalman import parallelfilterseries, parallelrtssmooth
+from thalesians.filtering.lowlevel.smoothing import rtssmooth
+
+class ParallelKalmanTest(unittest.TestCase):
+    def _makefilter(self):
+        return KalmanFilter(np.array((.5, -.2)), np.diag((.5, .3)), np.array(((.1, .02), (.02, .05))), np.diag((.2, .3)),
+                np.array(((.9, .1), (-.2, .7))), np.array(((1., 0.), (.5, 1.))), procoffset=np.array((.05, 0.)), obsoffset=np.array((0., -.1)))
+
+    def test_matches_sequential_filter_and_smoother(self):
+        observations = np.random.RandomState(seed=42).normal(size=(101, 2))
+        observations[3] = np.nan
+        observations[50, 1] = np.nan
+        observations[100] = np.nan
+        procmaps = np.array([((.9 + .05 * np.sin(t), .1), (-.2, .7)) for t in range(101)])
+        for workers, blocksize in ((None, 4096), (3, 8)):
+            expected = self._makefilter().filterseries(observations, procmaps=procmaps)
+            actual = parallelfilterseries(self._makefilter(), observations, procmaps=procmaps, workers=workers, blocksize=blocksize)
+            for field in expected._fields:
+                npt.assert_allclose(getattr(actual, field), getattr(expected, field), rtol=1e-8, atol=1e-10, err_msg=field)
+            expectedsmoothed = rtssmooth(expected, procmaps)
+            actualsmoothed = parallelrtssmooth(actual, procmaps, workers=workers, blocksize=blocksize)
+            for field in expectedsmoothed._fields:
+                npt.assert_allclose(getattr(actualsmoothed, field), getattr(expectedsmoothed, field), rtol=1e-8, atol=1e-10, err_msg=field)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.processes import IntegratedOrnsteinUhlenbeckProcess, MultivariateOrnsteinUhlenbeckProcess, \
+        MultivariateWienerProcess
+
+class ProcessesTest(unittest.TestCase):
+    def test_wiener_process(self):
+        process = MultivariateWienerProcess((.1, -.2), ((.04, .01), (.01, .09)))
+        npt.assert_almost_equal(process.kalmanprocmap(.5), np.eye(2))
+        npt.assert_almost_equal(process.kalmanprocnoisecov(.5), ((.02, .005), (.005, .045)))
+        npt.assert_almost_equal(process.kalmanprocoffset(.5), (.05, -.1))
+
+    def test_ornstein_uhlenbeck_process(self):
+        theta, mean, var, dt = 2., .3, .25, .7
+        process = MultivariateOrnsteinUhlenbeckProcess(theta, mean, var)
+        npt.assert_almost_equal(process.kalmanprocmap(dt), [[np.exp(-theta * dt)]])
+        npt.assert_almost_equal(process.kalmanprocnoisecov(dt), [[var * (1. - np.exp(-2. * theta * dt)) / (2. * theta)]])
+        npt.assert_almost_equal(process.kalmanprocoffset(dt), [mean * (1. - np.exp(-theta * dt))])
+
+    def test_discretisations_compose(self):
+        # Two steps of dt must give the same transition as one step of 2 * dt.
+        for process in (MultivariateOrnsteinUhlenbeckProcess(((1., .3), (-.2, .5)), (.1, -.4), ((.2, .05), (.05, .1))),
+                IntegratedOrnsteinUhlenbeckProcess(((1., .3), (-.2, .5)), (.1, -.4), ((.2, .05), (.05, .1)))):
+            one, two = process.discretise(.3), process.discretise(.6)
+            npt.assert_almost_equal(two.procmap, np.dot(one.procmap, one.procmap))
+            npt.assert_almost_equal(two.procnoisecov, np.dot(np.dot(one.procmap, one.procnoisecov), one.procmap.T) + one.procnoisecov)
+            npt.assert_almost_equal(two.procoffset, np.dot(one.procmap, one.procoffset) + one.procoffset)
+
+    def test_cache(self):
+        process = MultivariateOrnsteinUhlenbeckProcess(1., 0., 1., cachesize=2)
+        first = process.discretise(1.)
+        self.assertIs(process.discretise(1.), first)
+        process.discretise(2.)
+        process.discretise(1.)
+        process.discretise(3.)
+        self.assertIs(process.discretise(1.), first)
+        series = process.discretiseseries((1., 3., 1., .5))
+        npt.assert_almost_equal(series.procmap[:,0,0], np.exp(-np.array((1., 3., 1., .5))))
+        self.assertEqual(np.shape(series.procoffset), (4, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.kalman import KalmanFilter
+from thalesians.filtering.lowlevel.score import loglikelihoodandscore
+
+class ScoreTest(unittest.TestCase):
+    def test_score_matches_finite_differences(self):
+        observations = np.random.RandomState(seed=42).normal(size=(30, 2))
+        observations[7, 1] = np.nan
+        kalmanfilter = KalmanFilter(np.zeros(2), np.eye(2), procnoisecov=np.eye(2), obsnoisecov=np.eye(2),
+                procmap=np.eye(2), obsmap=np.array(((1., 0.), (.5, 1.))))
+
+        # params = (persistence, log process noise variance, log observation noise variance, loading, drift)
+        parameterisation = dict(
+                procmap=lambda p: (np.array(((p[0], .1), (0., p[0]))), np.array((((1., 0.), (0., 1.)),) + ((((0., 0.), (0., 0.)),) * 4))),
+                procnoisecov=lambda p: (np.exp(p[1]) * np.eye(2), np.array([np.zeros((2, 2)), np.exp(p[1]) * np.eye(2), np.zeros((2, 2)), np.zeros((2, 2)), np.zeros((2, 2))])),
+                obsnoisecov=lambda p: (np.exp(p[2]) * np.eye(2), np.array([np.zeros((2, 2)), np.zeros((2, 2)), np.exp(p[2]) * np.eye(2), np.zeros((2, 2)), np.zeros((2, 2))])),
+                obsmap=lambda p: (np.array(((1., 0.), (p[3], 1.))), np.array([np.zeros((2, 2))] * 3 + [((0., 0.), (1., 0.))] + [np.zeros((2, 2))])),
+                procoffset=lambda p: (np.array((p[4], 0.)), np.array([(0., 0.)] * 4 + [(1., 0.)])))
+        params = np.array((.7, np.log(.3), np.log(.2), .5, .1))
+
+        loglikelihood, score = loglikelihoodandscore(kalmanfilter, observations, params, parameterisation)
+        npt.assert_equal(kalmanfilter.loglikelihoodandscore(observations, params, parameterisation), (loglikelihood, score))
+
+        def reference(p):
+            kf = KalmanFilter(np.zeros(2), np.eye(2), procnoisecov=parameterisation['procnoisecov'](p)[0],
+                    obsnoisecov=parameterisation['obsnoisecov'](p)[0], procmap=parameterisation['procmap'](p)[0],
+                    obsmap=parameterisation['obsmap'](p)[0], procoffset=parameterisation['procoffset'](p)[0])
+            return np.sum(kf.filterseries(observations).loglikelihoods)
+
+        npt.assert_almost_equal(loglikelihood, reference(params))
+        epsilon = 1e-6
+        finitedifferences = [(reference(params + epsilon * e) - reference(params - epsilon * e)) / (2. * epsilon) for e in np.eye(len(params))]
+        npt.assert_allclose(score, finitedifferences, rtol=1e-5, atol=1e-6)
+
+if __name__ == '__main__':
+    unittest.main()
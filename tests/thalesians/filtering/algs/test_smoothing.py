@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.kalman import KalmanFilter
+from thalesians.filtering.lowlevel.smoothing import rtssmooth
+
+class RTSSmootherTest(unittest.TestCase):
+    def test_matches_joint_gaussian_conditioning(self):
+        procmap = np.array(((.9, .2), (-.1, .7)))
+        procnoisecov = np.array(((.2, .05), (.05, .1)))
+        obsmap = np.array(((1., .5),))
+        obsnoisecov = np.array(((.3,),))
+        initialstate = np.array((1., -1.))
+        initialstatecov = np.eye(2)
+        observations = np.random.RandomState(seed=42).normal(size=6)
+        observations[3] = np.nan
+        timecount = len(observations)
+
+        kf = KalmanFilter(initialstate, initialstatecov, procnoisecov, obsnoisecov, procmap, obsmap)
+        smoothed = rtssmooth(kf.filterseries(observations), procmap)
+
+        # The joint distribution of the states at times -1, 0, ..., timecount-1, each a linear map of the initial state and the
+        # process noises.
+        statecount = timecount + 1
+        means = [initialstate]
+        for t in range(timecount): means.append(np.dot(procmap, means[-1]))
+        mean = np.concatenate(means)
+        loadings = np.zeros((2 * statecount, 2 * statecount))
+        noisecovs = [initialstatecov] + [procnoisecov] * timecount
+        for i in range(statecount):
+            for j in range(i + 1):
+                loadings[2*i:2*i+2,2*j:2*j+2] = np.linalg.matrix_power(procmap, i - j)
+        noisecov = np.zeros((2 * statecount, 2 * statecount))
+        for j in range(statecount): noisecov[2*j:2*j+2,2*j:2*j+2] = noisecovs[j]
+        cov = np.dot(np.dot(loadings, noisecov), loadings.T)
+
+        observed = [t for t in range(timecount) if not np.isnan(observations[t])]
+        obsloadings = np.zeros((len(observed), 2 * statecount))
+        for k, t in enumerate(observed): obsloadings[k,2*(t+1):2*(t+1)+2] = obsmap
+        gain = np.dot(np.dot(cov, obsloadings.T), np.linalg.inv(np.dot(np.dot(obsloadings, cov), obsloadings.T) + obsnoisecov[0,0] * np.eye(len(observed))))
+        posteriormean = mean + np.dot(gain, observations[observed] - np.dot(obsloadings, mean))
+        posteriorcov = cov - np.dot(np.dot(gain, obsloadings), cov)
+
+        npt.assert_almost_equal(smoothed.initialstate, posteriormean[:2])
+        npt.assert_almost_equal(smoothed.initialstatecov, posteriorcov[:2,:2])
+        for t in range(timecount):
+            i = 2 * (t + 1)
+            npt.assert_almost_equal(smoothed.states[t], posteriormean[i:i+2])
+            npt.assert_almost_equal(smoothed.statecovs[t], posteriorcov[i:i+2,i:i+2])
+            npt.assert_almost_equal(smoothed.lagonecovs[t], posteriorcov[i:i+2,i-2:i])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.kalman import KalmanFilter
+from thalesians.filtering.lowlevel.sqrtkalman import cholupdate, SquareRootKalmanFilter
+
+class SquareRootKalmanFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.args = dict(state=np.zeros(2), statecov=np.eye(2), procnoisecov=np.array(((.2, .05), (.05, .1))),
+                obsnoisecov=np.diag((.3, .4)), procmap=np.array(((.9, .1), (0., .8))), obsmap=np.array(((1., 0.), (1., 1.))),
+                procoffset=np.array((.1, 0.)), procnoisemap=np.eye(2), obsnoisemap=np.eye(2))
+        self.observations = np.random.RandomState(seed=42).normal(size=(30, 2))
+
+    def test_matches_kalman_filter(self):
+        kf = KalmanFilter(**self.args)
+        srkf = SquareRootKalmanFilter(**self.args)
+        for obs in self.observations:
+            kf.predictAndObserve(obs)
+            srkf.predictAndObserve(obs)
+            npt.assert_almost_equal(srkf.state, kf.state)
+            npt.assert_almost_equal(srkf.statecov, kf.statecov)
+            npt.assert_almost_equal(srkf.gain, kf.gain)
+            npt.assert_almost_equal(srkf.innovcov, kf.innovcov)
+        npt.assert_almost_equal(srkf.loglikelihood, kf.loglikelihood)
+
+    def test_single_precision(self):
+        kf = KalmanFilter(**self.args)
+        srkf = SquareRootKalmanFilter(dtype=np.float32, **self.args)
+        for obs in self.observations:
+            kf.predictAndObserve(obs)
+            srkf.predictAndObserve(obs)
+        self.assertEqual(srkf.state.dtype, np.float32)
+        self.assertEqual(srkf.statecovsqrt.dtype, np.float32)
+        npt.assert_allclose(srkf.state, kf.state, rtol=1e-4, atol=1e-5)
+        npt.assert_allclose(srkf.statecov, kf.statecov, rtol=1e-4, atol=1e-5)
+        self.assertTrue(np.all(np.linalg.eigvalsh(srkf.statecov) > 0.))
+
+    def test_cholupdate(self):
+        a = np.array(((4., 1., .5), (1., 3., .2), (.5, .2, 2.)))
+        u = np.array((.3, -.5, .8))
+        factor = np.linalg.cholesky(a)
+        npt.assert_almost_equal(cholupdate(factor, u), np.linalg.cholesky(a + np.outer(u, u)))
+        npt.assert_almost_equal(cholupdate(factor, u, downdate=True), np.linalg.cholesky(a - np.outer(u, u)))
+        self.assertRaises(np.linalg.LinAlgError, cholupdate, factor, 3. * u, True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import warnings
+
+import numpy as np
+import numpy.testing as npt
+
+from thalesians.filtering.lowlevel.kalman import KalmanFilter, UpdateStrategy
+from thalesians.filtering.lowlevel.unscented import sigmaPointWeights, sigmaPoints, unscentedTransform, UnscentedKalmanFilter, \
+        SquareRootUnscentedKalmanFilter
+import thalesians.maths.numpyutils as npu
+
+class UnscentedKalmanFilterTest(unittest.TestCase):
+    def test_matches_kalman_filter_on_linear_system(self):
+        procmap = np.array([[.9, .1], [-.2, .8]])
+        obsmap = np.array([[1., .5], [0., 1.], [.3, -.4]])
+        procnoisecov = np.array([[.2, .05], [.05, .1]])
+        obsnoisecov = np.diag([.3, .2, .4])
+        state, statecov = np.array([1., -1.]), np.array([[1., .2], [.2, .5]])
+
+        calls = [0]
+        def h(x, v):
+            calls[0] += 1
+            return np.dot(obsmap, x) + v
+
+        ukf = UnscentedKalmanFilter(state, statecov, procnoisecov, obsnoisecov, np.zeros((2, 3)), lambda x, w: np.dot(procmap, x) + w, h)
+        kf = KalmanFilter(state, statecov, procnoisecov, obsnoisecov, procmap, obsmap, procnoisemap=np.eye(2), obsnoisemap=np.eye(3),
+                updatestrategy=UpdateStrategy.sequential)
+        observations = np.random.RandomState(seed=42).normal(size=(20, 3))
+        observations[5, 1] = np.nan
+        observations[9, :] = np.nan
+        # The sequential update, like the unscented filter, leaves out NaN components rather than whole observations.
+        expected = kf.filterseries(observations)
+        for t, obs in enumerate(observations):
+            ukf.predictAndObserve(obs)
+            npt.assert_almost_equal(ukf.state[:,0], expected.states[t])
+            npt.assert_almost_equal(ukf.statecov, expected.statecovs[t])
+        npt.assert_almost_equal(ukf.loglikelihood, kf.loglikelihood)
+        self.assertEqual(calls[0], 19)
+
+    def test_correlated_noises(self):
+        # With x_t = x_{t-1} + w_t and y_t = x_t + v_t, the correlation of the noises only enters through cov(x_t, v_t) = cor.
+        ukf = UnscentedKalmanFilter(0., 1., 1., 1., .5, lambda x, w: x + w, lambda x, v: x + v)
+        ukf.predict()
+        ukf.observe(1.)
+        npt.assert_almost_equal(ukf.innovcov, [[2. + 1. + 2. * .5]])
+        npt.assert_almost_equal(ukf.gain, [[2.5 / 4.]])
+        npt.assert_almost_equal(ukf.state, [[2.5 / 4.]])
+        npt.assert_almost_equal(ukf.statecov, [[2. - 2.5 * 2.5 / 4.]])
+
+    def test_square_root_filter_matches_unscented_kalman_filter(self):
+        # A stochastic volatility model with leverage: the log-variance x follows an AR(1) and the observation is v * exp(x / 2).
+        f = lambda x, w: -.2 + .95 * x + .3 * w
+        h = lambda x, v: v * np.exp(.5 * x)
+        ukf = UnscentedKalmanFilter(-4., .5, 1., 1., -.7, f, h)
+        srukf = SquareRootUnscentedKalmanFilter(-4., .5, 1., 1., -.7, f, h)
+        observations = .1 * np.random.RandomState(seed=42).normal(size=50)
+        observations[17] = np.nan
+        for obs in observations:
+            ukf.predictAndObserve(obs)
+            srukf.predictAndObserve(obs)
+            npt.assert_almost_equal(srukf.state, ukf.state)
+            npt.assert_almost_equal(srukf.statecov, ukf.statecov)
+        npt.assert_almost_equal(srukf.innovcov, ukf.innovcov)
+        npt.assert_almost_equal(srukf.gain, ukf.gain)
+        npt.assert_almost_equal(srukf.loglikelihood, ukf.loglikelihood)
+        npt.assert_almost_equal(np.triu(srukf.statecovsqrt, 1), 0.)
+
+    def test_square_root_filter_falls_back_when_a_downdate_fails(self):
+        # With nearly noise-free observations of strongly correlated components, rounding makes the rank-one downdates fail.
+        statecov, obs = np.array([[1., .999999], [.999999, 1.]]), np.array([1., 2.])
+        srukf = SquareRootUnscentedKalmanFilter(np.zeros(2), statecov, 1e-30 * np.eye(2), 1e-16 * np.eye(2), np.zeros((2, 2)),
+                lambda x, w: x + w, lambda x, v: x + v)
+        srukf.predict()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            srukf.observe(obs)
+        self.assertEqual(len(caught), 1)
+        npt.assert_almost_equal(srukf.state[:,0], obs)
+        npt.assert_almost_equal(np.dot(srukf.statecovsqrt, srukf.statecovsqrt.T), srukf.statecov)
+        self.assertTrue(np.all(np.isfinite(srukf.statecovsqrt)))
+        npt.assert_almost_equal(srukf.statecov, 0.)
+
+    def test_sigma_points(self):
+        x, P = np.array([.5, -1., 2.]), np.array([[1., .3, 0.], [.3, .5, .1], [0., .1, .2]])
+        X, Wm, Wc = sigmaPoints(x, P, alef=3.)
+        sqrtP = np.linalg.cholesky(3. * P)
+        npt.assert_almost_equal(X[:,0], x)
+        npt.assert_almost_equal(X[:,1:4], x[:,np.newaxis] + sqrtP)
+        npt.assert_almost_equal(X[:,4:], x[:,np.newaxis] - sqrtP)
+        npt.assert_almost_equal(Wm, [0.] + [1. / 6.] * 6)
+        npt.assert_almost_equal(np.dot((X - x[:,np.newaxis]) * Wc, (X - x[:,np.newaxis]).T), P)
+        self.assertIs(sigmaPointWeights(3, 3.)[0], Wm)
+
+        npt.assert_almost_equal(sigmaPoints(x[:,np.newaxis], None, sqrtP=np.linalg.cholesky(P))[0], X)
+
+        xs = np.array([x, 2. * x])
+        Ps = np.array([P, .5 * P])
+        Xs, _, _ = sigmaPoints(xs, Ps)
+        for i in range(2):
+            npt.assert_almost_equal(Xs[i], sigmaPoints(xs[i], Ps[i])[0])
+        f = npu.vectorised(lambda X: np.exp(X[...,:2,:]))
+        Ys, Ymeans, Ycovs = unscentedTransform(Xs, Wm, Wc, f)
+        for i in range(2):
+            Y, Ymean, Ycov = unscentedTransform(sigmaPoints(xs[i], Ps[i])[0], Wm, Wc, f)
+            npt.assert_almost_equal(Ymeans[i], Ymean)
+            npt.assert_almost_equal(Ycovs[i], Ycov)
+
+    def test_unscented_transform_vectorised_and_columnwise_agree(self):
+        X, Wm, Wc = sigmaPoints(np.array([.5, -1.]), np.array([[1., .3], [.3, .5]]))
+        columnwise = unscentedTransform(X, Wm, Wc, lambda col: np.array([np.sin(col[0]) * col[1], np.exp(col[1])]))
+        vectorised = unscentedTransform(X, Wm, Wc, npu.vectorised(lambda X: np.vstack((np.sin(X[0]) * X[1], np.exp(X[1])))))
+        for expected, actual in zip(columnwise, vectorised):
+            npt.assert_almost_equal(actual, expected)
+
+if __name__ == '__main__':
+    unittest.main()
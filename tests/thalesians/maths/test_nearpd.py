@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+import numpy.testing as npt
+
+import thalesians.maths.nearpd as nearpd
+
+class NearPDTest(unittest.TestCase):
+    def setUp(self):
+        # An indefinite "correlation matrix", as from pairwise estimates.
+        self.a = np.array(((1., .9, .7), (.9, 1., -.4), (.7, -.4, 1.)))
+
+    def test_nearpd(self):
+        result = nearpd.nearpd(self.a)
+        eigvals, eigvecs = np.linalg.eigh(self.a)
+        npt.assert_almost_equal(result, np.dot(eigvecs * np.maximum(eigvals, 0.), eigvecs.T))
+        self.assertTrue(np.all(np.linalg.eigvalsh(result) > 0.))
+
+        result = nearpd.nearpd(self.a, keepdiag=True)
+        npt.assert_almost_equal(np.diagonal(result), 1.)
+        self.assertTrue(np.min(np.linalg.eigvalsh(result)) > -1e-8)
+        # Higham's example: the nearest correlation matrix to [[2, -1, 0, 0], [-1, 2, -1, 0], [0, -1, 2, -1], [0, 0, -1, 2]] with
+        # its diagonal replaced by ones.
+        a = np.eye(4) - np.diag(np.ones(3), 1) - np.diag(np.ones(3), -1)
+        result = nearpd.nearpd(a, keepdiag=True, tol=1e-12, maxiter=1000)
+        npt.assert_almost_equal(result, ((1., -.8084, .1916, .1068), (-.8084, 1., -.6562, .1916), (.1916, -.6562, 1., -.8084),
+                (.1068, .1916, -.8084, 1.)), decimal=4)
+
+        stack = np.array((self.a, np.eye(3), 2. * self.a))
+        result = nearpd.nearpd(stack, keepdiag=True)
+        for i in range(3):
+            npt.assert_almost_equal(result[i], nearpd.nearpd(stack[i], keepdiag=True))
+
+    def test_repairedcholesky(self):
+        good = np.array(((2., .5, 0.), (.5, 1., .2), (0., .2, 3.)))
+        npt.assert_almost_equal(nearpd.repairedcholesky(good), np.linalg.cholesky(good))
+        for strategy in nearpd.RepairStrategy:
+            factor = nearpd.repairedcholesky(self.a, strategy)
+            npt.assert_almost_equal(np.triu(factor, 1), 0.)
+            npt.assert_almost_equal(np.dot(factor, factor.T), nearpd.nearpd(self.a), decimal=3)
+
+            stack = np.array((good, self.a))
+            factors = nearpd.repairedcholesky(stack, strategy)
+            npt.assert_almost_equal(factors[0], np.linalg.cholesky(good))
+            npt.assert_almost_equal(factors[1], factor)
+
+        # A singular matrix needs only a little jitter.
+        singular = np.ones((2, 2))
+        factor = nearpd.repairedcholesky(singular, nearpd.RepairStrategy.jitter)
+        npt.assert_almost_equal(np.dot(factor, factor.T), singular)
+
+if __name__ == '__main__':
+    unittest.main()